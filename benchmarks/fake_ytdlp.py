@@ -0,0 +1,104 @@
+"""Stand-in for yt_dlp.YoutubeDL that serves every video from the local FixtureServer.
+
+It follows the parts of the yt-dlp API the bot uses (extract_info, sanitize_info,
+process_ie_result, download, progress and postprocessor hooks), so the real format
+planning, download and upload code runs without network access.
+"""
+import copy
+import os
+import re
+import shutil
+import time
+
+import requests
+
+
+class FakeYoutubeDL:
+    base_url = ""
+    video_size = 0
+    # Время "разбора страницы" в extract_info (секунды)
+    extract_delay = 0.05
+    # True - лучший формат уже склеен (mp4 с аудио), False - нужна склейка видео и аудио
+    progressive = False
+
+    def __init__(self, params: dict = None):
+        self.params = params or {}
+
+    def __enter__(self) -> "FakeYoutubeDL":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+    def _info(self, url: str) -> dict:
+        match = re.search(r"(?:v=|youtu\.be/|/shorts/|/status/|/video/|/reel/)([\w-]+)", url)
+        video_id = match.group(1) if match else "video"
+        video_size = self.video_size
+        formats = [
+            {"format_id": "18", "ext": "mp4", "vcodec": "avc1", "acodec": "mp4a", "height": 360,
+             "protocol": "http", "filesize": video_size, "url": f"{self.base_url}/video.mp4?f=18&id={video_id}"},
+            {"format_id": "140", "ext": "m4a", "vcodec": "none", "acodec": "mp4a", "abr": 128,
+             "protocol": "http", "filesize": video_size // 8, "url": f"{self.base_url}/video.mp4?f=140&id={video_id}"},
+            {"format_id": "137", "ext": "mp4", "vcodec": "avc1", "acodec": "none", "height": 1080,
+             "protocol": "http", "filesize": video_size, "url": f"{self.base_url}/video.mp4?f=137&id={video_id}"},
+        ]
+        if self.progressive:
+            formats[0]["height"] = 1080
+        return {"id": video_id, "webpage_url": url, "duration": 60, "is_live": False, "formats": formats}
+
+    def extract_info(self, url: str, download: bool = True) -> dict:
+        time.sleep(self.extract_delay)
+        info = self._info(url)
+        if download:
+            self.process_ie_result(info, download=True)
+        return info
+
+    @staticmethod
+    def sanitize_info(info: dict) -> dict:
+        return copy.deepcopy(info)
+
+    def _fetch(self, fmt: dict, filename: str) -> None:
+        downloaded = 0
+        with requests.get(fmt["url"], stream=True, timeout=20) as response:
+            response.raise_for_status()
+            total = int(response.headers.get("Content-Length") or 0) or None
+            with open(filename, "wb") as file:
+                for chunk in response.iter_content(chunk_size=65536):
+                    file.write(chunk)
+                    downloaded += len(chunk)
+                    for hook in self.params.get("progress_hooks", []):
+                        hook({"status": "downloading", "downloaded_bytes": downloaded, "total_bytes": total})
+        for hook in self.params.get("progress_hooks", []):
+            hook({"status": "finished", "downloaded_bytes": downloaded, "total_bytes": total})
+
+    def process_ie_result(self, info: dict, download: bool = True) -> dict:
+        if not download:
+            return info
+        formats = {fmt["format_id"]: fmt for fmt in info["formats"]}
+        spec = self.params.get("format", "")
+        requested = [formats[part] for part in spec.split("+") if part in formats] or [formats["18"]]
+        output = self.params.get("outtmpl", f"{info['id']}.mp4")
+        if len(requested) == 1:
+            self._fetch(requested[0], output)
+            return info
+
+        parts = [f"{output}.f{fmt['format_id']}" for fmt in requested]
+        for fmt, part in zip(requested, parts):
+            self._fetch(fmt, part)
+        hooks = self.params.get("postprocessor_hooks", [])
+        for hook in hooks:
+            hook({"status": "started", "postprocessor": "Merger", "info_dict": info})
+        # Вместо ffmpeg просто склеиваем байты: важен только порядок операций с диском
+        with open(output, "wb") as merged:
+            for part in parts:
+                with open(part, "rb") as source:
+                    shutil.copyfileobj(source, merged)
+                os.remove(part)
+        for hook in hooks:
+            hook({"status": "finished", "postprocessor": "Merger", "info_dict": info})
+        return info
+
+    def download(self, urls: list) -> int:
+        for url in urls:
+            self.extract_info(url, download=True)
+        return 0
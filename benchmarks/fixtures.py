@@ -0,0 +1,104 @@
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, urlunsplit
+
+from requests.adapters import HTTPAdapter
+
+# Страница, похожая на пин Pinterest: og:image в <head>, затем тяжелое тело со скриптами
+PIN_HEAD = (
+    '<!DOCTYPE html><html><head><meta charset="utf-8"><title>Pin</title>'
+    '<meta property="og:title" content="Pin">'
+    '<meta property="og:image" content="{image_url}">'
+    '</head><body>'
+)
+PIN_BODY_FILLER = '<script>window.__PWS_DATA__ = {"props": "' + "x" * 1024 + '"};</script>\n'
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+    """Does not print tracebacks when a client drops a keep-alive connection."""
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            return  # Клиент закрыл соединение посреди запроса - для нагрузочного теста это норма
+        super().handle_error(request, client_address)
+
+
+class FixtureServer:
+    """Local keep-alive HTTP server with Pinterest-like pages and media files."""
+
+    def __init__(self, page_body_kb: int = 512, image_kb: int = 256, video_kb: int = 2048):
+        self.page_body_kb = page_body_kb
+        self.image = b"\x89PNG\r\n\x1a\n" + b"\0" * (image_kb * 1024)
+        self.video = b"\0\0\0\x18ftypmp42" + b"\0" * (video_kb * 1024)
+        self._server = QuietHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def pin_page(self) -> bytes:
+        head = PIN_HEAD.format(image_url=f"{self.base_url}/image.png")
+        return (head + PIN_BODY_FILLER * self.page_body_kb + "</body></html>").encode()
+
+    def _handler_class(self):
+        fixture = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                self._respond(send_body=True)
+
+            def do_HEAD(self):
+                self._respond(send_body=False)
+
+            def _respond(self, send_body: bool):
+                if self.path.startswith("/pin/"):
+                    body, content_type = fixture.pin_page(), "text/html; charset=utf-8"
+                elif self.path.startswith("/image"):
+                    body, content_type = fixture.image, "image/png"
+                elif self.path.startswith("/video"):
+                    body, content_type = fixture.video, "video/mp4"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if not send_body:
+                    return
+                try:
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # Клиент закрыл соединение, прочитав нужное
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self) -> "FixtureServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class LocalRedirectAdapter(HTTPAdapter):
+    """requests adapter that sends requests for a real site (e.g. pinterest.com) to a local server."""
+
+    def __init__(self, base_url: str, **kwargs):
+        super().__init__(**kwargs)
+        self.base = urlsplit(base_url)
+
+    def send(self, request, **kwargs):
+        parts = urlsplit(request.url)
+        request.url = urlunsplit((self.base.scheme, self.base.netloc, parts.path, parts.query, parts.fragment))
+        return super().send(request, **kwargs)
@@ -0,0 +1,227 @@
+"""Offline load test: synthetic users send links to the real handlers, Telegram and the media sites are local fakes.
+
+Run from the repository root:
+    python -m benchmarks.load_test --users 20 --links 5 --output result.json
+
+The result is JSON (throughput, end-to-end latency percentiles, event loop lag, peak RSS,
+Bot API calls), so runs on two commits can be compared directly.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Optional
+
+from benchmarks.fake_ytdlp import FakeYoutubeDL
+from benchmarks.fixtures import FixtureServer, LocalRedirectAdapter
+from benchmarks.telegram_stub import TelegramStub
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BOT_TOKEN = "123456:BENCHMARK-TOKEN"
+# Период проверки задержки цикла событий (секунды)
+LAG_PROBE_INTERVAL = 0.01
+
+
+def percentile(values: list[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q * len(ordered))) - 1))]
+
+
+def summarize_ms(values: list[float]) -> dict:
+    return {
+        "mean": round(statistics.mean(values) * 1000, 2) if values else None,
+        "p50": round(percentile(values, 0.50) * 1000, 2) if values else None,
+        "p95": round(percentile(values, 0.95) * 1000, 2) if values else None,
+        "p99": round(percentile(values, 0.99) * 1000, 2) if values else None,
+        "max": round(max(values) * 1000, 2) if values else None,
+    }
+
+
+def peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдает килобайты, macOS - байты
+    return round(peak / 1024 / (1024 if sys.platform == "darwin" else 1), 1)
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+                              ).stdout.strip()
+    except Exception:
+        return None
+
+
+def make_links(user_number: int, count: int, pinterest_share: float, duplicate_share: float,
+               rng: random.Random) -> list[str]:
+    links = []
+    for index in range(count):
+        if rng.random() < duplicate_share:
+            # Популярная ссылка, которую присылают многие - проверяет объединение загрузок и кэш
+            number = rng.randrange(3)
+            video_id, pin_id = f"shared{number:05d}", 900000 + number
+        else:
+            video_id, pin_id = f"u{user_number:04d}l{index:05d}", user_number * 100000 + index
+        if rng.random() < pinterest_share:
+            links.append(f"https://www.pinterest.com/pin/{pin_id}/")
+        else:
+            links.append(f"https://www.youtube.com/watch?v={video_id}")
+    return links
+
+
+async def monitor_loop_lag(samples: list[float]) -> None:
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(LAG_PROBE_INTERVAL)
+        samples.append(max(0.0, time.perf_counter() - started - LAG_PROBE_INTERVAL))
+
+
+async def run_user(dp, bot, user_number: int, links: list[str], think_time: float, update_ids,
+                   latencies: list[float], errors: list[str]) -> None:
+    user_id = 1000 + user_number
+    for message_id, link in enumerate(links, start=1):
+        update = {
+            "update_id": next(update_ids),
+            "message": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_number}"},
+                "text": link,
+            },
+        }
+        started = time.perf_counter()
+        try:
+            await dp.feed_raw_update(bot, update)
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+        latencies.append(time.perf_counter() - started)
+        if think_time:
+            await asyncio.sleep(think_time)
+
+
+async def run_load(args: argparse.Namespace, server: FixtureServer, telegram: TelegramStub) -> dict:
+    from aiogram import Dispatcher
+
+    from handlers import downloader, router
+    from handlers.botapi import create_bot
+    from handlers.executor import download_executor
+    from handlers.http import get_session
+
+    FakeYoutubeDL.base_url = server.base_url
+    FakeYoutubeDL.video_size = len(server.video)
+    FakeYoutubeDL.extract_delay = args.extract_ms / 1000
+    FakeYoutubeDL.progressive = args.progressive
+    downloader.yt_dlp.YoutubeDL = FakeYoutubeDL
+    get_session().mount("https://www.pinterest.com/", LocalRedirectAdapter(server.base_url))
+
+    bot = create_bot(BOT_TOKEN)
+    dp = Dispatcher()
+    dp.include_router(router)
+
+    rng = random.Random(args.seed)
+    users = [make_links(number, args.links, args.pinterest_share, args.duplicate_share, rng)
+             for number in range(args.users)]
+    latencies: list[float] = []
+    errors: list[str] = []
+    lag_samples: list[float] = []
+    update_ids = itertools.count(1)
+
+    lag_task = asyncio.create_task(monitor_loop_lag(lag_samples))
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(run_user(dp, bot, number, links, args.think_ms / 1000, update_ids, latencies, errors)
+                               for number, links in enumerate(users)))
+    finally:
+        elapsed = time.perf_counter() - started
+        lag_task.cancel()
+        download_executor.shutdown(wait=True)
+        await bot.session.close()
+
+    total_links = sum(len(links) for links in users)
+    return {
+        "links": total_links,
+        "failed": telegram.error_edits + len(errors),
+        "duration_s": round(elapsed, 3),
+        "throughput_links_per_s": round(total_links / elapsed, 2) if elapsed else None,
+        "latency_ms": summarize_ms(latencies),
+        "loop_lag_ms": summarize_ms(lag_samples),
+        "peak_rss_mb": peak_rss_mb(),
+        "telegram": {
+            "calls": dict(sorted(telegram.calls.items())),
+            "uploaded_mb": round(telegram.uploaded_bytes / 1024 / 1024, 2),
+            "sent_by_path_mb": round(telegram.local_file_bytes / 1024 / 1024, 2),
+        },
+        "errors": errors[:10],
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=20, help="сколько пользователей одновременно")
+    parser.add_argument("--links", type=int, default=5, help="сколько ссылок присылает каждый пользователь")
+    parser.add_argument("--pinterest-share", type=float, default=0.3, help="доля ссылок Pinterest")
+    parser.add_argument("--duplicate-share", type=float, default=0.0,
+                        help="доля одинаковых популярных ссылок (объединение загрузок и кэш file_id)")
+    parser.add_argument("--video-kb", type=int, default=2048, help="размер тестового видео")
+    parser.add_argument("--image-kb", type=int, default=256, help="размер тестовой картинки")
+    parser.add_argument("--extract-ms", type=float, default=50, help="время extract_info в фейковом yt-dlp")
+    parser.add_argument("--progressive", action="store_true", help="видео без склейки (поток в Telegram)")
+    parser.add_argument("--telegram-latency-ms", type=float, default=20, help="задержка ответа Bot API")
+    parser.add_argument("--local-api", action="store_true",
+                        help="как локальный сервер Bot API (--local): файлы отправляются путем")
+    parser.add_argument("--think-ms", type=float, default=0, help="пауза пользователя между ссылками")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="куда записать JSON (по умолчанию stdout)")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    output = os.path.abspath(args.output) if args.output else None
+    workdir = tempfile.mkdtemp(prefix="bot-bench-")
+    # Настройки читаются при импорте handlers, поэтому задаются до него.
+    # Без администратора и лимита ссылок, все временные файлы - во временной папке.
+    # Пул только потоковый: подмена yt-dlp не попадает в дочерние процессы.
+    os.environ.update({
+        "ADMIN_ID": "",
+        "DOWNLOAD_POOL": "thread",
+        "JOB_QUEUE": "",
+        "USER_RATE_PER_MINUTE": "0",
+        "FILE_ID_CACHE_PATH": os.path.join(workdir, "file_id_cache.sqlite3"),
+        "SPOTIFY_OUTPUT_DIR": os.path.join(workdir, "spotify"),
+    })
+    os.chdir(workdir)
+
+    with FixtureServer(image_kb=args.image_kb, video_kb=args.video_kb) as server, \
+            TelegramStub(latency=args.telegram_latency_ms / 1000) as telegram:
+        # Бот ходит в заглушку так же, как в собственный сервер Bot API
+        os.environ["TELEGRAM_API_URL"] = telegram.base_url
+        os.environ["TELEGRAM_API_LOCAL"] = "1" if args.local_api else "0"
+        results = asyncio.run(run_load(args, server, telegram))
+
+    report = {"commit": git_commit(), "params": vars(args), **results}
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if output:
+        with open(output, "w", encoding="utf-8") as file:
+            file.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Compare the old Pinterest path (new connection + full bs4 parse) with the pooled streaming one.
+
+Run from the repository root: python -m benchmarks.pinterest_og_image [iterations]
+"""
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import requests
+
+from benchmarks.fixtures import FixtureServer
+from handlers.downloader import Downloader
+
+
+def legacy_download(url: str, output_filename: str) -> None:
+    import bs4  # Только для сравнения со старым вариантом
+
+    response = requests.get(url, headers=Downloader.HEADERS, timeout=10)
+    response.raise_for_status()
+    soup = bs4.BeautifulSoup(response.content, "html.parser")
+    img_url = soup.find("meta", property="og:image")["content"]
+    with requests.get(img_url, stream=True, headers=Downloader.HEADERS, timeout=20) as r:
+        r.raise_for_status()
+        with open(output_filename, "wb") as file:
+            for chunk in r.iter_content(chunk_size=8192):
+                file.write(chunk)
+
+
+def measure(func, url: str, iterations: int) -> dict:
+    timings = []
+    with tempfile.TemporaryDirectory() as tmp:
+        output_filename = os.path.join(tmp, "pin.png")
+        for _ in range(iterations):
+            started = time.perf_counter()
+            func(url, output_filename)
+            timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        "mean_ms": round(statistics.mean(timings), 3),
+        "p50_ms": round(timings[len(timings) // 2], 3),
+        "p95_ms": round(timings[int(len(timings) * 0.95) - 1], 3),
+    }
+
+
+def main() -> None:
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    with FixtureServer() as server:
+        url = f"{server.base_url}/pin/1"
+        results = {
+            "iterations": iterations,
+            "page_bytes": len(server.pin_page()),
+            "pooled_streaming": measure(Downloader().download_pinterest_image, url, iterations),
+        }
+        try:
+            results["legacy_bs4"] = measure(legacy_download, url, iterations)
+        except ImportError:
+            results["legacy_bs4"] = "bs4 не установлен"
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
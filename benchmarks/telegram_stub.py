@@ -0,0 +1,113 @@
+import asyncio
+import itertools
+import threading
+import time
+from collections import Counter
+from typing import Optional
+from urllib.parse import unquote, urlsplit
+
+from aiohttp import web
+
+# Какое поле сообщения заполняет ответ на каждый метод отправки файла
+MEDIA_FIELDS = {
+    "sendVideo": "video",
+    "sendAnimation": "animation",
+    "sendAudio": "audio",
+    "sendPhoto": "photo",
+    "sendDocument": "document",
+}
+
+
+class TelegramStub:
+    """Local fake of the Bot API: accepts uploads and edits and answers like Telegram would.
+
+    Runs its own event loop in a thread, so its work does not show up in the bot's loop lag.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self.uploaded_bytes = 0
+        # Файлы, отправленные путем (file://), как их читает telegram-bot-api в режиме --local
+        self.local_file_bytes = 0
+        self.error_edits = 0
+        self._message_ids = itertools.count(1)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._runner: Optional[web.AppRunner] = None
+        self._started = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self.port = 0
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def _message(self, chat_id, text: Optional[str] = None) -> dict:
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id or 0), "type": "private"},
+        }
+        if text is not None:
+            message["text"] = text
+        return message
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        form = await request.post()
+        for value in form.values():
+            if isinstance(value, web.FileField):
+                self.uploaded_bytes += len(value.file.read())
+            elif isinstance(value, str) and value.startswith("file://"):
+                with open(unquote(urlsplit(value).path), "rb") as file:
+                    self.local_file_bytes += len(file.read())
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        elif method in ("deleteMessage", "deleteWebhook", "setWebhook"):
+            result = True
+        elif method in ("sendMessage", "editMessageText"):
+            text = form.get("text", "")
+            if method == "editMessageText" and str(text).startswith("⚠️"):
+                self.error_edits += 1
+            result = self._message(form.get("chat_id"), str(text))
+        elif method in MEDIA_FIELDS:
+            result = self._message(form.get("chat_id"))
+            number = result["message_id"]
+            file = {"file_id": f"file-{number}", "file_unique_id": f"unique-{number}"}
+            field = MEDIA_FIELDS[method]
+            if field in ("video", "animation"):
+                file.update(width=1280, height=720, duration=1)
+            elif field == "audio":
+                file.update(duration=1)
+            result[field] = [{**file, "width": 1280, "height": 720}] if field == "photo" else file
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    def _run(self) -> None:
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        app = web.Application(client_max_size=2 * 1024 ** 3)
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        self._loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        self._loop.run_until_complete(site.start())
+        self.port = site._server.sockets[0].getsockname()[1]
+        self._started.set()
+        self._loop.run_forever()
+        self._loop.run_until_complete(self._runner.cleanup())
+        self._loop.close()
+
+    def __enter__(self) -> "TelegramStub":
+        self._thread.start()
+        self._started.wait()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
@@ -0,0 +1,22 @@
+import logging
+
+from aiogram import Bot
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+from handlers import config
+
+logger = logging.getLogger(__name__)
+
+
+def create_bot(token: str) -> Bot:
+    """Create the Bot for the public Bot API or for the server in TELEGRAM_API_URL."""
+    session = None
+    if config.TELEGRAM_API_URL:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(config.TELEGRAM_API_URL,
+                                                                 is_local=config.TELEGRAM_API_LOCAL))
+        logger.info(f"Используется сервер Bot API {config.TELEGRAM_API_URL} "
+                    f"({'локальный режим, файлы отправляются путем' if config.TELEGRAM_API_LOCAL else 'обычный режим'}), "
+                    f"лимит файла {config.MAX_UPLOAD_BYTES // 1024 // 1024} МБ")
+    return Bot(token=token, session=session, default=DefaultBotProperties(parse_mode="HTML"))
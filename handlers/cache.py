@@ -0,0 +1,135 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from aiogram import types
+
+from handlers import config
+
+logger = logging.getLogger(__name__)
+
+
+class FileIdCache:
+    """Persistent map from a canonical content key to a Telegram file_id, with TTL and LRU eviction."""
+
+    def __init__(self, path: str, ttl_seconds: float, max_entries: int):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS file_ids ("
+            " key TEXT PRIMARY KEY,"
+            " file_type TEXT NOT NULL,"
+            " file_id TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS file_ids_last_used ON file_ids (last_used)")
+
+    def get(self, key: str) -> Optional[tuple[str, str]]:
+        """Return (file_type, file_id) for the key, or None if missing or expired."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT file_type, file_id, created_at FROM file_ids WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            file_type, file_id, created_at = row
+            if now - created_at > self.ttl_seconds:
+                self._conn.execute("DELETE FROM file_ids WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE file_ids SET last_used = ? WHERE key = ?", (now, key))
+        return file_type, file_id
+
+    def put(self, key: str, file_type: str, file_id: str) -> None:
+        """Store the file_id and evict the least recently used entries over the limit."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO file_ids (key, file_type, file_id, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?)", (key, file_type, file_id, now, now))
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM file_ids").fetchone()
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM file_ids WHERE key IN "
+                    "(SELECT key FROM file_ids ORDER BY last_used LIMIT ?)", (count - self.max_entries,))
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM file_ids WHERE key = ?", (key,))
+
+
+class TTLCache:
+    """Small thread-safe in-memory cache with per-entry TTL and LRU eviction."""
+
+    def __init__(self, ttl_seconds: float, max_entries: int = 1024):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if time.monotonic() > expires_at:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: Any, ttl_seconds: Optional[float] = None) -> None:
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def file_ref_from_message(sent: types.Message) -> Optional[tuple[str, str]]:
+    """Extract (file_type, file_id) from a message returned by answer_video/audio/photo.
+
+    Telegram may store an mp4 as an animation or a document, so the returned type is the
+    one to use for re-sending, not necessarily the one the file was uploaded with.
+    """
+    if sent.video:
+        return "video", sent.video.file_id
+    if sent.animation:
+        return "animation", sent.animation.file_id
+    if sent.audio:
+        return "audio", sent.audio.file_id
+    if sent.photo:
+        return "photo", sent.photo[-1].file_id
+    if sent.document:
+        return "document", sent.document.file_id
+    return None
+
+
+file_id_cache: Optional[FileIdCache] = None
+if config.FILE_ID_CACHE_ENABLED:
+    try:
+        file_id_cache = FileIdCache(
+            config.FILE_ID_CACHE_PATH, config.FILE_ID_CACHE_TTL, config.FILE_ID_CACHE_MAX_ENTRIES)
+        logger.info(f"Кэш file_id открыт: {config.FILE_ID_CACHE_PATH}")
+    except sqlite3.Error as e:
+        logger.error(f"Не удалось открыть кэш file_id {config.FILE_ID_CACHE_PATH}: {e}. Кэш отключен.")
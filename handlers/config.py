@@ -0,0 +1,255 @@
+import logging
+import os
+
+from dotenv import load_dotenv
+
+# Загружаем .env до чтения любых настроек: модули handlers импортируются раньше,
+# чем main.py успевает вызвать load_dotenv, а повторный вызов безопасен.
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+def env_str(name: str, default: str = "") -> str:
+    """Read a string setting from the environment."""
+    value = os.getenv(name)
+    return value.strip() if value is not None and value.strip() else default
+
+
+def env_int(name: str, default: int) -> int:
+    """Read an integer setting, falling back to the default on bad values."""
+    value = os.getenv(name)
+    if value is None or not value.strip():
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        logger.error(f"Переменная окружения {name}='{value}' должна быть целым числом. Используется {default}.")
+        return default
+
+
+def env_float(name: str, default: float) -> float:
+    """Read a float setting, falling back to the default on bad values."""
+    value = os.getenv(name)
+    if value is None or not value.strip():
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        logger.error(f"Переменная окружения {name}='{value}' должна быть числом. Используется {default}.")
+        return default
+
+
+def env_bool(name: str, default: bool) -> bool:
+    """Read a boolean setting (1/true/yes/on)."""
+    value = os.getenv(name)
+    if value is None or not value.strip():
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def env_mapping(name: str, default: dict[str, int]) -> dict[str, int]:
+    """Read a 'Key=1,Other=2' setting into a dict of ints merged over the default."""
+    result = dict(default)
+    value = os.getenv(name)
+    if not value:
+        return result
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        key, sep, number = item.partition("=")
+        try:
+            if not sep:
+                raise ValueError
+            result[key.strip()] = int(number)
+        except ValueError:
+            logger.error(f"Некорректный элемент '{item}' в переменной окружения {name} (ожидается Имя=число).")
+    return result
+
+
+# Загружаем ADMIN_ID и проверяем его наличие и тип
+ADMIN_ID_STR = os.getenv("ADMIN_ID")
+ADMIN_ID = None  # Инициализируем как None
+
+if not ADMIN_ID_STR:
+    logger.warning("Переменная окружения ADMIN_ID не установлена! Функции администрирования будут ограничены.")
+else:
+    try:
+        ADMIN_ID = int(ADMIN_ID_STR)
+        logger.info(f"ADMIN_ID успешно загружен и установлен: {ADMIN_ID}")
+    except ValueError:
+        logger.critical(
+            f"ADMIN_ID ('{ADMIN_ID_STR}') должен быть целым числом (ID пользователя Telegram)! Функции администрирования будут ограничены.")
+        ADMIN_ID = None  # Оставляем None, если значение некорректно
+
+
+# --- Отчеты администратору ---
+# Как часто (секунды) отправлять администратору сводку по запросам и ошибкам
+ADMIN_DIGEST_INTERVAL = env_float("ADMIN_DIGEST_INTERVAL", 3600.0)
+# Сколько последних ошибок перечислять в сводке
+ADMIN_DIGEST_MAX_ERRORS = env_int("ADMIN_DIGEST_MAX_ERRORS", 20)
+
+
+# --- Пул загрузок ---
+# Количество одновременных загрузок во всем боте.
+DOWNLOAD_WORKERS = env_int("DOWNLOAD_WORKERS", 4)
+# Тип пула: "thread" (по умолчанию) или "process".
+DOWNLOAD_POOL = env_str("DOWNLOAD_POOL", "thread").lower()
+# Лимиты одновременных загрузок по платформам, например "YouTube=2,Spotify=4".
+PLATFORM_CONCURRENCY = env_mapping("PLATFORM_CONCURRENCY", {"YouTube": 2, "Spotify": 4})
+# Сколько заявок может ждать в очереди, прежде чем бот начнет отказывать.
+MAX_QUEUE_DEPTH = env_int("MAX_QUEUE_DEPTH", 50)
+
+# --- Справедливое распределение загрузок между пользователями ---
+# Сколько загрузок одного пользователя выполняется одновременно (остальные ждут в очереди).
+USER_CONCURRENCY = env_int("USER_CONCURRENCY", 2)
+# Сколько ссылок в минуту принимается от одного пользователя и сколько можно прислать разом.
+USER_RATE_PER_MINUTE = env_float("USER_RATE_PER_MINUTE", 6.0)
+USER_BURST = env_int("USER_BURST", 5)
+# Относительная "стоимость" загрузки по платформам: чем дороже загрузки пользователя,
+# тем реже его задания выбираются из очереди, пока другие ждут.
+PLATFORM_COST = env_mapping("PLATFORM_COST", {
+    "YouTube": 10, "Spotify": 3, "Instagram": 3, "TikTok": 3, "X": 3, "Pinterest": 1,
+})
+# Дешевые платформы идут быстрой полосой: выбираются первыми и имеют свои слоты сверх DOWNLOAD_WORKERS.
+FAST_LANE_PLATFORMS = [name.strip() for name in env_str("FAST_LANE_PLATFORMS", "Pinterest").split(",")
+                       if name.strip()]
+FAST_LANE_WORKERS = env_int("FAST_LANE_WORKERS", 1)
+# Администратор не ограничен лимитами и обслуживается вне очереди.
+ADMIN_PRIORITY = env_bool("ADMIN_PRIORITY", True)
+
+# --- Кэш file_id ---
+FILE_ID_CACHE_ENABLED = env_bool("FILE_ID_CACHE_ENABLED", True)
+FILE_ID_CACHE_PATH = env_str("FILE_ID_CACHE_PATH", os.path.join("data", "file_id_cache.sqlite3"))
+# Telegram хранит file_id долго, поэтому по умолчанию 30 дней
+FILE_ID_CACHE_TTL = env_int("FILE_ID_CACHE_TTL", 30 * 24 * 3600)
+FILE_ID_CACHE_MAX_ENTRIES = env_int("FILE_ID_CACHE_MAX_ENTRIES", 10000)
+
+# --- Проверка метаданных (yt-dlp extract_info) ---
+# Метаданные хранятся недолго: ссылки на потоки YouTube со временем перестают работать.
+METADATA_CACHE_TTL = env_int("METADATA_CACHE_TTL", 300)
+METADATA_CACHE_MAX_ENTRIES = env_int("METADATA_CACHE_MAX_ENTRIES", 512)
+# Максимальная длительность YouTube видео в секундах (100 минут)
+YOUTUBE_MAX_DURATION = env_int("YOUTUBE_MAX_DURATION", 6000)
+
+# --- Сервер Bot API ---
+# Адрес собственного сервера telegram-bot-api (например, http://localhost:8081); пусто - api.telegram.org
+TELEGRAM_API_URL = env_str("TELEGRAM_API_URL", "").rstrip("/")
+# Сервер запущен с --local и видит файлы бота по тем же путям: файлы отправляются путем, без загрузки по HTTP
+TELEGRAM_API_LOCAL = env_bool("TELEGRAM_API_LOCAL", False)
+# Лимиты загрузки: публичный Bot API принимает до 50 МБ, локальный сервер - до 2000 МБ
+PUBLIC_API_MAX_UPLOAD_BYTES = 50 * 1024 * 1024
+LOCAL_API_MAX_UPLOAD_BYTES = 2000 * 1024 * 1024
+
+# --- Выбор формата ---
+# Бюджет размера файла; по умолчанию - лимит загрузки используемого сервера Bot API
+MAX_UPLOAD_BYTES = env_int("MAX_UPLOAD_BYTES", LOCAL_API_MAX_UPLOAD_BYTES if TELEGRAM_API_URL and TELEGRAM_API_LOCAL
+                           else PUBLIC_API_MAX_UPLOAD_BYTES)
+# Готовый mp4 предпочитается склейке, если его высота не меньше этой доли от лучшей склеенной
+PROGRESSIVE_MIN_HEIGHT_RATIO = env_float("PROGRESSIVE_MIN_HEIGHT_RATIO", 0.75)
+
+# --- Spotify ---
+# "service" - постоянный клиент spotdl в процессе бота, "subprocess" - запуск spotdl на каждый трек
+SPOTIFY_MODE = env_str("SPOTIFY_MODE", "service").lower()
+SPOTIFY_THREADS = env_int("SPOTIFY_THREADS", 4)
+SPOTIFY_TIMEOUT = env_int("SPOTIFY_TIMEOUT", 120)
+SPOTIFY_OUTPUT_DIR = env_str("SPOTIFY_OUTPUT_DIR", os.path.join("downloads", "spotify"))
+
+# --- Пакетный режим ---
+# Сколько видео из одного сообщения (несколько ссылок или плейлист) скачивается за раз
+BATCH_MAX_ITEMS = env_int("BATCH_MAX_ITEMS", 20)
+
+# --- Короткие ссылки ---
+# Куда ведут pin.it и vt.tiktok.com, запоминается, чтобы не ходить по редиректу повторно
+SHORT_LINK_CACHE_TTL = env_int("SHORT_LINK_CACHE_TTL", 24 * 60 * 60)
+SHORT_LINK_CACHE_MAX_ENTRIES = env_int("SHORT_LINK_CACHE_MAX_ENTRIES", 4096)
+SHORT_LINK_TIMEOUT = env_float("SHORT_LINK_TIMEOUT", 10.0)
+
+# --- Рабочая папка загрузок ---
+# Каждая загрузка получает свою папку внутри WORKSPACE_ROOT
+WORKSPACE_ROOT = env_str("WORKSPACE_ROOT", os.path.join("downloads", "jobs"))
+# Сколько байт могут занимать одновременные загрузки; сверх этого новые ждут освобождения места
+WORKSPACE_QUOTA_BYTES = env_int("WORKSPACE_QUOTA_BYTES", 2 * 1024 * 1024 * 1024)
+# Необязательная папка в tmpfs (например, /dev/shm/tg_bot) для маленьких файлов
+WORKSPACE_TMPFS_ROOT = env_str("WORKSPACE_TMPFS_ROOT", "")
+WORKSPACE_TMPFS_QUOTA_BYTES = env_int("WORKSPACE_TMPFS_QUOTA_BYTES", 256 * 1024 * 1024)
+WORKSPACE_TMPFS_MAX_FILE_BYTES = env_int("WORKSPACE_TMPFS_MAX_FILE_BYTES", 32 * 1024 * 1024)
+# Резерв под загрузку, размер которой заранее неизвестен
+WORKSPACE_DEFAULT_RESERVATION = env_int("WORKSPACE_DEFAULT_RESERVATION", 64 * 1024 * 1024)
+# Сколько секунд загрузка ждет свободного места, прежде чем отказать
+WORKSPACE_WAIT_TIMEOUT = env_float("WORKSPACE_WAIT_TIMEOUT", 120.0)
+# Уборщик раз в WORKSPACE_JANITOR_INTERVAL секунд удаляет файлы старше WORKSPACE_STALE_AFTER
+WORKSPACE_JANITOR_INTERVAL = env_float("WORKSPACE_JANITOR_INTERVAL", 600.0)
+WORKSPACE_STALE_AFTER = env_float("WORKSPACE_STALE_AFTER", 3600.0)
+
+# --- HTTP клиент для прямых загрузок ---
+HTTP_POOL_CONNECTIONS = env_int("HTTP_POOL_CONNECTIONS", 16)
+HTTP_POOL_MAXSIZE = env_int("HTTP_POOL_MAXSIZE", 32)
+
+# --- Потоковая отправка ---
+# Файлы до этого размера с известной длиной идут из источника сразу в Telegram, минуя диск (0 - выключено)
+STREAM_MAX_BYTES = env_int("STREAM_MAX_BYTES", 20 * 1024 * 1024)
+
+# --- Обработка после загрузки (ffmpeg) ---
+# Перенос индекса mp4 в начало файла, превью и размеры видео; выполняется в своем пуле процессов
+POSTPROCESS_ENABLED = env_bool("POSTPROCESS_ENABLED", True)
+POSTPROCESS_WORKERS = env_int("POSTPROCESS_WORKERS", 2)
+# Сколько секунд может работать один запуск ffmpeg или ffprobe
+POSTPROCESS_TIMEOUT = env_float("POSTPROCESS_TIMEOUT", 120.0)
+FFMPEG_BINARY = env_str("FFMPEG_BINARY", "ffmpeg")
+FFPROBE_BINARY = env_str("FFPROBE_BINARY", "ffprobe")
+# Формат команды /audio: "m4a" (без перекодирования, если звук уже AAC) или "mp3"
+AUDIO_FORMAT = env_str("AUDIO_FORMAT", "m4a").lower()
+
+# --- Прогресс загрузки ---
+# Как часто (секунды) обновлять статусное сообщение в одном чате (0 - не показывать прогресс)
+PROGRESS_INTERVAL = env_float("PROGRESS_INTERVAL", 3.0)
+# Общий лимит правок сообщений в секунду для всего бота
+PROGRESS_EDITS_PER_SECOND = env_float("PROGRESS_EDITS_PER_SECOND", 20.0)
+
+# --- Очередь заданий для отдельных воркеров ---
+# "" - загрузки выполняются в процессе бота; "sqlite" - бот только ставит задания в очередь,
+# а скачивают и отправляют файлы процессы worker.py
+JOB_QUEUE = env_str("JOB_QUEUE", "").lower()
+JOB_QUEUE_PATH = env_str("JOB_QUEUE_PATH", os.path.join("data", "jobs.sqlite3"))
+# Сколько секунд задание принадлежит воркеру без продления аренды; потом его заберет другой
+JOB_VISIBILITY_TIMEOUT = env_int("JOB_VISIBILITY_TIMEOUT", 300)
+JOB_MAX_ATTEMPTS = env_int("JOB_MAX_ATTEMPTS", 3)
+# Сколько заданий один процесс worker.py выполняет одновременно
+WORKER_CONCURRENCY = env_int("WORKER_CONCURRENCY", 2)
+WORKER_POLL_INTERVAL = env_float("WORKER_POLL_INTERVAL", 1.0)
+
+# --- Ошибки загрузок ---
+# Сколько секунд помнить ошибку ссылки: неисправимую (видео удалено, закрыто, слишком длинное) и временную
+NEGATIVE_CACHE_PERMANENT_TTL = env_int("NEGATIVE_CACHE_PERMANENT_TTL", 6 * 60 * 60)
+NEGATIVE_CACHE_TRANSIENT_TTL = env_int("NEGATIVE_CACHE_TRANSIENT_TTL", 60)
+NEGATIVE_CACHE_MAX_ENTRIES = env_int("NEGATIVE_CACHE_MAX_ENTRIES", 4096)
+# Предохранитель платформы: при доле временных ошибок от CIRCUIT_ERROR_RATE среди не менее CIRCUIT_MIN_REQUESTS
+# загрузок за CIRCUIT_WINDOW_SECONDS запросы к ней отклоняются CIRCUIT_OPEN_SECONDS, затем идет один пробный
+CIRCUIT_WINDOW_SECONDS = env_float("CIRCUIT_WINDOW_SECONDS", 300.0)
+CIRCUIT_MIN_REQUESTS = env_int("CIRCUIT_MIN_REQUESTS", 5)
+CIRCUIT_ERROR_RATE = env_float("CIRCUIT_ERROR_RATE", 0.5)
+CIRCUIT_OPEN_SECONDS = env_float("CIRCUIT_OPEN_SECONDS", 120.0)
+
+# --- Режим работы бота ---
+# "polling" - long polling, "webhook" - aiohttp сервер принимает обновления от Telegram
+BOT_MODE = env_str("BOT_MODE", "polling").lower()
+# Публичный адрес бота; путь, секрет и адрес, на котором слушает сервер вебхука
+WEBHOOK_URL = env_str("WEBHOOK_URL", "")
+WEBHOOK_PATH = env_str("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = env_str("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = env_str("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = env_int("WEBHOOK_PORT", 8080)
+# Сколько секунд при остановке ждать завершения начатых загрузок и отправок
+SHUTDOWN_DRAIN_TIMEOUT = env_float("SHUTDOWN_DRAIN_TIMEOUT", 60.0)
+
+# --- Запуск ---
+# Тяжелые модули (yt-dlp, requests) загружаются при первой загрузке; прогрев делает это в фоне сразу после старта
+WARMUP_ENABLED = env_bool("WARMUP_ENABLED", True)
+# Через сколько секунд после начала приема обновлений запускать прогрев
+WARMUP_DELAY = env_float("WARMUP_DELAY", 1.0)
+
+# --- Метрики ---
+# Порт HTTP сервера с /metrics для Prometheus (0 - не запускать); /stats у администратора работает всегда
+METRICS_PORT = env_int("METRICS_PORT", 0)
+METRICS_HOST = env_str("METRICS_HOST", "0.0.0.0")
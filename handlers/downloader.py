@@ -1,87 +1,208 @@
 # Any changes to this file may negatively impact performance.
 
+import copy
 import os
 import subprocess
-from typing import Literal
+import time
+from typing import Optional
 import logging  # Добавлен logging
 import shutil  # Добавлен shutil для удаления папок
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
-import bs4
-import requests
-import youthon  # Убедитесь, что эта библиотека установлена, если нет - pip install youthon
-import yt_dlp
+from handlers import config, metrics
+from handlers.cache import TTLCache
+from handlers.formats import AUDIO_ONLY_FORMAT, DEFAULT_FORMAT, estimate_format_size, plan_format
+from handlers.http import BROWSER_HEADERS, find_og_image, get_session
+from handlers.lazy import lazy_import, register_warmup
+from handlers.progress import ProgressState
+from handlers.spotify import SpotifyService, SpotifyServiceUnavailable
+from handlers.streaming import Media, RemoteMedia
+from handlers.workspace import workspace
+
+# yt-dlp при импорте загружает сотни модулей экстракторов - откладываем до первой загрузки или прогрева
+yt_dlp = lazy_import("yt_dlp")
+requests = lazy_import("requests")
+# Результаты extract_info по ссылке: повторный запрос или отказ по длительности не ходят в сеть
+metadata_cache = TTLCache(config.METADATA_CACHE_TTL, config.METADATA_CACHE_MAX_ENTRIES)
+# Один клиент spotdl на процесс; запускается при первом треке
+spotify_service = SpotifyService(config.SPOTIFY_OUTPUT_DIR, config.SPOTIFY_THREADS)
+# Резерв места под картинку Pinterest или трек Spotify: размер заранее неизвестен, но невелик
+SMALL_MEDIA_RESERVATION = 16 * 1024 * 1024
+
+
+def format_budget() -> int:
+    """Largest planned video size: the upload limit, but no more than the workspace can reserve for it."""
+    # Видео резервируется вдвое (см. video_reservation): иначе с локальным Bot API (лимит 2000 МБ) выбранный
+    # формат не поместился бы в квоту по умолчанию, хотя меньшее разрешение поместилось бы
+    return min(config.MAX_UPLOAD_BYTES, workspace.disk.quota // 2)
+
+
+def video_reservation(plan) -> Optional[int]:
+    """Bytes to reserve for a planned video: merging streams and the faststart remux keep two copies."""
+    if not plan.estimated_bytes:
+        return None
+    return plan.estimated_bytes * (1 if plan.progressive and not config.POSTPROCESS_ENABLED else 2)
 
 
 class Downloader:
-    HEADERS = {
-        "User-Agent": (
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-            "AppleWebKit/537.36 (KHTML, like Gecko) "
-            "Chrome/91.0.4472.124 Safari/537.36"
-        )
-    }
-    PLATFORM_PREFIXES = {
-        "YouTube": ["https://www.youtube.com/watch?v=", 'https://youtube.com/watch?v', "https://youtu.be/",
-                    "https://www.youtube.com/shorts/", "https://youtube.com/shorts/"],
-        "X": ["https://x.com/", "https://twitter.com/"],
-        "TikTok": ["https://www.tiktok.com/", "https://vt.tiktok.com/"],
-        "Instagram": ["https://www.instagram.com/reel/", "https://instagram.com/reel/"],
-        "Pinterest": ["https://pin.it/", "https://www.pinterest.com/pin/", "https://in.pinterest.com/pin/"],
-        "Spotify": ["https://open.spotify.com/track/"],
-    }
-
-    def download(self, platform: str, url: str, base_filename: str) -> str:  # filename переименован в base_filename
-        """Download content based on the detected platform."""
+    HEADERS = BROWSER_HEADERS
+
+    def download(self, platform: str, url: str, base_filename: str,
+                 progress: Optional[ProgressState] = None,
+                 audio_only: bool = False) -> Media:  # filename переименован в base_filename
+        """Download content based on the detected platform.
+
+        Returns a file path, or a RemoteMedia when the content can be streamed straight
+        into the Telegram upload without touching disk. Progress, if given, is updated
+        from the download thread. With audio_only, video platforms fetch just the audio
+        track, which post-processing then converts.
+        """
+        media = self._download_media(platform, url, base_filename, progress, audio_only)
+        if isinstance(media, RemoteMedia):
+            size = media.size or 0
+        else:
+            size = os.path.getsize(media) if os.path.exists(media) else 0
+        metrics.DOWNLOADED_BYTES.inc(size, platform=platform)
+        return media
+
+    def _download_media(self, platform: str, url: str, base_filename: str,
+                        progress: Optional[ProgressState] = None, audio_only: bool = False) -> Media:
         if platform == "YouTube":
-            time_limit = 6000  # 100 минут
-            # Проверка длительности видео YouTube
+            # Одна проверка метаданных и для ограничения длительности, и для самой загрузки
             try:
-                video_info = youthon.Video(url)
-                if video_info.length_seconds > time_limit:
-                    raise ValueError(
-                        f"Скачивание доступно только для YouTube видео короче {time_limit / 60:.0f} минут.")
-            except Exception as e:  # Обработка ошибок youthon, например, если видео недоступно
+                with metrics.STAGE_SECONDS.time(platform=platform, stage="probe"):
+                    info = self.probe_video(url)
+            except Exception as e:  # Например, если видео недоступно
                 logging.error(f"Ошибка при получении информации о YouTube видео {url}: {e}")
                 raise ValueError(
                     f"Не удалось получить информацию о YouTube видео. Возможно, оно недоступно или ссылка некорректна. Ошибка: {e}")
-            return self.download_video(url, f"{base_filename}.mp4")
+            self.check_duration(info, config.YOUTUBE_MAX_DURATION)
+            if audio_only:
+                return self.download_audio_track(url, base_filename, info, progress=progress, platform=platform)
+            plan = plan_format(info, format_budget(), config.PROGRESSIVE_MIN_HEIGHT_RATIO)
+            if plan.progressive:
+                media = self.progressive_media(info, plan.format_spec, f"{base_filename}.mp4")
+                if media is not None:
+                    return media
+            with workspace.allocate(base_filename, video_reservation(plan)) as job_dir:
+                return self.download_video(url, job_dir.file(f"{base_filename}.mp4"), info=info,
+                                           format_spec=plan.format_spec, progress=progress, platform=platform)
         elif platform in ["Instagram", "TikTok", "X"]:
-            return self.download_video(url, f"{base_filename}.mp4", True)
+            try:
+                with metrics.STAGE_SECONDS.time(platform=platform, stage="probe"):
+                    info = self.probe_video(url, True)
+            except Exception as e:
+                logging.error(f"yt-dlp ошибка при получении информации о {url}: {e}")
+                raise RuntimeError(f"Ошибка при скачивании видео: {e}")
+            if audio_only:
+                return self.download_audio_track(url, base_filename, info, True, progress, platform)
+            plan = plan_format(info, format_budget(), config.PROGRESSIVE_MIN_HEIGHT_RATIO)
+            if plan.progressive:
+                media = self.progressive_media(info, plan.format_spec, f"{base_filename}.mp4")
+                if media is not None:
+                    return media
+            with workspace.allocate(base_filename, video_reservation(plan)) as job_dir:
+                return self.download_video(url, job_dir.file(f"{base_filename}.mp4"), True, info=info,
+                                           format_spec=plan.format_spec, progress=progress, platform=platform)
         elif platform == "Pinterest":
-            return self.download_pinterest_image(url, f"{base_filename}.png")
+            # Если картинка пойдет потоком, пустая папка удалится при выходе
+            with workspace.allocate(base_filename, SMALL_MEDIA_RESERVATION) as job_dir, \
+                    metrics.STAGE_SECONDS.time(platform=platform, stage="download"):
+                return self.download_pinterest_image(url, job_dir.file(f"{base_filename}.png"), progress)
         elif platform == "Spotify":
             # download_spotify_track теперь будет использовать base_filename и добавлять .mp3
-            return self.download_spotify_track(url, base_filename)
+            with workspace.allocate(base_filename, SMALL_MEDIA_RESERVATION) as job_dir:
+                return self.download_spotify_track(url, job_dir.file(base_filename), progress)
         else:
             # Эта ветка не должна достигаться, если platform корректно определен и проверен в message_handler
             raise ValueError("Неизвестная платформа для скачивания.")
 
     @staticmethod
-    def detect_platform(url: str) -> Literal[
-        "YouTube", "Instagram", "X", "TikTok", "Spotify", "Pinterest", "unsupported"]:
-        """Detects the platform from the URL using prefix matching."""
-        for platform, prefixes in Downloader.PLATFORM_PREFIXES.items():
-            if any(url.startswith(prefix) for prefix in prefixes):
-                return platform
-        return "unsupported"
-
-    def download_video(self, url: str, output_filename: str, extra_args: bool = False) -> str:
-        """Download a video from supported platforms."""
+    def _ydl_options(extra_args: bool = False) -> dict:
+        """Common yt-dlp options for probing and downloading."""
         ydl_options = {
-            "format": "bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best",  # Более надежный формат
-            "outtmpl": output_filename,
+            "format": DEFAULT_FORMAT,  # Более надежный формат
+            "merge_output_format": "mp4",
             "quiet": True,
             "http_headers": Downloader.HEADERS,
             "noplaylist": True,  # Не скачивать плейлисты
             "retries": 3,  # Количество попыток
         }
-
         if extra_args:  # Для TikTok
             ydl_options["extractor_args"] = {"tiktok": {"webpage_download": True}}
+        return ydl_options
+
+    def probe_video(self, url: str, extra_args: bool = False) -> dict:
+        """Extract metadata once (no download), using the short-lived metadata cache."""
+        cache_key = url.strip()
+        info = metadata_cache.get(cache_key)
+        if info is None:
+            with yt_dlp.YoutubeDL(self._ydl_options(extra_args)) as ydl:
+                info = ydl.sanitize_info(ydl.extract_info(url, download=False))
+            metadata_cache.put(cache_key, info)
+            logging.info(f"Метаданные {url}: длительность {info.get('duration')} с, "
+                         f"оценка размера {self.estimate_filesize(info)} байт, формат {info.get('format_id')}")
+        else:
+            logging.info(f"Метаданные {url} взяты из кэша.")
+        # process_ie_result изменяет словарь, поэтому кэшированную копию не отдаем
+        return copy.deepcopy(info)
 
+    def list_playlist(self, url: str, limit: int) -> list[str]:
+        """Return the video URLs of a playlist or a channel's Shorts tab, at most limit of them."""
+        ydl_options = self._ydl_options()
+        # Только список записей, без разбора каждого видео - их проверит обычная загрузка
+        ydl_options.update(extract_flat="in_playlist", noplaylist=False, playlistend=limit)
         try:
             with yt_dlp.YoutubeDL(ydl_options) as ydl:
-                ydl.download([url])
+                info = ydl.extract_info(url, download=False)
+        except Exception as e:
+            logging.error(f"yt-dlp ошибка при получении плейлиста {url}: {e}")
+            raise RuntimeError(f"Не удалось получить список видео: {e}")
+        urls = [entry.get("url") or f"https://www.youtube.com/watch?v={entry['id']}"
+                for entry in info.get("entries") or [] if entry and entry.get("id")]
+        return urls[:limit]
+
+    @staticmethod
+    def check_duration(info: dict, time_limit: int) -> None:
+        """Reject live streams and videos longer than time_limit seconds."""
+        if info.get("is_live"):
+            raise ValueError("Прямые трансляции не поддерживаются.")
+        duration = info.get("duration") or 0
+        if duration > time_limit:
+            raise ValueError(
+                f"Скачивание доступно только для YouTube видео короче {time_limit / 60:.0f} минут.")
+
+    @staticmethod
+    def estimate_filesize(info: dict) -> Optional[int]:
+        """Estimate the size in bytes of the format(s) selected in the info dict."""
+        total = 0
+        for fmt in info.get("requested_formats") or [info]:
+            size = estimate_format_size(fmt, info.get("duration"))
+            if not size:
+                return None
+            total += size
+        return total
+
+    def download_video(self, url: str, output_filename: str, extra_args: bool = False,
+                       info: Optional[dict] = None, format_spec: Optional[str] = None,
+                       progress: Optional[ProgressState] = None, platform: str = "unknown") -> str:
+        """Download a video from supported platforms, reusing probed metadata if given."""
+        ydl_options = self._ydl_options(extra_args)
+        ydl_options["outtmpl"] = output_filename
+        if format_spec:
+            ydl_options["format"] = format_spec
+        if progress is not None:
+            ydl_options["progress_hooks"] = [progress.ytdlp_hook]
+        ydl_options["postprocessor_hooks"] = [self._merge_timer(platform)]
+
+        try:
+            with metrics.STAGE_SECONDS.time(platform=platform, stage="download"), \
+                    yt_dlp.YoutubeDL(ydl_options) as ydl:
+                if info is not None:
+                    # Страница уже разобрана при проверке - скачиваем без повторного извлечения
+                    ydl.process_ie_result(info, download=True)
+                else:
+                    ydl.download([url])
         except Exception as e:
             logging.error(f"yt-dlp ошибка при скачивании {url}: {e}")
             raise RuntimeError(f"Ошибка при скачивании видео: {e}")
@@ -92,29 +213,70 @@ class Downloader:
 
         return output_filename
 
-    def download_pinterest_image(self, url: str, output_filename: str) -> str:
-        """Download an image from Pinterest."""
+    def download_audio_track(self, url: str, base_filename: str, info: dict, extra_args: bool = False,
+                             progress: Optional[ProgressState] = None, platform: str = "unknown") -> str:
+        """Download only the audio stream; post-processing converts it to AUDIO_FORMAT."""
+        # Расширение заранее неизвестно (m4a, webm), ffmpeg определит формат по содержимому
+        with workspace.allocate(base_filename) as job_dir:
+            return self.download_video(url, job_dir.file(f"{base_filename}.source"), extra_args, info=info,
+                                       format_spec=AUDIO_ONLY_FORMAT, progress=progress, platform=platform)
+
+    @staticmethod
+    def _merge_timer(platform: str):
+        """yt-dlp postprocessor hook that records how long ffmpeg merging takes."""
+        started: dict[str, float] = {}
+
+        def hook(status: dict) -> None:
+            if status.get("postprocessor") != "Merger":
+                return
+            if status.get("status") == "started":
+                started["at"] = time.perf_counter()
+            elif status.get("status") == "finished" and "at" in started:
+                metrics.STAGE_SECONDS.observe(time.perf_counter() - started.pop("at"), platform=platform,
+                                              stage="merge")
+        return hook
+
+    @staticmethod
+    def progressive_media(info: dict, format_id: str, filename: str) -> Optional[RemoteMedia]:
+        """Return the planned pre-muxed format as RemoteMedia if it can be streamed as is."""
+        if config.STREAM_MAX_BYTES <= 0:
+            return None
+        fmt = next((f for f in info.get("formats") or [] if f.get("format_id") == format_id), None)
+        # Потоково отдаем только обычный http(s) файл с точно известным размером и без cookies
+        if (fmt is None or fmt.get("protocol") not in ("http", "https") or fmt.get("cookies")
+                or not fmt.get("filesize") or fmt["filesize"] > config.STREAM_MAX_BYTES):
+            return None
+        logging.info(f"Формат {format_id} ({fmt['filesize']} байт) будет передан в Telegram потоком, без диска.")
+        return RemoteMedia(fmt["url"], filename, {**Downloader.HEADERS, **(fmt.get("http_headers") or {})},
+                           fmt["filesize"])
+
+    @staticmethod
+    def remote_media(url: str, filename: str) -> Optional[RemoteMedia]:
+        """Check the size of a direct file and return RemoteMedia if it is small enough to stream."""
+        if config.STREAM_MAX_BYTES <= 0:
+            return None
+        response = get_session().head(url, headers=Downloader.HEADERS, timeout=10, allow_redirects=True)
+        size = int(response.headers.get("Content-Length") or 0)
+        if not response.ok or not 0 < size <= config.STREAM_MAX_BYTES:
+            # Размер неизвестен или слишком велик - сохраняем на диск
+            return None
+        return RemoteMedia(response.url, filename, dict(Downloader.HEADERS), size)
+
+    def download_pinterest_image(self, url: str, output_filename: str,
+                                 progress: Optional[ProgressState] = None) -> Media:
+        """Download an image from Pinterest, or return it as RemoteMedia for streaming."""
         try:
-            response = requests.get(url, headers=Downloader.HEADERS, timeout=10)
+            # Страницу читаем потоково и только до og:image, а не разбираем целиком
+            response = get_session().get(url, headers=Downloader.HEADERS, timeout=10, stream=True)
             response.raise_for_status()
-            soup = bs4.BeautifulSoup(response.content, "html.parser")
-
-            # Ищем мета-тег og:image
-            og_image_meta = soup.find("meta", property="og:image")
-            if not og_image_meta or not og_image_meta.get("content"):
-                # Попробуем найти основной тег img с высоким разрешением, если og:image нет
-                # Это может потребовать более сложного парсинга в зависимости от структуры Pinterest
-                # Для простоты, пока ограничимся og:image или специфичным селектором
-                img_tag = soup.find("img",
-                                    {"data-test-id": "pin-closeup-image"})  # Примерный селектор, может измениться
-                if img_tag and img_tag.get("src"):
-                    img_url = img_tag["src"]
-                else:  # Если ничего не найдено
-                    raise ValueError("Не удалось найти URL изображения на странице Pinterest.")
-            else:
-                img_url = og_image_meta["content"]
-
-            self.download_file(img_url, output_filename)
+            img_url = find_og_image(response)
+            if not img_url:  # Если ничего не найдено
+                raise ValueError("Не удалось найти URL изображения на странице Pinterest.")
+
+            media = self.remote_media(img_url, output_filename)
+            if media is not None:
+                return media
+            self.download_file(img_url, output_filename, progress)
             return output_filename
         except requests.RequestException as e:
             logging.error(f"Ошибка сети при скачивании с Pinterest {url}: {e}")
@@ -124,13 +286,39 @@ class Downloader:
             raise RuntimeError(f"Ошибка при обработке Pinterest: {e}")
 
     @staticmethod
-    def download_spotify_track(url: str, output_filename_base: str) -> str:
+    def download_spotify_track(url: str, output_filename_base: str,
+                               progress: Optional[ProgressState] = None) -> str:
         """Download a Spotify track and save it as output_filename_base.mp3."""
         final_filename = f"{output_filename_base}.mp3"
+        if progress is not None:
+            # spotdl не сообщает байты, показываем только этап
+            progress.set_stage("поиск и загрузка трека")
+
+        if config.SPOTIFY_MODE == "service":
+            try:
+                # Постоянный клиент spotdl: без запуска интерпретатора и новых сессий на каждый трек
+                with metrics.STAGE_SECONDS.time(platform="Spotify", stage="download"):
+                    track_path = spotify_service.download(url, timeout=config.SPOTIFY_TIMEOUT)
+                shutil.move(track_path, final_filename)
+                return final_filename
+            except SpotifyServiceUnavailable as e:
+                logging.warning(f"{e}. Используется запуск spotdl в отдельном процессе.")
+            except FutureTimeoutError:
+                logging.error(f"spotdl timed out while downloading {url}")
+                raise RuntimeError("Скачивание трека Spotify заняло слишком много времени.")
+            except Exception as e:
+                logging.error(f"Общая ошибка при скачивании Spotify трека {url}: {e}")
+                raise RuntimeError(f"Произошла ошибка при скачивании трека Spotify: {e}")
+
+        with metrics.STAGE_SECONDS.time(platform="Spotify", stage="download_cli"):
+            return Downloader._download_spotify_track_subprocess(url, final_filename)
 
-        # Создаем временную уникальную папку для скачивания spotdl
+    @staticmethod
+    def _download_spotify_track_subprocess(url: str, final_filename: str) -> str:
+        """Fallback: run the spotdl CLI in a subprocess for a single track."""
+        # Создаем временную уникальную папку для скачивания spotdl рядом с итоговым файлом (в папке задачи),
         # чтобы избежать конфликтов имен и легко найти скачанный файл
-        temp_download_dir = f"temp_spotify_{output_filename_base}_{os.urandom(4).hex()}"
+        temp_download_dir = os.path.join(os.path.dirname(final_filename), f"temp_spotify_{os.urandom(4).hex()}")
         os.makedirs(temp_download_dir, exist_ok=True)
 
         try:
@@ -142,7 +330,8 @@ class Downloader:
             cmd = ["spotdl", "download", url, "--output", temp_download_dir]
 
             # Запускаем spotdl
-            result = subprocess.run(cmd, check=False, capture_output=True, text=True, timeout=120)  # Увеличим таймаут
+            result = subprocess.run(cmd, check=False, capture_output=True, text=True,
+                                    timeout=config.SPOTIFY_TIMEOUT)  # Увеличим таймаут
 
             if result.returncode != 0:
                 error_output = result.stderr or result.stdout or "No output from spotdl."
@@ -178,14 +367,17 @@ class Downloader:
                     logging.error(f"Не удалось удалить временную папку {temp_download_dir}: {e_rmtree}")
 
     @staticmethod
-    def download_file(url: str, output_filename: str) -> None:
+    def download_file(url: str, output_filename: str, progress: Optional[ProgressState] = None) -> None:
         """Generic file download helper."""
         try:
-            with requests.get(url, stream=True, headers=Downloader.HEADERS, timeout=20) as r:  # Добавлен таймаут
+            with get_session().get(url, stream=True, headers=Downloader.HEADERS, timeout=20) as r:  # Добавлен таймаут
                 r.raise_for_status()
+                total = int(r.headers.get("Content-Length") or 0) or None
                 with open(output_filename, "wb") as file:
-                    for chunk in r.iter_content(chunk_size=8192):  # chunk_size=1024 довольно мал
+                    for chunk in r.iter_content(chunk_size=65536):
                         file.write(chunk)
+                        if progress is not None:
+                            progress.add_bytes(len(chunk), total)
             if not os.path.exists(output_filename) or os.path.getsize(output_filename) == 0:
                 raise FileNotFoundError(f"Файл {output_filename} не был создан или пуст после скачивания с {url}.")
         except requests.RequestException as e:
@@ -193,4 +385,12 @@ class Downloader:
             raise RuntimeError(f"Ошибка сети при скачивании файла: {e}")
         except Exception as e:
             logging.error(f"Общая ошибка при скачивании файла {url}: {e}")
-            raise RuntimeError(f"Общая ошибка при скачивании файла: {e}")
\ No newline at end of file
+            raise RuntimeError(f"Общая ошибка при скачивании файла: {e}")
+
+def _build_extractors() -> None:
+    # Первый YoutubeDL собирает список всех экстракторов - делаем это до запроса пользователя
+    with yt_dlp.YoutubeDL({"quiet": True}):
+        pass
+
+
+register_warmup("экстракторы yt-dlp", _build_extractors)
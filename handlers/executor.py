@@ -0,0 +1,267 @@
+import asyncio
+import functools
+import itertools
+import logging
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Optional
+
+from handlers import config, metrics
+from handlers.lazy import warm_up
+from handlers.scheduler import LANE_NORMAL, FairScheduler
+
+logger = logging.getLogger(__name__)
+
+# Как часто ожидающий в очереди проверяет, не сдвинулась ли его позиция (секунды)
+QUEUE_POLL_INTERVAL = 1.0
+
+
+class QueueFullError(RuntimeError):
+    """Raised when the download queue is over its depth limit."""
+
+
+class JobCancelledError(RuntimeError):
+    """Raised to waiters of a cancelled download job."""
+
+
+@dataclass(eq=False)
+class Job:
+    id: int
+    platform: str
+    user_id: int
+    func: Callable[..., Any]
+    args: tuple
+    future: asyncio.Future
+    on_discard: Optional[Callable[[Any], None]] = None
+    lane: int = LANE_NORMAL
+    finish_tag: float = 0.0
+    enqueued_at: float = field(default_factory=time.monotonic)
+    started_at: Optional[float] = None
+    cancelled: bool = False
+
+
+class DownloadExecutor:
+    """Runs blocking downloads in a bounded pool with per-platform and per-user limits.
+
+    The order of waiting jobs is decided by the FairScheduler: admin, fast lane, then
+    weighted fair queuing between users. Fast lane jobs also get extra slots of their own.
+    """
+
+    def __init__(self, max_workers: int = 4, pool_kind: str = "thread",
+                 platform_limits: Optional[dict[str, int]] = None, max_queue_depth: int = 50,
+                 scheduler: Optional[FairScheduler] = None):
+        self.max_workers = max(1, max_workers)
+        self.pool_kind = pool_kind
+        self.platform_limits = dict(platform_limits or {})
+        self.max_queue_depth = max_queue_depth
+        self.scheduler = scheduler or FairScheduler({}, [], 0, self.max_workers)
+        self._pool: Optional[Executor] = None
+        self._pending: list[Job] = []
+        self._running: set[Job] = set()
+        self._running_by_platform: dict[str, int] = {}
+        self._running_by_user: dict[int, int] = {}
+        self._ids = itertools.count(1)
+
+    @classmethod
+    def from_env(cls) -> "DownloadExecutor":
+        """Build an executor from the DOWNLOAD_* settings."""
+        return cls(
+            max_workers=config.DOWNLOAD_WORKERS,
+            pool_kind=config.DOWNLOAD_POOL,
+            platform_limits=config.PLATFORM_CONCURRENCY,
+            max_queue_depth=config.MAX_QUEUE_DEPTH,
+            scheduler=FairScheduler.from_env(),
+        )
+
+    def _get_pool(self) -> Executor:
+        if self._pool is None:
+            pool_size = self.max_workers + self.scheduler.fast_lane_workers
+            if self.pool_kind == "process":
+                # Каждый процесс пула сразу загружает yt-dlp, а не на первой загрузке
+                self._pool = ProcessPoolExecutor(max_workers=pool_size,
+                                                 initializer=warm_up if config.WARMUP_ENABLED else None)
+            else:
+                self._pool = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="download")
+            logger.info(f"Создан пул загрузок: {self.pool_kind}, воркеров: {self.max_workers} "
+                        f"+ {self.scheduler.fast_lane_workers} быстрой полосы, "
+                        f"лимиты платформ: {self.platform_limits}")
+        return self._pool
+
+    @property
+    def shares_memory(self) -> bool:
+        """True if jobs run in this process, so they can update shared objects like progress."""
+        return self.pool_kind != "process"
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    @property
+    def running_count(self) -> int:
+        return len(self._running)
+
+    def submit(self, platform: str, user_id: int, func: Callable[..., Any], *args: Any,
+               on_discard: Optional[Callable[[Any], None]] = None) -> Job:
+        """Queue a blocking call; raises QueueFullError when the queue is full."""
+        if len(self._pending) >= self.max_queue_depth and not self.scheduler.is_admin(user_id):
+            raise QueueFullError(
+                f"Бот сейчас перегружен: в очереди {len(self._pending)} загрузок. Попробуйте через пару минут.")
+        job = Job(
+            id=next(self._ids),
+            platform=platform,
+            user_id=user_id,
+            func=func,
+            args=args,
+            future=asyncio.get_running_loop().create_future(),
+            on_discard=on_discard,
+            lane=self.scheduler.lane(platform, user_id),
+            finish_tag=self.scheduler.tag(platform, user_id),
+        )
+        self._pending.append(job)
+        logger.info(f"Загрузка #{job.id} ({platform}) пользователя {user_id} поставлена в очередь "
+                    f"(полоса {job.lane}, тег {job.finish_tag:.0f}). "
+                    f"В очереди: {len(self._pending)}, выполняется: {len(self._running)}")
+        self._dispatch()
+        return job
+
+    def _ordered_pending(self) -> list[Job]:
+        return sorted(self._pending, key=lambda job: (job.lane, job.finish_tag, job.id))
+
+    def position(self, job: Job) -> int:
+        """1-based position among waiting jobs in scheduling order, or 0 if the job is no longer waiting."""
+        try:
+            return self._ordered_pending().index(job) + 1
+        except ValueError:
+            return 0
+
+    def estimate_wait(self, job: Job) -> float:
+        """Rough seconds until the job starts, from the average durations of jobs ahead of it."""
+        ordered = self._ordered_pending()
+        if job not in ordered:
+            return 0.0
+        now = time.monotonic()
+        work = sum(self.scheduler.expected_duration(ahead.platform) for ahead in ordered[:ordered.index(job)])
+        work += sum(max(self.scheduler.expected_duration(running.platform) - (now - running.started_at), 0.0)
+                    for running in self._running)
+        return work / self.max_workers
+
+    async def run(self, platform: str, user_id: int, func: Callable[..., Any], *args: Any,
+                  on_position: Optional[Callable[[int, float], Awaitable[None]]] = None,
+                  on_discard: Optional[Callable[[Any], None]] = None) -> Any:
+        """Submit a job and wait for its result.
+
+        on_position is awaited with the queue position and the estimated wait in seconds
+        whenever the position changes while the job waits, and with 0 once the job starts. Cancelling the waiting task cancels the job.
+        """
+        job = self.submit(platform, user_id, func, *args, on_discard=on_discard)
+        try:
+            if on_position is not None:
+                await self._watch_position(job, on_position)
+            return await asyncio.shield(job.future)
+        except asyncio.CancelledError:
+            self.cancel(job)
+            raise
+
+    async def _watch_position(self, job: Job, on_position: Callable[[int, float], Awaitable[None]]) -> None:
+        last_position = 0
+        while job.started_at is None and not job.future.done():
+            position = self.position(job)
+            if position and position != last_position:
+                await on_position(position, self.estimate_wait(job))
+                last_position = position
+            await asyncio.wait([job.future], timeout=QUEUE_POLL_INTERVAL)
+        if last_position and not job.future.done():
+            await on_position(0, 0.0)
+
+    def cancel(self, job: Job) -> bool:
+        """Cancel a job; a running job finishes in the pool but its result is discarded."""
+        if job.future.done():
+            return False
+        job.cancelled = True
+        if job in self._pending:
+            self._pending.remove(job)
+            logger.info(f"Загрузка #{job.id} отменена до начала выполнения.")
+        else:
+            logger.info(f"Загрузка #{job.id} отменена во время выполнения, результат будет отброшен.")
+        job.future.set_exception(JobCancelledError("Загрузка отменена."))
+        # Исключение уже доставлено ожидающим; помечаем его полученным, чтобы asyncio не ругался
+        job.future.exception()
+        self._dispatch()
+        return True
+
+    def _platform_has_capacity(self, platform: str) -> bool:
+        limit = self.platform_limits.get(platform, self.max_workers)
+        return self._running_by_platform.get(platform, 0) < limit
+
+    def _has_slot(self, job: Job) -> bool:
+        # Обычные загрузки занимают только основные слоты, быстрая полоса может брать и свои
+        slots = self.max_workers if job.lane == LANE_NORMAL else self.max_workers + self.scheduler.fast_lane_workers
+        return len(self._running) < slots
+
+    def _pick_next(self) -> Optional[Job]:
+        for job in self._ordered_pending():
+            if (self._has_slot(job) and self._platform_has_capacity(job.platform)
+                    and self.scheduler.user_has_capacity(job.user_id, self._running_by_user.get(job.user_id, 0))):
+                return job
+        return None
+
+    def _dispatch(self) -> None:
+        while True:
+            job = self._pick_next()
+            if job is None:
+                return
+            self._start(job)
+
+    def _start(self, job: Job) -> None:
+        self._pending.remove(job)
+        self._running.add(job)
+        self._running_by_platform[job.platform] = self._running_by_platform.get(job.platform, 0) + 1
+        self._running_by_user[job.user_id] = self._running_by_user.get(job.user_id, 0) + 1
+        self.scheduler.started(job.finish_tag)
+        job.started_at = time.monotonic()
+        logger.info(f"Загрузка #{job.id} ({job.platform}) начата после ожидания "
+                    f"{job.started_at - job.enqueued_at:.1f} с.")
+        pool_future = asyncio.get_running_loop().run_in_executor(
+            self._get_pool(), functools.partial(job.func, *job.args))
+        pool_future.add_done_callback(functools.partial(self._on_done, job))
+
+    def _on_done(self, job: Job, pool_future: asyncio.Future) -> None:
+        self._running.discard(job)
+        self._running_by_platform[job.platform] -= 1
+        self._running_by_user[job.user_id] -= 1
+        if not self._running_by_user[job.user_id]:
+            del self._running_by_user[job.user_id]
+
+        if pool_future.cancelled():
+            if not job.future.done():
+                job.future.cancel()
+        elif pool_future.exception() is not None:
+            if not job.future.done():
+                job.future.set_exception(pool_future.exception())
+        elif job.cancelled:
+            if job.on_discard is not None:
+                try:
+                    job.on_discard(pool_future.result())
+                except Exception as e_discard:
+                    logger.error(f"Не удалось убрать результат отмененной загрузки #{job.id}: {e_discard}",
+                                 exc_info=True)
+        elif not job.future.done():
+            job.future.set_result(pool_future.result())
+        if not pool_future.cancelled() and pool_future.exception() is None:
+            self.scheduler.record_duration(job.platform, time.monotonic() - job.started_at)
+
+        self._dispatch()
+
+    def shutdown(self, wait: bool = False) -> None:
+        """Stop the pool, dropping jobs that have not started yet."""
+        for job in list(self._pending):
+            self.cancel(job)
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait, cancel_futures=True)
+            self._pool = None
+
+
+download_executor = DownloadExecutor.from_env()
+metrics.registry.gauge("bot_queue_depth", "Downloads waiting in the queue.", lambda: download_executor.pending_count)
+metrics.registry.gauge("bot_running_jobs", "Downloads running in the pool.", lambda: download_executor.running_count)
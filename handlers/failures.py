@@ -0,0 +1,219 @@
+import logging
+import re
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from handlers import config, metrics
+from handlers.cache import TTLCache
+from handlers.executor import JobCancelledError, QueueFullError
+from handlers.workspace import WorkspaceFullError
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+PERMANENT = "permanent"
+TRANSIENT = "transient"
+
+# Ошибки, которые не исправятся повтором: видео удалено, закрыто, недоступно в стране, нарушает
+# ограничения бота. Все остальное (сеть, 429, "подтвердите, что вы не бот") считается временным
+PERMANENT_PATTERNS = re.compile(
+    r"private video|video unavailable|has been removed|no longer available|not available in your country"
+    r"|copyright|account .*(?:suspended|terminated)|unsupported url|http error 404|does not exist|confirm your age"
+    r"|короче \d+ минут|трансляции не поддерживаются|не удалось найти url изображения",
+    re.IGNORECASE,
+)
+# Штатные отказы самого бота (отмена, перегрузка) ничего не говорят о ссылке или платформе
+NOT_CLASSIFIED = (JobCancelledError, QueueFullError, WorkspaceFullError)
+
+CIRCUIT_TRIPS = metrics.registry.counter("bot_circuit_trips_total", "Times a platform circuit breaker opened.")
+
+
+class FastFailError(RuntimeError):
+    """A request refused without downloading: the outcome is already known or the platform is down."""
+
+
+class KnownFailureError(FastFailError):
+    """The same content failed recently; the cached error is returned instead of retrying."""
+
+
+class CircuitOpenError(FastFailError):
+    def __init__(self, platform: str, retry_after: float):
+        self.platform = platform
+        self.retry_after = retry_after
+        super().__init__(f"{platform} сейчас не отвечает на запросы бота. "
+                         f"Попробуйте через {max(1, round(retry_after / 60))} мин.")
+
+
+def classify_failure(error: BaseException) -> Optional[str]:
+    """PERMANENT or TRANSIENT for a download error, None for errors that say nothing about the link."""
+    if not isinstance(error, Exception) or isinstance(error, NOT_CLASSIFIED + (FastFailError,)):
+        return None
+    return PERMANENT if PERMANENT_PATTERNS.search(str(error)) else TRANSIENT
+
+
+@dataclass
+class CachedFailure:
+    kind: str
+    message: str
+
+
+class NegativeCache:
+    """Remembers recent failures per canonical content key; permanent ones for much longer."""
+
+    def __init__(self, permanent_ttl: float, transient_ttl: float, max_entries: int):
+        self.ttls = {PERMANENT: permanent_ttl, TRANSIENT: transient_ttl}
+        self._cache = TTLCache(max(permanent_ttl, transient_ttl), max_entries)
+
+    def get(self, key: str) -> Optional[CachedFailure]:
+        return self._cache.get(key)
+
+    def put(self, key: str, kind: str, message: str) -> None:
+        if self.ttls[kind] > 0:
+            self._cache.put(key, CachedFailure(kind, message), ttl_seconds=self.ttls[kind])
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+
+class CircuitBreaker:
+    """Error-rate circuit breaker for one platform.
+
+    Closed: requests pass and outcomes are counted over a sliding window. When the share of
+    transient failures reaches error_rate (with at least min_requests), it opens and refuses
+    requests for open_seconds. Then it is half-open: one probe request passes; success closes
+    the circuit, failure opens it again.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, platform: str, window_seconds: float, min_requests: int, error_rate: float,
+                 open_seconds: float):
+        self.platform = platform
+        self.window_seconds = window_seconds
+        self.min_requests = min_requests
+        self.error_rate = error_rate
+        self.open_seconds = open_seconds
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self._outcomes: deque[tuple[float, bool]] = deque()
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def _trim(self, now: float) -> None:
+        while self._outcomes and now - self._outcomes[0][0] > self.window_seconds:
+            self._outcomes.popleft()
+
+    def _open(self, now: float) -> None:
+        self.state = self.OPEN
+        self.opened_at = now
+        self._probing = False
+        CIRCUIT_TRIPS.inc(platform=self.platform)
+        logger.warning(f"{self.platform}: слишком много ошибок, запросы приостановлены на {self.open_seconds:.0f} с")
+
+    def acquire(self) -> bool:
+        """Let a request through or raise CircuitOpenError; True means this request is the half-open probe."""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == self.OPEN:
+                remaining = self.opened_at + self.open_seconds - now
+                if remaining > 0:
+                    raise CircuitOpenError(self.platform, remaining)
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN:
+                if self._probing:
+                    raise CircuitOpenError(self.platform, self.open_seconds)
+                self._probing = True
+                logger.info(f"{self.platform}: пробный запрос после паузы")
+                return True
+            return False
+
+    def record(self, ok: bool, probe: bool) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if probe:
+                self._probing = False
+                if ok:
+                    self.state = self.CLOSED
+                    self._outcomes.clear()
+                    logger.info(f"{self.platform}: пробный запрос успешен, запросы возобновлены")
+                else:
+                    self._open(now)
+                return
+            if self.state != self.CLOSED:
+                return  # Результат запроса, начатого до срабатывания
+            self._outcomes.append((now, ok))
+            self._trim(now)
+            failures = sum(not outcome for _, outcome in self._outcomes)
+            if len(self._outcomes) >= self.min_requests and failures / len(self._outcomes) >= self.error_rate:
+                self._open(now)
+
+    def release(self, probe: bool) -> None:
+        """Forget a request that ended without telling anything about the platform (cancelled, rejected)."""
+        if probe:
+            with self._lock:
+                self._probing = False
+
+
+class FailureGuard:
+    """Wraps downloads with the negative cache and per-platform circuit breakers."""
+
+    def __init__(self, negative_cache: NegativeCache, breaker_factory: Callable[[str], CircuitBreaker]):
+        self.negative_cache = negative_cache
+        self._breaker_factory = breaker_factory
+        self.breakers: dict[str, CircuitBreaker] = {}
+
+    @classmethod
+    def from_env(cls) -> "FailureGuard":
+        return cls(
+            NegativeCache(config.NEGATIVE_CACHE_PERMANENT_TTL, config.NEGATIVE_CACHE_TRANSIENT_TTL,
+                          config.NEGATIVE_CACHE_MAX_ENTRIES),
+            lambda platform: CircuitBreaker(platform, config.CIRCUIT_WINDOW_SECONDS, config.CIRCUIT_MIN_REQUESTS,
+                                            config.CIRCUIT_ERROR_RATE, config.CIRCUIT_OPEN_SECONDS),
+        )
+
+    def breaker(self, platform: str) -> CircuitBreaker:
+        if platform not in self.breakers:
+            self.breakers[platform] = self._breaker_factory(platform)
+        return self.breakers[platform]
+
+    async def run(self, platform: str, key: str, download: Callable[[], Awaitable[T]]) -> T:
+        """Run the download unless its failure is cached or the platform's circuit is open."""
+        cached = self.negative_cache.get(key)
+        if cached is not None:
+            logger.info(f"{key}: недавняя ошибка ({cached.kind}) из кэша, загрузка не запускается")
+            raise KnownFailureError(cached.message)
+        breaker = self.breaker(platform)
+        probe = breaker.acquire()
+        try:
+            result = await download()
+        except BaseException as e:
+            kind = classify_failure(e)
+            if kind is None:
+                breaker.release(probe)
+            else:
+                self.negative_cache.put(key, kind, str(e))
+                # Удаленное или закрытое видео - не признак проблем платформы
+                breaker.record(ok=kind == PERMANENT, probe=probe)
+            raise
+        breaker.record(ok=True, probe=probe)
+        return result
+
+    def remember(self, key: str, kind: str, message: str) -> None:
+        """Cache a failure found after the download (e.g. the file is over the upload limit)."""
+        logger.info(f"{key}: ошибка ({kind}) запомнена: {message}")
+        self.negative_cache.put(key, kind, message)
+
+    def describe(self) -> list[str]:
+        """Lines for /stats about platforms whose circuit is not closed."""
+        return [f"{breaker.platform}: {'пауза' if breaker.state == CircuitBreaker.OPEN else 'пробный запрос'}"
+                for breaker in self.breakers.values() if breaker.state != CircuitBreaker.CLOSED]
+
+
+failure_guard = FailureGuard.from_env()
+metrics.registry.gauge("bot_negative_cache_entries", "Failures remembered in the negative cache.",
+                       lambda: len(failure_guard.negative_cache))
@@ -0,0 +1,110 @@
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Формат по умолчанию, если yt-dlp не вернул список форматов
+DEFAULT_FORMAT = "bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best"
+# Для команды /audio качается только звуковая дорожка; если ее нет отдельно - видео целиком
+AUDIO_ONLY_FORMAT = "bestaudio[ext=m4a]/bestaudio/best"
+# Протоколы, которые yt-dlp не скачивает одним потоком (раскадровки и т.п.)
+SKIPPED_PROTOCOLS = ("mhtml",)
+# Предел высоты для склеиваемых форматов, когда размеры файлов неизвестны
+UNKNOWN_SIZE_MAX_HEIGHT = 720
+
+
+@dataclass
+class FormatPlan:
+    format_spec: str
+    height: Optional[int]
+    estimated_bytes: Optional[int]
+    progressive: bool
+    reason: str
+
+
+def estimate_format_size(fmt: dict, duration: Optional[float]) -> Optional[int]:
+    """Estimate a single format's size in bytes from filesize, filesize_approx or bitrate."""
+    size = fmt.get("filesize") or fmt.get("filesize_approx")
+    if not size and fmt.get("tbr") and duration:
+        size = fmt["tbr"] * 1000 / 8 * duration  # tbr в кбит/с
+    return int(size) if size else None
+
+
+def _has_video(fmt: dict) -> bool:
+    return fmt.get("vcodec") not in (None, "none")
+
+
+def _has_audio(fmt: dict) -> bool:
+    return fmt.get("acodec") not in (None, "none")
+
+
+def _quality(fmt: dict) -> tuple:
+    return fmt.get("height") or 0, fmt.get("tbr") or 0
+
+
+def _pick_best(candidates: list[tuple], progressive_ratio: float) -> tuple[tuple, str]:
+    best_merged = max((c for c in candidates if not c[3]), key=lambda c: c[4], default=None)
+    best_progressive = max((c for c in candidates if c[3]), key=lambda c: c[4], default=None)
+    if best_progressive and (best_merged is None
+                             or (best_progressive[1] or 0) >= (best_merged[1] or 0) * progressive_ratio):
+        return best_progressive, "готовый mp4 без склейки"
+    return best_merged, "лучшее качество со склейкой видео и аудио"
+
+
+def plan_format(info: dict, max_bytes: int, progressive_ratio: float = 0.75) -> FormatPlan:
+    """Pick the best quality that fits into max_bytes from the probed format list.
+
+    A pre-muxed (progressive) mp4 is preferred over a video+audio pair that needs an ffmpeg
+    merge when its height is at least progressive_ratio of the best merged option. If nothing
+    fits, the smallest option is returned so that a lower resolution is tried instead of failing.
+    """
+    formats = [f for f in info.get("formats") or [] if f.get("protocol") not in SKIPPED_PROTOCOLS]
+    if not formats:
+        return FormatPlan(DEFAULT_FORMAT, info.get("height"), None, False, "нет списка форматов")
+    duration = info.get("duration")
+
+    # (spec, height, size, progressive, quality)
+    candidates = []
+    # Только mp4: результат сохраняется как .mp4 и отправляется через send_video. Без готового mp4
+    # остаются склейка mp4+m4a ниже или DEFAULT_FORMAT
+    progressive = [f for f in formats if _has_video(f) and _has_audio(f) and f.get("ext") == "mp4"]
+    for fmt in progressive:
+        candidates.append((fmt["format_id"], fmt.get("height"), estimate_format_size(fmt, duration), True,
+                           _quality(fmt)))
+
+    audio_only = [f for f in formats if _has_audio(f) and not _has_video(f) and f.get("ext") == "m4a"]
+    if audio_only:
+        audio = max(audio_only, key=lambda f: f.get("abr") or f.get("tbr") or 0)
+        audio_size = estimate_format_size(audio, duration)
+        for fmt in formats:
+            if _has_video(fmt) and not _has_audio(fmt) and fmt.get("ext") == "mp4":
+                video_size = estimate_format_size(fmt, duration)
+                size = video_size + audio_size if video_size and audio_size else None
+                candidates.append((f"{fmt['format_id']}+{audio['format_id']}", fmt.get("height"), size, False,
+                                   _quality(fmt)))
+
+    if not candidates:
+        return FormatPlan(DEFAULT_FORMAT, info.get("height"), None, False, "нет подходящих mp4 форматов")
+
+    fitting = [c for c in candidates if c[2] is not None and c[2] <= max_bytes]
+    known = [c for c in candidates if c[2] is not None]
+    if fitting:
+        chosen, reason = _pick_best(fitting, progressive_ratio)
+    elif known:
+        chosen = min(known, key=lambda c: c[2])
+        reason = "ни один формат не укладывается в лимит, выбран самый маленький"
+    else:
+        # Размеры неизвестны - ограничиваемся умеренным разрешением
+        moderate = [c for c in candidates if (c[1] or 0) <= UNKNOWN_SIZE_MAX_HEIGHT]
+        if moderate:
+            chosen, reason = _pick_best(moderate, progressive_ratio)
+        else:
+            chosen, reason = min(candidates, key=lambda c: c[4]), "наименьшее доступное качество"
+        reason = f"размеры неизвестны, {reason}"
+
+    plan = FormatPlan(chosen[0], chosen[1], chosen[2], chosen[3], reason)
+    logger.info(f"План формата для {info.get('webpage_url') or info.get('id')}: {plan.format_spec} "
+                f"({plan.height}p, ~{plan.estimated_bytes} байт, лимит {max_bytes}) - {plan.reason}. "
+                f"Кандидатов: {len(candidates)}, в лимите: {len(fitting)}")
+    return plan
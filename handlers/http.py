@@ -0,0 +1,90 @@
+import codecs
+import logging
+import threading
+from html.parser import HTMLParser
+from typing import Optional
+
+from handlers import config
+from handlers.lazy import lazy_import
+
+logger = logging.getLogger(__name__)
+# requests нужен только для прямых загрузок и коротких ссылок, не для старта бота
+requests = lazy_import("requests")
+
+BROWSER_HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+        "AppleWebKit/537.36 (KHTML, like Gecko) "
+        "Chrome/91.0.4472.124 Safari/537.36"
+    )
+}
+
+_session: Optional["requests.Session"] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> "requests.Session":
+    """Shared keep-alive session for all direct fetches (pages, images, redirects)."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=config.HTTP_POOL_CONNECTIONS,
+                                      pool_maxsize=config.HTTP_POOL_MAXSIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+                logger.info(f"Создан общий HTTP пул: {config.HTTP_POOL_CONNECTIONS} хостов, "
+                            f"до {config.HTTP_POOL_MAXSIZE} соединений на хост")
+    return _session
+
+
+def close_session() -> None:
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+class OgImageParser(HTMLParser):
+    """Incremental parser that remembers the og:image URL (and a Pinterest <img> fallback)."""
+
+    def __init__(self):
+        super().__init__()
+        self.og_image: Optional[str] = None
+        self.fallback_image: Optional[str] = None
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, Optional[str]]]) -> None:
+        if self.og_image:
+            return
+        attributes = dict(attrs)
+        if tag == "meta" and "og:image" in (attributes.get("property"), attributes.get("name")):
+            self.og_image = attributes.get("content") or None
+        elif (tag == "img" and not self.fallback_image
+              and attributes.get("data-test-id") == "pin-closeup-image"):  # Примерный селектор, может измениться
+            self.fallback_image = attributes.get("src") or None
+
+    handle_startendtag = handle_starttag
+
+
+def find_og_image(response: "requests.Response", max_bytes: int = 2 * 1024 * 1024) -> Optional[str]:
+    """Read a streamed HTML response only until og:image is found.
+
+    Falls back to the Pinterest close-up <img> if the page has no og:image.
+    The response is closed as soon as parsing stops.
+    """
+    parser = OgImageParser()
+    decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")(errors="replace")
+    read_bytes = 0
+    try:
+        for chunk in response.iter_content(chunk_size=16384):
+            read_bytes += len(chunk)
+            parser.feed(decoder.decode(chunk))
+            if parser.og_image or read_bytes >= max_bytes:
+                break
+    finally:
+        response.close()
+    logger.debug(f"og:image поиск: прочитано {read_bytes} байт, найдено: {bool(parser.og_image)}")
+    return parser.og_image or parser.fallback_image
@@ -0,0 +1,279 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from handlers import config
+from handlers.executor import QueueFullError
+
+logger = logging.getLogger(__name__)
+
+# Пауза перед повторной попыткой: RETRY_BACKOFF * 2 ** (попытка - 1) секунд
+RETRY_BACKOFF = 5.0
+
+
+@dataclass
+class QueuedJob:
+    id: int
+    user_id: int
+    payload: dict
+    attempts: int
+    max_attempts: int
+
+
+class JobQueue(ABC):
+    """Durable queue shared by the bot frontend and download workers.
+
+    A worker leases a job for a visibility timeout and must ack it, fail it or extend the
+    lease before it runs out; otherwise the job becomes visible to other workers again.
+    Backends implement these methods; see JOB_QUEUE_BACKENDS.
+    """
+
+    @abstractmethod
+    def enqueue(self, user_id: int, payload: dict, max_attempts: int = 3, max_depth: Optional[int] = None) -> int:
+        """Add a job; raises QueueFullError if max_depth jobs are already waiting."""
+
+    @abstractmethod
+    def lease(self, worker_id: str, visibility_timeout: float) -> Optional[QueuedJob]:
+        """Take the oldest available job, or return None if there is none."""
+
+    @abstractmethod
+    def extend(self, job_id: int, worker_id: str, visibility_timeout: float) -> bool:
+        """Prolong the lease; False means the worker no longer owns the job."""
+
+    @abstractmethod
+    def ack(self, job_id: int, worker_id: str) -> bool:
+        """Mark the job done; False means the worker no longer owns the job."""
+
+    @abstractmethod
+    def fail(self, job_id: int, worker_id: str, error: str, retry: bool = True, retry_after: float = 0.0) -> bool:
+        """Record a failed attempt; returns True if the job will be retried.
+
+        The retry waits the exponential backoff, but at least retry_after seconds. Does nothing
+        and returns False if the worker no longer owns the job.
+        """
+
+    @abstractmethod
+    def release(self, job_id: int, worker_id: str) -> bool:
+        """Give the job back without counting the attempt; False means the worker no longer owns the job."""
+
+    @abstractmethod
+    def cancel_queued(self, user_id: int) -> list[dict]:
+        """Cancel the user's jobs that no worker has taken yet; returns their payloads."""
+
+    @abstractmethod
+    def pending_count(self) -> int:
+        """Number of jobs waiting for a worker."""
+
+    @abstractmethod
+    def stats(self) -> dict[str, int]:
+        """Number of jobs per status."""
+
+    @abstractmethod
+    def purge(self, older_than: float) -> int:
+        """Delete finished jobs older than the given number of seconds."""
+
+
+class SQLiteJobQueue(JobQueue):
+    """JobQueue in a local SQLite file, for workers running on the same machine or shared volume.
+
+    Leasing runs in a BEGIN IMMEDIATE transaction, so two workers never take the same job.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " user_id INTEGER NOT NULL,"
+            " payload TEXT NOT NULL,"
+            " status TEXT NOT NULL,"  # queued, leased, done, failed, cancelled
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " max_attempts INTEGER NOT NULL,"
+            " available_at REAL NOT NULL,"
+            " lease_owner TEXT,"
+            " lease_until REAL,"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " last_error TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status_available ON jobs (status, available_at)")
+
+    def enqueue(self, user_id: int, payload: dict, max_attempts: int = 3, max_depth: Optional[int] = None) -> int:
+        now = time.time()
+        with self._lock:
+            # Проверка глубины и вставка в одной транзакции: параллельные обработчики не превысят лимит
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if max_depth is not None:
+                    (pending,) = self._conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()
+                    if pending >= max_depth:
+                        raise QueueFullError(f"Бот сейчас перегружен: в очереди {pending} загрузок. "
+                                             f"Попробуйте через пару минут.")
+                cursor = self._conn.execute(
+                    "INSERT INTO jobs (user_id, payload, status, max_attempts, available_at, created_at, updated_at) "
+                    "VALUES (?, ?, 'queued', ?, ?, ?, ?)",
+                    (user_id, json.dumps(payload, ensure_ascii=False), max(1, max_attempts), now, now, now))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        logger.info(f"Задание #{cursor.lastrowid} пользователя {user_id} поставлено в очередь.")
+        return cursor.lastrowid
+
+    def lease(self, worker_id: str, visibility_timeout: float) -> Optional[QueuedJob]:
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Аренда истекла (воркер упал или завис), а попытки кончились - задание больше не выдаем
+                expired = self._conn.execute(
+                    "UPDATE jobs SET status = 'failed', lease_owner = NULL, updated_at = ?, "
+                    "last_error = 'истекла аренда' "
+                    "WHERE status = 'leased' AND lease_until < ? AND attempts >= max_attempts",
+                    (now, now)).rowcount
+                row = self._conn.execute(
+                    "SELECT id, user_id, payload, attempts, max_attempts FROM jobs "
+                    "WHERE (status = 'queued' AND available_at <= ?) OR (status = 'leased' AND lease_until < ?) "
+                    # Сначала задания пользователей, у которых сейчас меньше всего выполняющихся заданий
+                    "ORDER BY (SELECT COUNT(*) FROM jobs AS running WHERE running.user_id = jobs.user_id "
+                    "AND running.status = 'leased'), available_at, id LIMIT 1", (now, now)).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = 'leased', attempts = attempts + 1, lease_owner = ?, "
+                        "lease_until = ?, updated_at = ? WHERE id = ?",
+                        (worker_id, now + visibility_timeout, now, row[0]))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        if expired:
+            logger.warning(f"Заданий с истекшей арендой и без оставшихся попыток: {expired}, помечены как failed.")
+        if row is None:
+            return None
+        job_id, user_id, payload, attempts, max_attempts = row
+        return QueuedJob(id=job_id, user_id=user_id, payload=json.loads(payload),
+                         attempts=attempts + 1, max_attempts=max_attempts)
+
+    def extend(self, job_id: int, worker_id: str, visibility_timeout: float) -> bool:
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET lease_until = ?, updated_at = ? "
+                "WHERE id = ? AND status = 'leased' AND lease_owner = ?",
+                (now + visibility_timeout, now, job_id, worker_id))
+        return cursor.rowcount == 1
+
+    def ack(self, job_id: int, worker_id: str) -> bool:
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = 'done', lease_owner = NULL, updated_at = ? "
+                "WHERE id = ? AND status = 'leased' AND lease_owner = ?",
+                (time.time(), job_id, worker_id))
+        return cursor.rowcount == 1
+
+    def fail(self, job_id: int, worker_id: str, error: str, retry: bool = True, retry_after: float = 0.0) -> bool:
+        now = time.time()
+        with self._lock:
+            # Чтение попыток и запись в одной транзакции, и запись только пока аренда наша: иначе воркер
+            # с истекшей арендой вернул бы в очередь задание, которое уже выполняет другой воркер
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT attempts, max_attempts FROM jobs WHERE id = ? AND status = 'leased' AND lease_owner = ?",
+                    (job_id, worker_id)).fetchone()
+                will_retry = False
+                if row is not None:
+                    attempts, max_attempts = row
+                    will_retry = retry and attempts < max_attempts
+                    if will_retry:
+                        cursor = self._conn.execute(
+                            "UPDATE jobs SET status = 'queued', lease_owner = NULL, lease_until = NULL, "
+                            "available_at = ?, updated_at = ?, last_error = ? "
+                            "WHERE id = ? AND status = 'leased' AND lease_owner = ?",
+                            (now + max(RETRY_BACKOFF * 2 ** (attempts - 1), retry_after), now, error, job_id, worker_id))
+                    else:
+                        cursor = self._conn.execute(
+                            "UPDATE jobs SET status = 'failed', lease_owner = NULL, updated_at = ?, last_error = ? "
+                            "WHERE id = ? AND status = 'leased' AND lease_owner = ?",
+                            (now, error, job_id, worker_id))
+                    will_retry = will_retry and cursor.rowcount == 1
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return will_retry
+
+    def release(self, job_id: int, worker_id: str) -> bool:
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = 'queued', attempts = MAX(attempts - 1, 0), lease_owner = NULL, "
+                "lease_until = NULL, available_at = ?, updated_at = ? "
+                "WHERE id = ? AND status = 'leased' AND lease_owner = ?",
+                (now, now, job_id, worker_id))
+        return cursor.rowcount == 1
+
+    def cancel_queued(self, user_id: int) -> list[dict]:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT id, payload FROM jobs WHERE user_id = ? AND status = 'queued'", (user_id,)).fetchall()
+                self._conn.executemany(
+                    "UPDATE jobs SET status = 'cancelled', updated_at = ? WHERE id = ?",
+                    [(time.time(), job_id) for job_id, _ in rows])
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [json.loads(payload) for _, payload in rows]
+
+    def pending_count(self) -> int:
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()
+        return count
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return dict(rows)
+
+    def purge(self, older_than: float) -> int:
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed', 'cancelled') AND updated_at < ?",
+                (time.time() - older_than,))
+        return cursor.rowcount
+
+
+# Доступные реализации очереди; другой брокер подключается добавлением класса сюда
+JOB_QUEUE_BACKENDS: dict[str, Any] = {
+    "sqlite": lambda: SQLiteJobQueue(config.JOB_QUEUE_PATH),
+}
+
+
+def create_job_queue(kind: str) -> Optional[JobQueue]:
+    """Build the queue named by JOB_QUEUE, or None when downloads run inside the bot process."""
+    if not kind:
+        return None
+    factory = JOB_QUEUE_BACKENDS.get(kind)
+    if factory is None:
+        logger.error(f"Неизвестная очередь заданий JOB_QUEUE='{kind}', загрузки будут выполняться в процессе бота.")
+        return None
+    logger.info(f"Очередь заданий: {kind}. Загрузки выполняют процессы worker.py.")
+    return factory()
+
+
+job_queue = create_job_queue(config.JOB_QUEUE)
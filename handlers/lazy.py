@@ -0,0 +1,81 @@
+import importlib
+import logging
+import threading
+import time
+from types import ModuleType
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+# Сколько секунд занял отложенный импорт каждого модуля
+import_seconds: dict[str, float] = {}
+_lazy_modules: dict[str, "LazyModule"] = {}
+_warmups: list[tuple[str, Callable[[], None]]] = []
+
+
+class LazyModule:
+    """Stands in for a heavy module and imports it on first attribute access.
+
+    Setting an attribute sets it on the real module, so monkeypatching keeps working.
+    """
+
+    def __init__(self, name: str):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+        self.__dict__["_lock"] = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def load(self) -> ModuleType:
+        module = self._module
+        if module is None:
+            with self._lock:
+                module = self._module
+                if module is None:
+                    started = time.perf_counter()
+                    module = importlib.import_module(self._name)
+                    import_seconds[self._name] = time.perf_counter() - started
+                    logger.info(f"Модуль {self._name} загружен за {import_seconds[self._name]:.2f} с")
+                    self.__dict__["_module"] = module
+        return module
+
+    def __getattr__(self, attr: str):
+        return getattr(self.load(), attr)
+
+    def __setattr__(self, attr: str, value) -> None:
+        setattr(self.load(), attr, value)
+
+    def __repr__(self) -> str:
+        return f"<lazy module {self._name!r}{' (loaded)' if self.loaded else ''}>"
+
+
+def lazy_import(name: str) -> LazyModule:
+    """Return a placeholder for the module that imports it when first used."""
+    if name not in _lazy_modules:
+        _lazy_modules[name] = LazyModule(name)
+    return _lazy_modules[name]
+
+
+def register_warmup(name: str, func: Callable[[], None]) -> None:
+    """Add a step to warm_up(), e.g. building yt-dlp's extractor list."""
+    _warmups.append((name, func))
+
+
+def warm_up() -> None:
+    """Import every lazy module and run the warm-up steps; blocking, run it in a thread."""
+    started = time.perf_counter()
+    for name, module in _lazy_modules.items():
+        try:
+            module.load()
+        except Exception as e:
+            logger.warning(f"Прогрев: не удалось загрузить {name}: {e}")
+    for name, func in _warmups:
+        step_started = time.perf_counter()
+        try:
+            func()
+            logger.info(f"Прогрев: {name} за {time.perf_counter() - step_started:.2f} с")
+        except Exception as e:
+            logger.warning(f"Прогрев: шаг {name} не выполнен: {e}")
+    logger.info(f"Прогрев завершен за {time.perf_counter() - started:.2f} с")
@@ -0,0 +1,239 @@
+import bisect
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм длительности (секунды)
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: tuple[tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+class Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+
+    @abstractmethod
+    def samples(self) -> list[str]:
+        """Exposition lines of the metric's values, without HELP and TYPE."""
+
+    def render(self) -> str:
+        return "\n".join([f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}",
+                          *self.samples()])
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def values(self) -> dict[tuple, float]:
+        with self._lock:
+            return dict(self._values)
+
+    def samples(self) -> list[str]:
+        return [f"{self.name}{_format_labels(key)} {value:g}" for key, value in sorted(self.values().items())]
+
+
+class Gauge(Metric):
+    """Value read at scrape time from a callback, so the hot path pays nothing."""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, func: Callable[[], float]):
+        super().__init__(name, documentation)
+        self.func = func
+
+    def value(self) -> Optional[float]:
+        try:
+            return float(self.func())
+        except Exception as e:
+            logger.warning(f"Не удалось получить значение метрики {self.name}: {e}")
+            return None
+
+    def samples(self) -> list[str]:
+        value = self.value()
+        return [] if value is None else [f"{self.name} {value:g}"]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(sorted(buckets))
+        # метки -> (счетчики по корзинам + корзина +Inf, сумма, количество)
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Observe the duration of the block, also when it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def values(self) -> dict[tuple, tuple[list[int], float, int]]:
+        with self._lock:
+            return {key: (list(counts), total, count) for key, (counts, total, count) in self._values.items()}
+
+    def quantile(self, q: float, **labels: str) -> Optional[float]:
+        """Upper bound of the bucket holding the q-quantile (approximation, as in Prometheus)."""
+        entry = self.values().get(tuple(sorted(labels.items())))
+        if entry is None or not entry[2]:
+            return None
+        counts, _, count = entry
+        rank = q * count
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return bound
+        return float("inf")
+
+    def samples(self) -> list[str]:
+        lines = []
+        for key, (counts, total, count) in sorted(self.values().items()):
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += bucket_count
+                le = bound if bound == "+Inf" else f"{bound:g}"
+                lines.append(f"{self.name}_bucket{_format_labels((*key, ('le', le)))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total:g}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+
+    def _register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        return self._register(Counter(name, documentation))
+
+    def histogram(self, name: str, documentation: str, buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, buckets))
+
+    def gauge(self, name: str, documentation: str, func: Callable[[], float]) -> Gauge:
+        return self._register(Gauge(name, documentation, func))
+
+    def get(self, name: str) -> Optional[Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+registry = MetricsRegistry()
+
+REQUESTS = registry.counter("bot_requests_total", "Processed links by platform and outcome.")
+FAILURES = registry.counter("bot_failures_total", "Failed links by platform and exception class.")
+STAGE_SECONDS = registry.histogram(
+    "bot_stage_seconds", "Duration of processing stages (probe, download, merge, upload, total).")
+DOWNLOADED_BYTES = registry.counter("bot_downloaded_bytes_total", "Bytes fetched from the source platforms.")
+FILE_ID_CACHE = registry.counter("bot_file_id_cache_lookups_total", "file_id cache lookups by result.")
+
+# Текущие значения, которые /stats показывает первыми
+GAUGE_TITLES = {
+    "bot_queue_depth": "В очереди",
+    "bot_running_jobs": "Выполняется загрузок",
+    "bot_inflight_downloads": "Уникальных загрузок в работе",
+    "bot_temp_disk_bytes": "Временные файлы",
+}
+
+
+def format_stats() -> str:
+    """Short human readable summary for the /stats admin command."""
+    lines = ["<b>Статистика</b>"]
+    for name, title in GAUGE_TITLES.items():
+        metric = registry.get(name)
+        value = metric.value() if isinstance(metric, Gauge) else None
+        if value is not None:
+            lines.append(f"{title}: {value / 1024 / 1024:.1f} МБ" if name.endswith("_bytes") else f"{title}: {value:g}")
+
+    cache = {dict(key).get("result"): value for key, value in FILE_ID_CACHE.values().items()}
+    lookups = cache.get("hit", 0) + cache.get("miss", 0)
+    if lookups:
+        lines.append(f"Кэш file_id: {cache.get('hit', 0) / lookups:.0%} попаданий из {lookups:g}")
+
+    requests_by_outcome: dict[str, float] = {}
+    for key, value in REQUESTS.values().items():
+        outcome = dict(key).get("outcome", "")
+        requests_by_outcome[outcome] = requests_by_outcome.get(outcome, 0) + value
+    if requests_by_outcome:
+        lines.append("Запросы: " + ", ".join(f"{outcome} {count:g}"
+                                             for outcome, count in sorted(requests_by_outcome.items())))
+
+    for key, (_, total, count) in sorted(STAGE_SECONDS.values().items()):
+        labels = dict(key)
+        p50 = STAGE_SECONDS.quantile(0.5, **labels)
+        p95 = STAGE_SECONDS.quantile(0.95, **labels)
+        lines.append(f"{labels.get('platform')} / {labels.get('stage')}: n={count}, "
+                     f"среднее {total / count:.2f} с, p50 ≤{p50:g} с, p95 ≤{p95:g} с")
+
+    for key, value in sorted(DOWNLOADED_BYTES.values().items()):
+        lines.append(f"Скачано {dict(key).get('platform')}: {value / 1024 / 1024:.1f} МБ")
+
+    failures = sorted(FAILURES.values().items(), key=lambda item: -item[1])[:5]
+    if failures:
+        lines.append("Ошибки: " + ", ".join(f"{dict(key).get('exception')} ({dict(key).get('platform')}) {count:g}"
+                                            for key, count in failures))
+    return "\n".join(lines)
+
+
+async def start_metrics_server(host: str, port: int):
+    """Serve /metrics for Prometheus on a separate port; returns the aiohttp runner to clean up."""
+    from aiohttp import web
+
+    async def handle_metrics(request: web.Request) -> web.Response:
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Метрики Prometheus доступны на http://{host}:{port}/metrics")
+    return runner
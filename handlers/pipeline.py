@@ -0,0 +1,684 @@
+import asyncio
+import functools
+import html
+import os
+import logging
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from aiogram import Bot, types
+from aiogram.types import InputMediaAudio, InputMediaPhoto, InputMediaVideo
+
+from handlers import config, downloader, metrics
+from handlers.cache import file_id_cache, file_ref_from_message
+from handlers.config import ADMIN_ID
+from handlers.executor import JobCancelledError, QueueFullError, download_executor
+from handlers.failures import PERMANENT, TRANSIENT, FastFailError, classify_failure, failure_guard
+from handlers.postprocess import postprocessor, read_media_info
+from handlers.progress import ProgressReporter, ProgressState, edit_limiter
+from handlers.reports import admin_digest, join_lines
+from handlers.scheduler import user_rate_limiter
+from handlers.singleflight import Flight, inflight_downloads
+from handlers.streaming import Media, RemoteMedia, check_upload_size, media_ext, media_name, to_input_file
+from handlers.urls import Link, extract_links, parse_link, short_links
+from handlers.workspace import WorkspaceFullError, workspace
+
+# Настройка логгера для этого модуля
+logger = logging.getLogger(__name__)
+
+MSG_TEXT_TEMPLATE = """
+<b>Platform: {}</b>
+
+Downloading {}
+Sending {}
+    """
+
+# Тип файла по расширению: определяет метод отправки (send_video, send_photo, send_audio)
+FILE_TYPES = {
+    ".mp4": "video",
+    ".png": "photo",
+    ".mp3": "audio",
+    ".m4a": "audio",
+}
+# Telegram принимает в одну медиагруппу от 2 до 10 файлов; фото и видео можно смешивать, аудио - только с аудио
+MEDIA_GROUP_SIZE = 10
+INPUT_MEDIA = {"photo": InputMediaPhoto, "video": InputMediaVideo, "audio": InputMediaAudio}
+MEDIA_GROUP_KINDS = {"photo": "visual", "video": "visual", "audio": "audio"}
+BATCH_ICONS = {"queued": "🕒", "downloading": "🟨", "ready": "✅", "sent": "✅", "failed": "⚠️"}
+
+
+class RetryLaterError(RuntimeError):
+    """A download failed with a transient error that the job queue will retry instead of reporting it now."""
+
+
+@dataclass
+class LinkRequest:
+    """Everything needed to process a link without the original Message object.
+
+    It is plain data, so the same request can be handled in-process or passed through
+    the job queue to a download worker.
+    """
+    chat_id: int
+    message_id: int
+    status_message_id: int
+    user_id: int
+    user_full_name: str
+    username: Optional[str]
+    text: str
+    # Команда /audio: вместо видео отправляется только звук в формате AUDIO_FORMAT
+    audio_only: bool = False
+
+    @property
+    def audio_format(self) -> Optional[str]:
+        return config.AUDIO_FORMAT if self.audio_only else None
+
+    def content_key(self, link: Link) -> str:
+        """Key for the file_id cache and download coalescing: audio and video of a link are different files.
+
+        Spotify always gives the same mp3, so /audio and a plain Spotify link share one key and one download.
+        """
+        return f"{link.key}:{self.audio_format}" if self.audio_only and link.platform != "Spotify" else link.key
+
+    @classmethod
+    def from_message(cls, message: types.Message, status_message: types.Message,
+                     audio_only: bool = False) -> "LinkRequest":
+        return cls(
+            chat_id=message.chat.id,
+            message_id=message.message_id,
+            status_message_id=status_message.message_id,
+            user_id=message.from_user.id,
+            user_full_name=message.from_user.full_name,
+            username=message.from_user.username,
+            text=message.text,
+            audio_only=audio_only,
+        )
+
+
+def _remove_discarded_file(media: Media) -> None:
+    """Remove a file produced by a download whose requester has already cancelled."""
+    if isinstance(media, RemoteMedia):
+        return
+    filename = media
+    if filename and workspace.remove(filename):
+        logger.info(f"Файл отмененной загрузки {filename} удален.")
+
+
+def _remove_downloaded_file(media: Media) -> None:
+    """Delete a temp file and its job directory once the last waiter of its download has sent it."""
+    if isinstance(media, RemoteMedia):
+        return  # Отправлялось потоком, на диске ничего нет
+    filename = media
+    if workspace.remove(filename):
+        logger.info(f"Временный файл {filename} удален.")
+    else: # Файл должен был быть, но его нет
+        logger.warning(f"Временный файл {filename} не найден для удаления.")
+
+
+def _start_download(dl: downloader.Downloader, request: LinkRequest, link: Link, base_filename: str) -> Flight:
+    """Join the shared download of the link: fetched in the download pool, then post-processed.
+
+    Identical links sent at the same time wait for the same download; its progress and queue
+    position are in flight.context for every waiter. A link that failed recently or a platform
+    with an open circuit breaker is refused at once.
+    """
+    async def report_position(progress: ProgressState, position: int, wait_seconds: float) -> None:
+        progress.set_queue_position(position, wait_seconds)
+
+    async def download(progress: ProgressState) -> Media:
+        media = await failure_guard.run(link.platform, request.content_key(link), lambda: download_executor.run(
+            link.platform,
+            request.user_id,
+            dl.download,
+            link.platform,
+            link.url,
+            base_filename,
+            # В пул процессов общий объект прогресса не передать
+            progress if download_executor.shares_memory else None,
+            request.audio_only,
+            on_position=functools.partial(report_position, progress),
+            on_discard=_remove_discarded_file,
+        ))
+        progress.set_stage("обработка")
+        media = await postprocessor.run(media, link.platform, request.audio_format)
+        try:
+            check_upload_size(media)
+        except ValueError as e:
+            # Файл не станет меньше при повторе: запоминаем отказ, но платформа тут ни при чем
+            failure_guard.remember(request.content_key(link), PERMANENT, str(e))
+            _remove_discarded_file(media)
+            raise
+        return media
+
+    return inflight_downloads.join(request.content_key(link), download, cleanup=_remove_downloaded_file,
+                                   context=ProgressState())
+
+
+def _send_options(file_type: str, media: Media) -> dict:
+    """Size, duration and thumbnail found by post-processing, for send_video/send_audio and InputMedia."""
+    if isinstance(media, RemoteMedia):
+        return {}
+    info = read_media_info(media)
+    if info is None:
+        return {}
+    options = {"duration": round(info.duration)} if info.duration else {}
+    if file_type == "video":
+        if info.width and info.height:
+            options.update(width=info.width, height=info.height)
+        if info.thumbnail:
+            options["thumbnail"] = types.FSInputFile(info.thumbnail)
+        options["supports_streaming"] = info.faststart
+    return options
+
+
+async def _answer_from_cache(bot: Bot, request: "LinkRequest",
+                             content_key: str) -> Optional[tuple[str, types.Message]]:
+    """Re-send already uploaded content by file_id; returns (file_type, sent message) on a hit."""
+    if file_id_cache is None:
+        return None
+    cached = file_id_cache.get(content_key)
+    if cached is None:
+        return None
+    file_type, file_id = cached
+    try:
+        sent_message = await getattr(bot, f"send_{file_type}")(request.chat_id, file_id)
+    except Exception as e_cached_send:
+        # file_id мог стать недействительным - удаляем запись и качаем заново
+        logger.warning(f"Не удалось отправить {content_key} из кэша file_id: {e_cached_send}")
+        file_id_cache.delete(content_key)
+        return None
+    logger.info(f"Кэш file_id: {content_key} отправлен пользователю {request.user_id} без скачивания")
+    return file_type, sent_message
+
+
+def _remember_file_id(content_key: str, sent_message: types.Message) -> None:
+    """Store the file_id of a freshly uploaded file for later re-sends."""
+    if file_id_cache is None:
+        return
+    file_ref = file_ref_from_message(sent_message)
+    if file_ref is None:
+        logger.warning(f"В ответе Telegram нет file_id для {content_key}, кэш не обновлен.")
+        return
+    try:
+        file_id_cache.put(content_key, *file_ref)
+    except Exception as e_cache_put:
+        logger.error(f"Не удалось сохранить file_id для {content_key}: {e_cache_put}", exc_info=True)
+
+
+def _describe_user(request: LinkRequest) -> str:
+    return f"{request.user_full_name} (@{request.username or 'N/A'}, ID: {request.user_id})"
+
+
+async def _send_admin_copy(bot: Bot, request: LinkRequest, platform_name: str,
+                           user_file_message: types.Message) -> None:
+    """Send the admin the file the user got, by file_id, so it is not uploaded a second time."""
+    caption = (
+        f"Копия файла для пользователя: {request.user_full_name} (@{request.username or 'N/A'})\n"
+        f"ID: {request.user_id}\n"
+        f"Оригинальная ссылка (первые 100 симв.): {request.text[:100]}{'...' if len(request.text) > 100 else ''}"
+    )
+    file_ref = file_ref_from_message(user_file_message)
+    try:
+        if file_ref is not None:
+            file_type, file_id = file_ref
+            await getattr(bot, f"send_{file_type}")(ADMIN_ID, file_id, caption=caption, parse_mode="HTML")
+        else:
+            await bot.copy_message(ADMIN_ID, from_chat_id=request.chat_id,
+                                   message_id=user_file_message.message_id, caption=caption, parse_mode="HTML")
+        logger.info(f"Копия файла пользователя {request.user_id} отправлена админу {ADMIN_ID} без повторной загрузки.")
+    except Exception as e_admin_copy:
+        logger.error(f"Не удалось отправить копию файла админу {ADMIN_ID}: {e_admin_copy}", exc_info=True)
+        admin_digest.record_error(platform_name, _describe_user(request), request.text,
+                                  f"Файл отправлен пользователю, но копия администратору не отправлена: {e_admin_copy}")
+
+
+async def process_link(bot: Bot, request: LinkRequest, retry_transient: bool = False) -> None:
+    """Process a message: one link as a single download, several links or a playlist as a batch.
+
+    Errors meant for the user are reported in the status message and not re-raised. With
+    retry_transient a transient download failure of a single link raises RetryLaterError instead.
+    """
+    links = extract_links(request.text)
+    if len(links) > 1 or (links and links[0].playlist):
+        await process_batch(bot, request, links)
+    else:
+        await process_single(bot, request, links, retry_transient)
+
+
+async def process_single(bot: Bot, request: LinkRequest, links: list[Link], retry_transient: bool = False) -> None:
+    """Download one link, send the result to the user and report to the admin."""
+    async def edit_status(text: str) -> None:
+        await bot.edit_message_text(text, chat_id=request.chat_id, message_id=request.status_message_id)
+
+    downloaded_filename = None
+    downloaded_media = None
+    file_type = None
+    user_file_message = None
+    flight = None
+    platform_name = "не определена"
+    outcome = "failed"
+    started = time.perf_counter()
+
+    try:
+        dl = downloader.Downloader()
+        if not links:
+            raise ValueError("Ссылка не поддерживается. Поддерживаемые ссылки - /supported_links")
+
+        link = links[0]
+        if link.short:
+            # pin.it и vt.tiktok.com раскрываем (с кэшем), чтобы кэш и объединение загрузок видели один ключ
+            link = await asyncio.to_thread(short_links.resolve, link)
+        platform_name = link.platform
+        content_key = request.content_key(link)
+        cached = await _answer_from_cache(bot, request, content_key)
+        if file_id_cache is not None:
+            metrics.FILE_ID_CACHE.inc(result="miss" if cached is None else "hit")
+        if cached is not None:
+            file_type, user_file_message = cached
+        else:
+            await edit_status(MSG_TEXT_TEMPLATE.format(platform_name, "🟨", "❌"))
+
+            base_filename_for_dl = str(f"{time.time()}-{request.user_id}")
+            # Загрузка блокирующая (yt-dlp, requests, spotdl), поэтому выполняется в пуле воркеров,
+            # а обработчик лишь ждет результат, не останавливая остальные чаты.
+            flight = _start_download(dl, request, link, base_filename_for_dl)
+
+            async def render_progress(progress_text: str) -> None:
+                mark = "🕒" if flight.context.queue_position else "🟨"
+                await edit_status(
+                    MSG_TEXT_TEMPLATE.format(platform_name, f"{mark} {progress_text}", "❌"))
+
+            # Прогресс и место в очереди общей загрузки показываются каждому ожидающему в его статусном сообщении
+            reporter = ProgressReporter(flight.context, request.chat_id, render_progress)
+            reporter.start()
+            try:
+                # /cancel этого пользователя отцепляет только его; загрузка отменится, когда уйдут все
+                await inflight_downloads.wait(flight, request.user_id)
+            except BaseException as e:
+                flight = None  # Ссылка уже освобождена в wait
+                if retry_transient and classify_failure(e) == TRANSIENT:
+                    raise RetryLaterError(str(e)) from e
+                raise
+            finally:
+                reporter.stop()
+            downloaded_media = flight.result
+            downloaded_filename = media_name(downloaded_media)
+            logger.info(f"Файл скачан: {downloaded_filename} для пользователя {request.user_id}")
+
+            file_ext = media_ext(downloaded_media)
+            file_type = FILE_TYPES.get(file_ext)
+
+            if not file_type:
+                logger.error(
+                    f"Не удалось определить тип файла для '{downloaded_filename}' (расширение '{file_ext}' неизвестно).")
+                raise ValueError(
+                    f"Не удалось определить тип файла для скачанного контента (расширение '{file_ext}' неизвестно).")
+            logger.info(f"Тип файла определен как: {file_type}")
+
+            await edit_status(MSG_TEXT_TEMPLATE.format(platform_name, "✅", "🟨"))
+
+            async with flight.upload_lock:
+                # Пока мы ждали, этот же файл мог загрузить другой ожидающий - тогда хватит file_id
+                cached = await _answer_from_cache(bot, request, content_key)
+                if cached is not None:
+                    user_file_message = cached[1]
+                else:
+                    # Отправка файла пользователю
+                    logger.info(f"Отправка файла {downloaded_filename} пользователю {request.user_id}")
+                    with metrics.STAGE_SECONDS.time(platform=platform_name, stage="upload"):
+                        sent_message = await getattr(
+                            bot,
+                            f"send_{file_type}")(
+                            request.chat_id,
+                            to_input_file(downloaded_media),
+                            **_send_options(file_type, downloaded_media),
+                        )
+                    logger.info(f"Файл {downloaded_filename} успешно отправлен пользователю {request.user_id}")
+                    _remember_file_id(content_key, sent_message)
+                    user_file_message = sent_message
+
+        await asyncio.sleep(0.5) # Небольшая пауза для обновления статуса, не блокирующая цикл событий
+        await edit_status(MSG_TEXT_TEMPLATE.format(platform_name, "✅", "✅"))
+        outcome = "cache_hit" if downloaded_media is None else "success"
+
+        # Удаляем исходное сообщение пользователя и статусное сообщение бота ПОСЛЕ успешной отправки
+        try:
+            await bot.delete_message(request.chat_id, request.message_id)
+            logger.info(f"Сообщение пользователя {request.user_id} (ID: {request.message_id}) удалено.")
+        except Exception as e_del_msg:
+            logger.warning(f"Не удалось удалить сообщение пользователя {request.user_id}: {e_del_msg}", exc_info=True)
+
+        try:
+            await bot.delete_message(request.chat_id, request.status_message_id)
+            logger.info(f"Статусное сообщение бота (ID: {request.status_message_id}) удалено.")
+        except Exception as e_del_status:
+            logger.warning(f"Не удалось удалить статусное сообщение бота: {e_del_status}", exc_info=True)
+
+        # Отчет администратору идет в периодическую сводку, а копию файла пересылаем по file_id -
+        # без повторной загрузки. Файлы из кэша администратор уже видел, их не дублируем.
+        if ADMIN_ID and request.user_id != ADMIN_ID:
+            admin_digest.record_success(platform_name, request.user_id, from_cache=downloaded_media is None)
+            if downloaded_media is not None and user_file_message is not None:
+                await _send_admin_copy(bot, request, platform_name, user_file_message)
+
+
+    except RetryLaterError as e:
+        # Временная ошибка загрузки: задание повторит очередь, пользователю пока только сообщаем о повторе
+        outcome = "retry"
+        logger.warning(f"Загрузка {request.text} пользователя {request.user_id} будет повторена: {e}")
+        try:
+            await edit_status(MSG_TEXT_TEMPLATE.format(platform_name, "🔁 повтор после ошибки", "❌"))
+        except Exception as e_edit:
+            logger.warning(f"Не удалось отредактировать статусное сообщение: {e_edit}", exc_info=True)
+        raise
+
+    except (QueueFullError, WorkspaceFullError, JobCancelledError, FastFailError) as e:
+        # Перегрузка, отмена и уже известные ошибки - штатные ситуации, отчет администратору не нужен
+        outcome = ("cancelled" if isinstance(e, JobCancelledError)
+                   else "fast_fail" if isinstance(e, FastFailError) else "rejected")
+        logger.info(f"Запрос {request.text} от пользователя {request.user_id} не выполнен: {e}")
+        try:
+            await edit_status(f"⚠️ {e}")
+        except Exception as e_edit:
+            logger.warning(f"Не удалось отредактировать статусное сообщение: {e_edit}", exc_info=True)
+
+    except Exception as e:
+        outcome = "failed"
+        metrics.FAILURES.inc(platform=platform_name, exception=type(e).__name__)
+        error_message = str(e)
+        logger.error(f"Ошибка при обработке ссылки {request.text} от пользователя {request.user_id}: {e}",
+                      exc_info=True)
+        try:
+            await edit_status(f"⚠️ Произошла ошибка: {error_message}")
+        except Exception as e_edit:
+            logger.warning(f"Не удалось отредактировать статусное сообщение об ошибке: {e_edit}", exc_info=True)
+            try:
+                await bot.send_message(request.chat_id, f"⚠️ Произошла ошибка: {error_message}")
+            except Exception as e_answer_err:
+                 logger.error(f"Не удалось отправить пользователю сообщение об ошибке: {e_answer_err}", exc_info=True)
+
+
+        # Ошибка попадет в ближайшую сводку администратору
+        if ADMIN_ID and request.user_id != ADMIN_ID:
+            admin_digest.record_error(platform_name, _describe_user(request), request.text, error_message)
+
+    finally:
+        metrics.REQUESTS.inc(platform=platform_name, outcome=outcome)
+        if outcome in ("success", "cache_hit"):
+            metrics.STAGE_SECONDS.observe(time.perf_counter() - started, platform=platform_name, stage="total")
+        # Освобождаем общую загрузку; временный файл удаляется после отправки последним ожидающим
+        if flight is not None:
+            try:
+                inflight_downloads.release(flight)
+            except Exception as e_remove:
+                logger.error(f"Ошибка удаления файла {downloaded_filename}: {e_remove}", exc_info=True)
+                # Дополнительно уведомить админа о проблеме с удалением файла
+                if ADMIN_ID and request.user_id != ADMIN_ID: # Проверяем, что пользователь не админ
+                    try:
+                        await bot.send_message(
+                            ADMIN_ID,
+                            f"‼️ <b>КРИТИЧЕСКАЯ ОШИБКА ФАЙЛОВОЙ СИСТЕМЫ (pipeline.py):</b>\n"
+                            f"Не удалось удалить временный файл: <code>{os.path.basename(downloaded_filename)}</code>\n"
+                            f"Полный путь: <code>{downloaded_filename}</code>\n"
+                            f"Ошибка: <code>{e_remove}</code>\n"
+                            f"Запрос от пользователя: @{request.username or 'N/A'} (ID: {request.user_id})",
+                            parse_mode="HTML"
+                        )
+                    except Exception as e_admin_file_remove_notify:
+                        logger.error(
+                            f"Не удалось отправить админу сообщение об ошибке удаления файла: {e_admin_file_remove_notify}", exc_info=True)
+
+
+@dataclass(eq=False)
+class BatchItem:
+    """One link of a batch and what has happened to it so far."""
+    link: Link
+    state: str = "queued"
+    flight: Optional[Flight] = None
+    file_type: Optional[str] = None
+    # Скачанный файл, а для попадания в кэш - его file_id
+    file: Optional[Media] = None
+    from_cache: bool = False
+    message: Optional[types.Message] = None
+    error: Optional[Exception] = None
+
+    @property
+    def title(self) -> str:
+        return f"{self.link.platform} {self.link.content_id or self.link.url}"
+
+    @property
+    def position(self) -> int:
+        """Place of the item's shared download in the pool queue, 0 if it is not waiting there."""
+        if self.flight is None or self.state != "downloading":
+            return 0
+        return self.flight.context.queue_position
+
+
+def _render_batch(items: list[BatchItem], skipped: int) -> str:
+    done = sum(item.state in ("ready", "sent") for item in items)
+    failed = sum(item.state == "failed" for item in items)
+    lines = [f"<b>Ссылок: {len(items)}</b>, готово {done}, ошибок {failed}"]
+    for number, item in enumerate(items, start=1):
+        mark = f"{BATCH_ICONS['queued']} #{item.position}" if item.position else BATCH_ICONS[item.state]
+        line = f"{mark} {number}. {html.escape(item.title)}"
+        if item.error is not None:
+            line += f" - {html.escape(str(item.error)[:200])}"
+        lines.append(line)
+    if skipped:
+        lines.append(f"Еще {skipped} пропущено: за один раз скачивается не больше {config.BATCH_MAX_ITEMS}.")
+    return join_lines(lines)
+
+
+async def _expand_batch(dl: downloader.Downloader, links: list[Link]) -> tuple[list[Link], int]:
+    """Replace playlists with their videos and short links with full ones; returns (links, skipped)."""
+    expanded: list[Link] = []
+    for link in links:
+        if link.playlist:
+            with metrics.STAGE_SECONDS.time(platform=link.platform, stage="probe"):
+                urls = await asyncio.to_thread(dl.list_playlist, link.url, config.BATCH_MAX_ITEMS)
+            expanded.extend(entry for entry in map(parse_link, urls) if entry is not None and not entry.playlist)
+        else:
+            expanded.append(link)
+    # Короткие ссылки раскрываются параллельно; раскрытые уже совпадают по ключу с полными
+    short = [link for link in expanded if link.short]
+    resolved = dict(zip(short, await asyncio.gather(*(asyncio.to_thread(short_links.resolve, link)
+                                                      for link in short))))
+    unique: dict[str, Link] = {}
+    for link in expanded:
+        link = resolved.get(link, link)
+        unique.setdefault(link.key, link)
+    selected = list(unique.values())
+    return selected[:config.BATCH_MAX_ITEMS], max(0, len(selected) - config.BATCH_MAX_ITEMS)
+
+
+async def _fetch_batch_item(dl: downloader.Downloader, request: LinkRequest, item: BatchItem,
+                            changed: Callable[[], None]) -> None:
+    """Get one batch item ready for sending: a cached file_id or a downloaded file."""
+    link = item.link
+    if file_id_cache is not None:
+        cached = file_id_cache.get(request.content_key(link))
+        metrics.FILE_ID_CACHE.inc(result="miss" if cached is None else "hit")
+        if cached is not None:
+            item.file_type, item.file = cached
+            item.from_cache = True
+            item.state = "ready"
+            changed()
+            return
+
+    # Ссылки пакета ставятся в пул все сразу; сколько из них качается одновременно, решает
+    # планировщик по лимиту пользователя (USER_CONCURRENCY), как и для отдельных сообщений
+    item.flight = _start_download(dl, request, link, f"{time.time()}-{request.user_id}")
+    item.state = "downloading"
+    changed()
+    try:
+        await inflight_downloads.wait(item.flight, request.user_id)
+    except BaseException:
+        item.flight = None  # Ссылка уже освобождена в wait
+        raise
+    item.file = item.flight.result
+    item.file_type = FILE_TYPES.get(media_ext(item.file))
+    if item.file_type is None:
+        raise ValueError(f"Не удалось определить тип файла {media_name(item.file)}.")
+    item.state = "ready"
+    changed()
+
+
+async def _send_batch(bot: Bot, request: LinkRequest, items: list[BatchItem]) -> None:
+    """Send ready items as media groups of up to 10; animations and documents from the cache go one by one."""
+    groups: dict[str, list[BatchItem]] = {}
+    singles: list[BatchItem] = []
+    for item in items:
+        if item.state != "ready":
+            continue
+        kind = MEDIA_GROUP_KINDS.get(item.file_type)
+        if kind is None:
+            singles.append(item)
+        else:
+            groups.setdefault(kind, []).append(item)
+    chunks = [group[start:start + MEDIA_GROUP_SIZE]
+              for group in groups.values() for start in range(0, len(group), MEDIA_GROUP_SIZE)]
+    chunks += [[item] for item in singles]
+
+    for chunk in chunks:
+        files = [item.file if item.from_cache else to_input_file(item.file) for item in chunk]
+        # У файлов из кэша Telegram уже знает размеры и превью
+        options = [{} if item.from_cache else _send_options(item.file_type, item.file) for item in chunk]
+        try:
+            if len(chunk) == 1:
+                messages = [await getattr(bot, f"send_{chunk[0].file_type}")(request.chat_id, files[0],
+                                                                              **options[0])]
+            else:
+                messages = await bot.send_media_group(
+                    request.chat_id,
+                    [INPUT_MEDIA[item.file_type](media=file, **item_options)
+                     for item, file, item_options in zip(chunk, files, options)])
+        except Exception as e:
+            logger.error(f"Не удалось отправить {len(chunk)} файл(ов) пакета пользователю {request.user_id}: {e}",
+                         exc_info=True)
+            for item in chunk:
+                item.state = "failed"
+                item.error = e
+            continue
+        for item, message in zip(chunk, messages):
+            item.state = "sent"
+            item.message = message
+            if not item.from_cache:
+                _remember_file_id(request.content_key(item.link), message)
+    logger.info(f"Пакет пользователя {request.user_id} отправлен: {len(chunks)} сообщений "
+                f"для {sum(len(chunk) for chunk in chunks)} файлов")
+
+
+async def process_batch(bot: Bot, request: LinkRequest, links: list[Link]) -> None:
+    """Download several links or playlist entries in parallel and send them as media groups.
+
+    A single status message shows every item and is edited at most once per PROGRESS_INTERVAL.
+    """
+    async def edit_status(text: str) -> None:
+        await bot.edit_message_text(text, chat_id=request.chat_id, message_id=request.status_message_id)
+
+    dl = downloader.Downloader()
+    items: list[BatchItem] = []
+    skipped = 0
+    started = time.perf_counter()
+    status_changed = asyncio.Event()
+
+    async def report_progress(shown: str) -> None:
+        while True:
+            # Места в очереди общих загрузок меняются без события, поэтому проверяем и по таймеру
+            try:
+                await asyncio.wait_for(status_changed.wait(), config.PROGRESS_INTERVAL or None)
+            except asyncio.TimeoutError:
+                pass
+            status_changed.clear()
+            text = _render_batch(items, skipped)
+            if text != shown and edit_limiter.try_acquire(request.chat_id):
+                try:
+                    await edit_status(text)
+                    shown = text
+                except Exception as e_edit:
+                    logger.warning(f"Не удалось обновить статус пакета: {e_edit}")
+            await asyncio.sleep(config.PROGRESS_INTERVAL)
+
+    async def fetch(item: BatchItem) -> None:
+        try:
+            await _fetch_batch_item(dl, request, item, status_changed.set)
+        except Exception as e:
+            logger.warning(f"Элемент пакета {item.link.url} пользователя {request.user_id} не скачан: {e}")
+            item.state = "failed"
+            item.error = e
+            status_changed.set()
+
+    reporter = None
+    try:
+        try:
+            selected, skipped = await _expand_batch(dl, links)
+        except Exception as e:
+            logger.error(f"Не удалось разобрать пакет {request.text} пользователя {request.user_id}: {e}",
+                         exc_info=True)
+            metrics.FAILURES.inc(platform="batch", exception=type(e).__name__)
+            await edit_status(f"⚠️ Произошла ошибка: {e}")
+            if ADMIN_ID and request.user_id != ADMIN_ID:
+                admin_digest.record_error("batch", _describe_user(request), request.text, str(e))
+            return
+        if not selected:
+            await edit_status("⚠️ В сообщении не найдено ни одного видео для скачивания.")
+            return
+        # Во фронтенде оплачено по токену за ссылку сообщения; видео из плейлистов доплачиваются долгом,
+        # чтобы несколько плейлистов не заняли очередь загрузок за пару токенов. С JOB_QUEUE пакет разбирает
+        # воркер, и долг остается в его лимитере, который фронтенд не проверяет
+        user_rate_limiter.charge(request.user_id, len(selected) - min(len(links), user_rate_limiter.burst))
+        items = [BatchItem(link) for link in selected]
+        initial_status = _render_batch(items, skipped)
+        await edit_status(initial_status)
+        reporter = asyncio.create_task(report_progress(initial_status))
+        await asyncio.gather(*(fetch(item) for item in items))
+        reporter.cancel()
+        with metrics.STAGE_SECONDS.time(platform="batch", stage="upload"):
+            await _send_batch(bot, request, items)
+    finally:
+        if reporter is not None:
+            reporter.cancel()
+        # Временные файлы удаляются, когда их отпустит последний ожидающий
+        for item in items:
+            if item.flight is not None:
+                try:
+                    inflight_downloads.release(item.flight)
+                except Exception as e_remove:
+                    logger.error(f"Ошибка удаления файла {media_name(item.file)}: {e_remove}", exc_info=True)
+
+    failed = [item for item in items if item.state == "failed"]
+    for item in items:
+        if item.state != "failed":
+            outcome = "cache_hit" if item.from_cache else "success"
+        elif isinstance(item.error, JobCancelledError):
+            outcome = "cancelled"
+        elif isinstance(item.error, FastFailError):
+            outcome = "fast_fail"
+        elif isinstance(item.error, (QueueFullError, WorkspaceFullError)):
+            outcome = "rejected"
+        else:
+            outcome = "failed"
+            metrics.FAILURES.inc(platform=item.link.platform, exception=type(item.error).__name__)
+        metrics.REQUESTS.inc(platform=item.link.platform, outcome=outcome)
+        if ADMIN_ID and request.user_id != ADMIN_ID:
+            if outcome == "failed":
+                admin_digest.record_error(item.link.platform, _describe_user(request), item.link.url,
+                                          str(item.error))
+            elif outcome in ("success", "cache_hit"):
+                admin_digest.record_success(item.link.platform, request.user_id, from_cache=item.from_cache)
+                if not item.from_cache and item.message is not None:
+                    await _send_admin_copy(bot, request, item.link.platform, item.message)
+    metrics.STAGE_SECONDS.observe(time.perf_counter() - started, platform="batch", stage="total")
+
+    if failed:
+        # Итог с ошибками оставляем пользователю, чтобы было видно, что не скачалось
+        try:
+            await edit_status(_render_batch(items, skipped))
+        except Exception as e_edit:
+            logger.warning(f"Не удалось показать итог пакета: {e_edit}", exc_info=True)
+        return
+    for message_id in (request.message_id, request.status_message_id):
+        try:
+            await bot.delete_message(request.chat_id, message_id)
+        except Exception as e_del:
+            logger.warning(f"Не удалось удалить сообщение {message_id} пользователя {request.user_id}: {e_del}")
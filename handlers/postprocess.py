@@ -0,0 +1,268 @@
+import asyncio
+import json
+import logging
+import os
+import shutil
+import struct
+import subprocess
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Iterator, Optional
+
+from handlers import config, metrics
+from handlers.streaming import Media, RemoteMedia, media_ext
+from handlers.workspace import workspace
+
+logger = logging.getLogger(__name__)
+
+# Результат обработки лежит рядом с файлом: повторная обработка и отправка его не пересчитывают
+META_SUFFIX = ".meta.json"
+# Превью для Telegram: JPEG не больше 320 px по большей стороне и не больше 200 КБ
+THUMBNAIL_SIZE = 320
+THUMBNAIL_MAX_BYTES = 200 * 1024
+# Кадр для превью берется с этой доли длительности: первый кадр часто черный
+THUMBNAIL_POSITION = 0.1
+# Формат /audio -> (кодек, при котором звук копируется без перекодирования, параметры кодирования)
+AUDIO_ENCODERS = {
+    "m4a": ("aac", ["-c:a", "aac", "-b:a", "192k"]),
+    "mp3": ("mp3", ["-c:a", "libmp3lame", "-q:a", "2"]),
+}
+AUDIO_EXTENSIONS = (".m4a", ".mp3")
+
+
+class PostProcessError(RuntimeError):
+    """A required ffmpeg step (audio extraction) failed or is unavailable."""
+
+
+@dataclass
+class MediaInfo:
+    """What post-processing learned about a file; saved next to it and sent along with it."""
+    width: Optional[int] = None
+    height: Optional[int] = None
+    duration: Optional[float] = None
+    thumbnail: Optional[str] = None
+    # Индекс (moov) в начале файла: клиент Telegram начинает воспроизведение, не дожидаясь конца загрузки
+    faststart: bool = False
+    # Шаг обработки -> секунды
+    timings: dict[str, float] = field(default_factory=dict)
+
+
+def read_media_info(filename: str) -> Optional[MediaInfo]:
+    """The saved post-processing result of a file, or None if it was not processed."""
+    try:
+        with open(filename + META_SUFFIX, encoding="utf-8") as file:
+            return MediaInfo(**json.load(file))
+    except (OSError, ValueError, TypeError):
+        return None
+
+
+def _write_media_info(filename: str, info: MediaInfo) -> None:
+    with open(filename + META_SUFFIX, "w", encoding="utf-8") as file:
+        json.dump(asdict(info), file)
+
+
+def moov_before_mdat(filename: str) -> Optional[bool]:
+    """Whether an MP4's index precedes its media data, read from top-level box headers; None if unknown."""
+    with open(filename, "rb") as file:
+        while True:
+            header = file.read(8)
+            if len(header) < 8:
+                return None
+            size, kind = struct.unpack(">I4s", header)
+            if kind == b"moov":
+                return True
+            if kind == b"mdat":
+                return False
+            if size == 1:  # 64-битный размер сразу после заголовка
+                size = struct.unpack(">Q", file.read(8))[0] - 8
+            if size < 8:  # 0 - бокс до конца файла, остальное - битый файл
+                return None
+            file.seek(size - 8, os.SEEK_CUR)
+
+
+def _run(command: list[str], timeout: float) -> str:
+    try:
+        result = subprocess.run(command, capture_output=True, text=True, timeout=timeout, check=False)
+    except subprocess.TimeoutExpired:
+        raise PostProcessError(f"{os.path.basename(command[0])} не уложился в {timeout:.0f} с")
+    if result.returncode != 0:
+        raise PostProcessError(f"{os.path.basename(command[0])}: {result.stderr.strip()[-500:]}")
+    return result.stdout
+
+
+@contextmanager
+def _timed(info: MediaInfo, step: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        info.timings[step] = time.perf_counter() - started
+
+
+def probe(filename: str, timeout: float) -> dict:
+    """ffprobe the streams (type, codec, size) and the duration of a file."""
+    output = _run([config.FFPROBE_BINARY, "-v", "error", "-show_entries",
+                   "stream=codec_type,codec_name,width,height:format=duration", "-of", "json", filename], timeout)
+    return json.loads(output)
+
+
+def remux_faststart(filename: str, timeout: float) -> None:
+    """Move the MP4 index to the front without re-encoding."""
+    temp_filename = f"{filename}.faststart.mp4"
+    try:
+        _run([config.FFMPEG_BINARY, "-v", "error", "-y", "-i", filename, "-map", "0", "-dn", "-c", "copy",
+              "-movflags", "+faststart", temp_filename], timeout)
+        os.replace(temp_filename, filename)
+    finally:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+
+
+def extract_thumbnail(filename: str, position: float, timeout: float) -> Optional[str]:
+    """Save the nearest keyframe at position seconds as a Telegram-sized JPEG; None if it came out too big."""
+    thumbnail = f"{os.path.splitext(filename)[0]}.thumb.jpg"
+    # Декодируются только ключевые кадры: не нужно распаковывать видео до нужного места
+    _run([config.FFMPEG_BINARY, "-v", "error", "-y", "-skip_frame", "nokey", "-ss", f"{position:.2f}",
+          "-i", filename, "-frames:v", "1",
+          "-vf", f"scale={THUMBNAIL_SIZE}:{THUMBNAIL_SIZE}:force_original_aspect_ratio=decrease",
+          "-q:v", "5", thumbnail], timeout)
+    if not os.path.exists(thumbnail) or os.path.getsize(thumbnail) > THUMBNAIL_MAX_BYTES:
+        return None
+    return thumbnail
+
+
+def extract_audio(filename: str, output_filename: str, audio_codec: Optional[str], audio_format: str,
+                  timeout: float) -> None:
+    """Write the first audio track to output_filename, copying it if it is already in the target codec."""
+    copy_codec, encode_args = AUDIO_ENCODERS[audio_format]
+    codec_args = ["-c:a", "copy"] if audio_codec == copy_codec else encode_args
+    _run([config.FFMPEG_BINARY, "-v", "error", "-y", "-i", filename, "-map", "0:a:0", "-vn", *codec_args,
+          output_filename], timeout)
+
+
+def process_file(filename: str, audio_format: Optional[str], timeout: float) -> tuple[str, MediaInfo, bool]:
+    """Post-process a downloaded file in a pool process.
+
+    Returns the file to send, its MediaInfo and whether the info came from the saved result.
+    A failed faststart remux or thumbnail leaves the file as it is; failed audio extraction raises.
+    """
+    target = f"{os.path.splitext(filename)[0]}.{audio_format}" if audio_format else filename
+    cached = read_media_info(target)
+    if cached is not None and os.path.exists(target):
+        return target, cached, True
+
+    info = MediaInfo()
+    with _timed(info, "ffprobe"):
+        probed = probe(filename, timeout)
+    streams = probed.get("streams") or []
+    video = next((stream for stream in streams if stream.get("codec_type") == "video"), None)
+    audio = next((stream for stream in streams if stream.get("codec_type") == "audio"), None)
+    try:
+        info.duration = float(probed["format"]["duration"])
+    except (KeyError, TypeError, ValueError):
+        pass
+
+    if audio_format:
+        if audio is None:
+            raise PostProcessError("В файле нет звуковой дорожки.")
+        with _timed(info, "audio"):
+            extract_audio(filename, target, audio.get("codec_name"), audio_format, timeout)
+        os.remove(filename)
+    elif video is not None:
+        info.width, info.height = video.get("width"), video.get("height")
+        try:
+            info.faststart = bool(moov_before_mdat(filename))
+            if not info.faststart:
+                with _timed(info, "faststart"):
+                    remux_faststart(filename, timeout)
+                info.faststart = True
+        except (PostProcessError, OSError) as e:
+            logger.warning(f"Не удалось перенести индекс {filename} в начало файла: {e}")
+        try:
+            with _timed(info, "thumbnail"):
+                info.thumbnail = extract_thumbnail(filename, (info.duration or 0) * THUMBNAIL_POSITION, timeout)
+        except (PostProcessError, OSError) as e:
+            logger.warning(f"Не удалось сделать превью {filename}: {e}")
+
+    _write_media_info(target, info)
+    return target, info, False
+
+
+class PostProcessor:
+    """Runs ffmpeg post-processing in its own bounded process pool, apart from the download workers.
+
+    Videos get a faststart remux (only if the index is at the end), a keyframe thumbnail and
+    their width, height and duration; with audio_format the audio track is extracted instead.
+    """
+
+    def __init__(self, enabled: bool = True, max_workers: int = 2, timeout: float = 120.0):
+        self.enabled = enabled
+        self.max_workers = max(1, max_workers)
+        self.timeout = timeout
+        self._pool: Optional[Executor] = None
+        self._available: Optional[bool] = None
+
+    @classmethod
+    def from_env(cls) -> "PostProcessor":
+        return cls(config.POSTPROCESS_ENABLED, config.POSTPROCESS_WORKERS, config.POSTPROCESS_TIMEOUT)
+
+    @property
+    def available(self) -> bool:
+        """Enabled and ffmpeg with ffprobe are installed; checked once."""
+        if self._available is None:
+            self._available = self.enabled and all(
+                shutil.which(binary) for binary in (config.FFMPEG_BINARY, config.FFPROBE_BINARY))
+            if self.enabled and not self._available:
+                logger.warning("ffmpeg или ffprobe не найдены: видео отправляются без обработки, /audio недоступна.")
+        return self._available
+
+    def _get_pool(self) -> Executor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+            logger.info(f"Создан пул обработки ffmpeg, процессов: {self.max_workers}")
+        return self._pool
+
+    async def run(self, media: Media, platform: str, audio_format: Optional[str] = None) -> Media:
+        """Post-process a download result and return what to send.
+
+        Streams and non-video files pass through as they are, as do audio files in audio mode.
+        """
+        if isinstance(media, RemoteMedia):
+            return media
+        ext = media_ext(media)
+        if audio_format and ext in AUDIO_EXTENSIONS:
+            return media  # Spotify уже отдает mp3
+        if not audio_format and ext != ".mp4":
+            return media
+        if not self.available:
+            if audio_format:
+                workspace.remove(media)
+                raise PostProcessError("Извлечение звука сейчас недоступно.")
+            return media
+
+        try:
+            filename, info, cached = await asyncio.get_running_loop().run_in_executor(
+                self._get_pool(), process_file, media, audio_format, self.timeout)
+        except BaseException as e:
+            # Исходный файл больше не нужен: звук не извлечен или ожидающие ушли
+            if audio_format or not isinstance(e, Exception):
+                workspace.remove(media)
+                raise
+            logger.warning(f"Обработка {media} не выполнена, файл отправляется как есть: {e}")
+            return media
+        if not cached:
+            for step, seconds in info.timings.items():
+                metrics.STAGE_SECONDS.observe(seconds, platform=platform, stage=step)
+            logger.info(f"Обработка {filename}: " + ", ".join(
+                f"{step} {seconds:.2f} с" for step, seconds in info.timings.items()))
+        return filename
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+postprocessor = PostProcessor.from_env()
@@ -0,0 +1,193 @@
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+from handlers import config
+
+logger = logging.getLogger(__name__)
+
+
+class ProgressState:
+    """Latest progress of one download, written by the worker thread and read by reporters.
+
+    Writers only replace a few numbers under a lock, so hooks never wait on Telegram.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self.version = 0
+        self.downloaded = 0
+        self.total: Optional[int] = None
+        self.speed: Optional[float] = None
+        self.eta: Optional[float] = None
+        self.stage: Optional[str] = None
+        # Место в очереди пула загрузок (0 - не ждет) и оценка ожидания в секундах
+        self.queue_position = 0
+        self.queue_wait = 0.0
+
+    def update(self, downloaded: int, total: Optional[int] = None, speed: Optional[float] = None,
+               eta: Optional[float] = None) -> None:
+        with self._lock:
+            self.downloaded = downloaded
+            self.total = total or self.total
+            if speed is None:
+                elapsed = time.monotonic() - self._started
+                speed = downloaded / elapsed if elapsed > 0 else None
+            self.speed = speed
+            if eta is None and speed and self.total:
+                eta = max(self.total - downloaded, 0) / speed
+            self.eta = eta
+            self.version += 1
+
+    def add_bytes(self, count: int, total: Optional[int] = None) -> None:
+        """Byte counter for plain HTTP downloads."""
+        self.update(self.downloaded + count, total)
+
+    def set_stage(self, stage: str) -> None:
+        with self._lock:
+            self.stage = stage
+            self.version += 1
+
+    def set_queue_position(self, position: int, wait_seconds: float) -> None:
+        """Executor on_position callback; every waiter of a shared download reads it from here."""
+        with self._lock:
+            self.queue_position = position
+            self.queue_wait = wait_seconds
+            self.version += 1
+
+    def ytdlp_hook(self, status: dict) -> None:
+        """yt-dlp progress_hooks callback."""
+        if status.get("status") == "downloading":
+            self.update(status.get("downloaded_bytes") or 0,
+                        status.get("total_bytes") or status.get("total_bytes_estimate"),
+                        status.get("speed"), status.get("eta"))
+        elif status.get("status") == "finished":
+            self.set_stage("обработка")
+
+    def snapshot(self) -> tuple[int, str]:
+        """Return (version, human readable progress line)."""
+        with self._lock:
+            if self.queue_position:
+                return self.version, f"вы #{self.queue_position} в очереди, ожидание {format_wait(self.queue_wait)}"
+            text = format_progress(self.downloaded, self.total, self.speed, self.eta, self.stage)
+            # Загрузка вышла из очереди, но байтов еще нет
+            return self.version, text or ("загрузка" if self.version else "")
+
+
+def format_wait(seconds: float) -> str:
+    minutes = round(seconds / 60)
+    return f"~{minutes} мин" if minutes else "меньше минуты"
+
+
+def _format_bytes(size: float) -> str:
+    for unit in ("Б", "КБ", "МБ"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "Б" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} ГБ"
+
+
+def format_progress(downloaded: int, total: Optional[int], speed: Optional[float], eta: Optional[float],
+                    stage: Optional[str] = None) -> str:
+    parts = []
+    if total:
+        parts.append(f"{min(downloaded / total, 1):.0%}")
+    if downloaded:
+        parts.append(_format_bytes(downloaded) + (f" из {_format_bytes(total)}" if total else ""))
+    if speed:
+        parts.append(f"{_format_bytes(speed)}/с")
+    if eta is not None and total:
+        minutes, seconds = divmod(int(eta), 60)
+        parts.append(f"осталось {minutes}:{seconds:02d}")
+    if stage:
+        parts.append(stage)
+    return " · ".join(parts)
+
+
+class EditRateLimiter:
+    """Global token bucket plus a minimum interval per chat for status message edits.
+
+    acquire never waits: when there is no token the caller skips this edit and the next
+    tick sends the newest state instead, so updates coalesce rather than queue up.
+    """
+
+    def __init__(self, rate_per_second: float, chat_interval: float):
+        self.rate = rate_per_second
+        self.capacity = max(1.0, rate_per_second)
+        self.chat_interval = chat_interval
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._chat_last_edit: dict[int, float] = {}
+
+    def try_acquire(self, chat_id: int) -> bool:
+        now = time.monotonic()
+        if now < self._blocked_until:
+            return False
+        if now - self._chat_last_edit.get(chat_id, 0.0) < self.chat_interval:
+            return False
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        self._chat_last_edit[chat_id] = now
+        if len(self._chat_last_edit) > 10000:
+            # Забываем чаты, которые давно не редактировались
+            self._chat_last_edit = {chat: ts for chat, ts in self._chat_last_edit.items()
+                                    if now - ts < self.chat_interval}
+        return True
+
+    def penalize(self, retry_after: float) -> None:
+        """Pause all edits after Telegram answered with RetryAfter."""
+        self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+        logger.warning(f"Telegram попросил подождать {retry_after} с, обновления прогресса приостановлены.")
+
+
+edit_limiter = EditRateLimiter(config.PROGRESS_EDITS_PER_SECOND, config.PROGRESS_INTERVAL)
+
+
+class ProgressReporter:
+    """Periodically renders a ProgressState into a status message while a download runs."""
+
+    def __init__(self, state: ProgressState, chat_id: int, render: Callable[[str], Awaitable[Any]],
+                 interval: float = config.PROGRESS_INTERVAL, limiter: EditRateLimiter = edit_limiter):
+        self.state = state
+        self.chat_id = chat_id
+        self.render = render
+        self.interval = interval
+        self.limiter = limiter
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        shown_version = 0
+        while True:
+            await asyncio.sleep(self.interval)
+            version, text = self.state.snapshot()
+            if version == shown_version or not text or not self.limiter.try_acquire(self.chat_id):
+                continue
+            try:
+                await self.render(text)
+                shown_version = version
+            except TelegramRetryAfter as e:
+                self.limiter.penalize(e.retry_after)
+            except TelegramBadRequest as e:
+                # Например, "message is not modified" или сообщение уже удалено
+                logger.debug(f"Не удалось обновить прогресс: {e}")
+                shown_version = version
+            except Exception as e:
+                logger.warning(f"Ошибка обновления прогресса: {e}")
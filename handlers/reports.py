@@ -0,0 +1,117 @@
+import asyncio
+import html
+import logging
+import time
+from collections import Counter, deque
+from dataclasses import dataclass
+from typing import Optional
+
+from aiogram import Bot
+
+from handlers import config
+
+logger = logging.getLogger(__name__)
+
+# Ограничение Telegram на длину текста сообщения
+MAX_MESSAGE_LENGTH = 4096
+
+
+def join_lines(lines: list[str], limit: int = MAX_MESSAGE_LENGTH) -> str:
+    """Join HTML lines into one message, dropping whole lines from the end to fit the limit."""
+    # Обрезка внутри строки может разорвать тег или &amp;, и Telegram отклонит все сообщение
+    text = "\n".join(lines)
+    if len(text) <= limit:
+        return text
+    kept: list[str] = []
+    length = len("…")
+    for line in lines:
+        if length + len(line) + 1 > limit:
+            break
+        kept.append(line)
+        length += len(line) + 1
+    return "\n".join(kept + ["…"])
+
+
+@dataclass
+class ErrorRecord:
+    platform: str
+    user: str
+    link: str
+    error: str
+
+
+class AdminDigest:
+    """Collects per-request reports and sends the admin one summary per interval.
+
+    Recording only touches in-memory counters, so the user's request never waits on it.
+    """
+
+    def __init__(self, admin_id: Optional[int], interval: float, max_errors: int = 20):
+        self.admin_id = admin_id
+        self.interval = interval
+        self._successes: Counter = Counter()
+        self._cache_hits = 0
+        self._users: set[int] = set()
+        self._errors_total = 0
+        self._errors: deque[ErrorRecord] = deque(maxlen=max_errors)
+        self._since = time.time()
+
+    def record_success(self, platform: str, user_id: int, from_cache: bool) -> None:
+        self._successes[platform] += 1
+        self._cache_hits += from_cache
+        self._users.add(user_id)
+
+    def record_error(self, platform: str, user: str, link: str, error: str) -> None:
+        self._errors_total += 1
+        self._errors.append(ErrorRecord(platform, user, link[:100], error[:300]))
+
+    def has_data(self) -> bool:
+        return bool(self._successes or self._errors_total)
+
+    def build(self) -> str:
+        minutes = (time.time() - self._since) / 60
+        total = sum(self._successes.values())
+        lines = [f"📊 <b>Сводка за {minutes:.0f} мин</b>",
+                 f"Успешно: {total} (из кэша file_id: {self._cache_hits}), пользователей: {len(self._users)}"]
+        if self._successes:
+            lines.append("По платформам: " + ", ".join(f"{platform} {count}"
+                                                       for platform, count in self._successes.most_common()))
+        if self._errors_total:
+            lines.append(f"❌ Ошибок: {self._errors_total}"
+                         + (f" (последние {len(self._errors)})" if self._errors_total > len(self._errors) else ""))
+            for record in self._errors:
+                lines.append(f"• {record.platform}, {html.escape(record.user)}: {html.escape(record.link)}\n"
+                             f"  {html.escape(record.error)}")
+        return join_lines(lines)
+
+    def reset(self) -> None:
+        self._successes.clear()
+        self._cache_hits = 0
+        self._users.clear()
+        self._errors_total = 0
+        self._errors.clear()
+        self._since = time.time()
+
+    async def flush(self, bot: Bot) -> None:
+        """Send the collected summary, if there is anything to report."""
+        if self.admin_id is None or not self.has_data():
+            return
+        text = self.build()
+        self.reset()
+        try:
+            await bot.send_message(self.admin_id, text, parse_mode="HTML", disable_web_page_preview=True)
+            logger.info(f"Сводка отправлена администратору {self.admin_id}")
+        except Exception as e:
+            logger.error(f"Не удалось отправить сводку администратору {self.admin_id}: {e}", exc_info=True)
+
+    async def run(self, bot: Bot) -> None:
+        """Background task: send the summary every interval and once more when cancelled."""
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                await self.flush(bot)
+        finally:
+            await asyncio.shield(self.flush(bot))
+
+
+admin_digest = AdminDigest(config.ADMIN_ID, config.ADMIN_DIGEST_INTERVAL, config.ADMIN_DIGEST_MAX_ERRORS)
@@ -0,0 +1,160 @@
+import logging
+import time
+from typing import Optional
+
+from handlers import config
+
+logger = logging.getLogger(__name__)
+
+# Полосы очереди: меньшее значение обслуживается раньше
+LANE_ADMIN = 0
+LANE_FAST = 1
+LANE_NORMAL = 2
+
+# Начальная оценка длительности загрузки, пока по платформе нет статистики (секунды)
+DEFAULT_JOB_SECONDS = 30.0
+# Вес новой длительности в скользящем среднем
+DURATION_SMOOTHING = 0.2
+
+
+class RateLimitedError(RuntimeError):
+    """Raised when a user sends links faster than their token bucket allows."""
+
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+        super().__init__(f"Слишком много ссылок подряд. Следующую можно отправить через {retry_after:.0f} с.")
+
+
+class TokenBucket:
+    def __init__(self, rate_per_second: float, capacity: float):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, count: float = 1) -> float:
+        """Take count tokens; returns 0 on success or the seconds until they are available."""
+        self._refill()
+        if self.tokens >= count:
+            self.tokens -= count
+            return 0.0
+        return (count - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def charge(self, count: float) -> None:
+        """Take count tokens even if there are not enough; the debt is repaid by refilling."""
+        self._refill()
+        self.tokens -= count
+
+    def is_full(self) -> bool:
+        return self.tokens + (time.monotonic() - self.updated) * self.rate >= self.capacity
+
+
+class UserRateLimiter:
+    """Token bucket per user for incoming links; the admin is not limited."""
+
+    def __init__(self, per_minute: float, burst: int, admin_id: Optional[int] = None):
+        self.rate = per_minute / 60
+        self.burst = max(1, burst)
+        self.admin_id = admin_id
+        self._buckets: dict[int, TokenBucket] = {}
+
+    def _bucket(self, user_id: int) -> TokenBucket:
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            if len(self._buckets) > 10000:
+                # Полные корзины ничем не отличаются от новых - их можно забыть
+                self._buckets = {user: b for user, b in self._buckets.items() if not b.is_full()}
+            bucket = self._buckets[user_id] = TokenBucket(self.rate, self.burst)
+        return bucket
+
+    def check(self, user_id: int, links: int = 1) -> None:
+        """Spend a token per link of the user; raises RateLimitedError if there are not enough."""
+        if self.rate <= 0 or user_id == self.admin_id:
+            return
+        # Сообщение с множеством ссылок стоит не больше полной корзины, иначе его нельзя было бы отправить
+        retry_after = self._bucket(user_id).take(min(max(1, links), self.burst))
+        if retry_after:
+            logger.info(f"Пользователь {user_id} превысил лимит ссылок, повтор через {retry_after:.0f} с.")
+            raise RateLimitedError(retry_after)
+
+    def charge(self, user_id: int, downloads: int) -> None:
+        """Charge downloads found only after the check, e.g. playlist entries, as a debt.
+
+        The batch itself is not cut, but the user's next links wait until the debt is repaid.
+        """
+        if self.rate <= 0 or user_id == self.admin_id or downloads <= 0:
+            return
+        self._bucket(user_id).charge(downloads)
+
+
+class FairScheduler:
+    """Orders waiting downloads: admin first, then the fast lane, then weighted fair queuing by user.
+
+    Each job gets a virtual finish tag start + cost, where start is the later of the current
+    virtual time and the user's previous finish tag (self-clocked fair queuing). A user who
+    queued many expensive jobs therefore gets later tags and cannot starve the others.
+    """
+
+    def __init__(self, platform_costs: dict[str, int], fast_platforms: list[str], fast_lane_workers: int,
+                 user_concurrency: int, admin_id: Optional[int] = None, admin_priority: bool = True):
+        self.platform_costs = dict(platform_costs)
+        self.fast_platforms = set(fast_platforms)
+        self.fast_lane_workers = max(0, fast_lane_workers)
+        self.user_concurrency = max(1, user_concurrency)
+        self.admin_id = admin_id if admin_priority else None
+        self.virtual_time = 0.0
+        self._user_finish: dict[int, float] = {}
+        self._durations: dict[str, float] = {}
+
+    @classmethod
+    def from_env(cls) -> "FairScheduler":
+        return cls(
+            platform_costs=config.PLATFORM_COST,
+            fast_platforms=config.FAST_LANE_PLATFORMS,
+            fast_lane_workers=config.FAST_LANE_WORKERS,
+            user_concurrency=config.USER_CONCURRENCY,
+            admin_id=config.ADMIN_ID,
+            admin_priority=config.ADMIN_PRIORITY,
+        )
+
+    def is_admin(self, user_id: int) -> bool:
+        return self.admin_id is not None and user_id == self.admin_id
+
+    def lane(self, platform: str, user_id: int) -> int:
+        if self.is_admin(user_id):
+            return LANE_ADMIN
+        return LANE_FAST if platform in self.fast_platforms else LANE_NORMAL
+
+    def tag(self, platform: str, user_id: int) -> float:
+        """Virtual finish tag for a new job of the user."""
+        start = max(self.virtual_time, self._user_finish.get(user_id, 0.0))
+        finish = start + self.platform_costs.get(platform, 1)
+        self._user_finish[user_id] = finish
+        return finish
+
+    def started(self, finish_tag: float) -> None:
+        """Advance virtual time to the tag of the job that has just been started."""
+        self.virtual_time = max(self.virtual_time, finish_tag)
+        if len(self._user_finish) > 10000:
+            # Пользователи, чьи теги уже позади виртуального времени, начнут с него же
+            self._user_finish = {user: tag for user, tag in self._user_finish.items() if tag > self.virtual_time}
+
+    def user_has_capacity(self, user_id: int, running: int) -> bool:
+        return self.is_admin(user_id) or running < self.user_concurrency
+
+    def expected_duration(self, platform: str) -> float:
+        return self._durations.get(platform, DEFAULT_JOB_SECONDS)
+
+    def record_duration(self, platform: str, seconds: float) -> None:
+        previous = self._durations.get(platform)
+        self._durations[platform] = seconds if previous is None else \
+            previous + DURATION_SMOOTHING * (seconds - previous)
+
+
+user_rate_limiter = UserRateLimiter(config.USER_RATE_PER_MINUTE, config.USER_BURST,
+                                    config.ADMIN_ID if config.ADMIN_PRIORITY else None)
@@ -0,0 +1,122 @@
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Optional
+
+from handlers import metrics
+from handlers.executor import JobCancelledError
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(eq=False)
+class Flight:
+    key: str
+    task: asyncio.Task
+    cleanup: Callable[[Any], None]
+    context: Any = None
+    waiters: int = 0
+    # Загрузки одного результата выполняются по очереди: первый загружает файл,
+    # остальные успевают найти его file_id в кэше и отправляют без повторной загрузки.
+    upload_lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    # Ожидающие в wait(): (пользователь, future, завершение которого отцепляет только этого ожидающего)
+    detachers: list[tuple[Optional[int], asyncio.Future]] = field(default_factory=list)
+
+    @property
+    def result(self) -> Any:
+        return self.task.result()
+
+
+class SingleFlight:
+    """Coalesces concurrent requests for the same key into one in-flight job.
+
+    Every waiter gets the same result or the same exception. The result is handed to
+    cleanup (e.g. the temp file is deleted) only after the last waiter releases it, and an
+    unfinished job is cancelled only when its last waiter leaves.
+    """
+
+    def __init__(self):
+        self._flights: dict[str, Flight] = {}
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    def join(self, key: str, factory: Callable[[Any], Awaitable[Any]], cleanup: Callable[[Any], None],
+             context: Any = None) -> Flight:
+        """Attach to the in-flight job for key, starting it via factory(context) if there is none.
+
+        The context of the job that actually runs (e.g. its progress state) is available as
+        flight.context to every waiter. Each join must be paired with wait() or release().
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = Flight(key=key, task=asyncio.ensure_future(factory(context)), cleanup=cleanup, context=context)
+            flight.task.add_done_callback(lambda task, f=flight: self._on_done(f))
+            self._flights[key] = flight
+        else:
+            logger.info(f"Запрос {key} присоединен к уже выполняющейся загрузке "
+                        f"(ожидающих: {flight.waiters + 1}).")
+        flight.waiters += 1
+        return flight
+
+    async def wait(self, flight: Flight, owner: Optional[int] = None) -> Any:
+        """Wait for the flight's result; on failure or cancellation the reference is released.
+
+        cancel_user(owner) makes this wait raise JobCancelledError without affecting other waiters.
+        """
+        waiter = (owner, asyncio.get_running_loop().create_future())
+        flight.detachers.append(waiter)
+        try:
+            await asyncio.wait([flight.task, waiter[1]], return_when=asyncio.FIRST_COMPLETED)
+            if not flight.task.done():
+                raise JobCancelledError("Загрузка отменена.")
+            return flight.task.result()
+        except BaseException:
+            self.release(flight)
+            raise
+        finally:
+            flight.detachers.remove(waiter)
+
+    def cancel_user(self, owner: int) -> int:
+        """Detach the user from every flight they wait for; returns how many waits were cancelled."""
+        cancelled = 0
+        for flight in list(self._flights.values()):
+            for waiter_owner, detached in flight.detachers:
+                if waiter_owner == owner and not detached.done():
+                    detached.set_result(None)
+                    cancelled += 1
+        return cancelled
+
+    async def acquire(self, key: str, factory: Callable[[Any], Awaitable[Any]],
+                      cleanup: Callable[[Any], None], context: Any = None) -> Flight:
+        """Join the in-flight job for key and wait for it."""
+        flight = self.join(key, factory, cleanup, context)
+        await self.wait(flight)
+        return flight
+
+    def release(self, flight: Flight) -> None:
+        """Drop one reference; the last one cleans up the result or cancels the unfinished job.
+
+        Exceptions from cleanup are propagated to the caller that triggered it.
+        """
+        flight.waiters -= 1
+        if flight.waiters > 0:
+            return
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+        if not flight.task.done():
+            logger.info(f"Все ожидающие {flight.key} ушли, загрузка отменяется.")
+            flight.task.cancel()
+        elif not flight.task.cancelled() and flight.task.exception() is None:
+            flight.cleanup(flight.task.result())
+
+    def _on_done(self, flight: Flight) -> None:
+        # Неудачную загрузку сразу убираем из таблицы, чтобы следующий запрос попробовал заново
+        if flight.task.cancelled() or flight.task.exception() is not None:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+
+
+inflight_downloads = SingleFlight()
+metrics.registry.gauge("bot_inflight_downloads", "Distinct downloads in flight (after coalescing).",
+                       lambda: len(inflight_downloads))
@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from dataclasses import dataclass, field
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SpotifyServiceUnavailable(RuntimeError):
+    """Raised when the in-process spotdl client cannot be started."""
+
+
+@dataclass(eq=False)
+class SpotifyJob:
+    url: str
+    future: Future = field(default_factory=Future)
+
+
+def _remove_late_result(future: Future) -> None:
+    if future.cancelled() or future.exception() is not None:
+        return
+    try:
+        os.remove(future.result())
+    except OSError as e:
+        logger.error(f"Не удалось удалить трек, скачанный после таймаута: {e}")
+
+
+class SpotifyService:
+    """Long-lived spotdl client running in its own thread.
+
+    spotdl drives downloads through its own asyncio loop, so a single thread owns the
+    client (and its Spotify / YouTube Music sessions) for the whole process lifetime.
+    Jobs that arrive together are downloaded as one batch, in parallel inside spotdl.
+    """
+
+    def __init__(self, output_dir: str, threads: int = 4):
+        self.output_dir = output_dir
+        self.threads = max(1, threads)
+        self._jobs: "queue.Queue[Optional[SpotifyJob]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._ready = threading.Event()
+        self._init_error: Optional[Exception] = None
+
+    def _ensure_started(self) -> None:
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="spotdl", daemon=True)
+                self._thread.start()
+        self._ready.wait()
+        if self._init_error is not None:
+            raise SpotifyServiceUnavailable(f"spotdl недоступен: {self._init_error}")
+
+    def download(self, url: str, timeout: float) -> str:
+        """Download a track and return the exact path of the produced mp3 (blocking)."""
+        self._ensure_started()
+        job = SpotifyJob(url)
+        self._jobs.put(job)
+        try:
+            return job.future.result(timeout=timeout)
+        except FutureTimeoutError:
+            # Если трек уже качается, файл появится позже - убираем его, когда появится
+            if not job.future.cancel():
+                job.future.add_done_callback(_remove_late_result)
+            raise
+
+    def close(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            self._jobs.put(None)
+
+    def _create_client(self, loop: asyncio.AbstractEventLoop):
+        from spotdl import Spotdl
+        from spotdl.utils.config import DEFAULT_CONFIG
+
+        # Своя папка у каждого процесса: воркеры с общим SPOTIFY_OUTPUT_DIR не забирают друг у друга
+        # один и тот же {track-id}.mp3. Внутри процесса одинаковые треки объединяет SingleFlight
+        output_dir = os.path.join(self.output_dir, str(os.getpid()))
+        os.makedirs(output_dir, exist_ok=True)
+        return Spotdl(
+            client_id=os.getenv("SPOTIFY_CLIENT_ID") or DEFAULT_CONFIG["client_id"],
+            client_secret=os.getenv("SPOTIFY_CLIENT_SECRET") or DEFAULT_CONFIG["client_secret"],
+            downloader_settings={
+                # Путь к файлу берется из результата загрузки, искать его в папке не нужно
+                "output": os.path.join(output_dir, "{track-id}.{output-ext}"),
+                "format": "mp3",
+                "threads": self.threads,
+                "simple_tui": True,
+            },
+            loop=loop,
+        )
+
+    def _run(self) -> None:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            client = self._create_client(loop)
+            logger.info(f"spotdl клиент запущен, потоков загрузки: {self.threads}")
+        except Exception as e:
+            logger.error(f"Не удалось запустить spotdl клиент: {e}", exc_info=True)
+            self._init_error = e
+            self._ready.set()
+            return
+        self._ready.set()
+
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            batch = [job]
+            # Забираем все, что уже ждет, чтобы скачать пачкой параллельно
+            while len(batch) < self.threads:
+                try:
+                    extra = self._jobs.get_nowait()
+                except queue.Empty:
+                    break
+                if extra is None:
+                    self._jobs.put(None)
+                    break
+                batch.append(extra)
+            self._download_batch(client, batch)
+        loop.close()
+
+    @staticmethod
+    def _download_batch(client, batch: list[SpotifyJob]) -> None:
+        found = []
+        for job in batch:
+            if not job.future.set_running_or_notify_cancel():
+                continue
+            try:
+                songs = client.search([job.url])
+                if not songs:
+                    raise RuntimeError("Трек не найден в Spotify.")
+                found.append((job, songs[0]))
+            except Exception as e:
+                logger.error(f"spotdl не смог найти трек {job.url}: {e}")
+                job.future.set_exception(e)
+        if not found:
+            return
+
+        try:
+            results = client.download_songs([song for _, song in found])
+        except Exception as e:
+            logger.error(f"spotdl ошибка при скачивании пачки из {len(found)} треков: {e}", exc_info=True)
+            for job, _ in found:
+                job.future.set_exception(e)
+            return
+
+        for (job, _), (_, path) in zip(found, results):
+            if path is None:
+                job.future.set_exception(RuntimeError("spotdl не вернул файл трека."))
+            else:
+                job.future.set_result(str(path))
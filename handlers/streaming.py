@@ -0,0 +1,57 @@
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional, Union
+
+from aiogram import types
+
+from handlers import config
+
+# Размер куска при перекачке из источника в Telegram; aiohttp читает следующий кусок
+# только после отправки предыдущего, так что в памяти держится не больше одного-двух кусков.
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+@dataclass
+class RemoteMedia:
+    """A direct-download URL whose bytes go straight into the Telegram upload, skipping disk."""
+    url: str
+    filename: str
+    headers: dict = field(default_factory=dict)
+    size: Optional[int] = None
+
+
+# Результат загрузки: путь к файлу на диске или ссылка для потоковой отправки
+Media = Union[str, RemoteMedia]
+
+
+def media_name(media: Media) -> str:
+    """Filename used for the type detection and logging of a download result."""
+    return media.filename if isinstance(media, RemoteMedia) else media
+
+
+def media_ext(media: Media) -> str:
+    return os.path.splitext(media_name(media))[1].lower()
+
+
+def check_upload_size(media: Media) -> None:
+    """Fail early with a clear message instead of uploading a file Telegram will reject."""
+    size = media.size if isinstance(media, RemoteMedia) else os.path.getsize(media)
+    if size and size > config.MAX_UPLOAD_BYTES:
+        raise ValueError(f"Файл слишком большой для отправки в Telegram: {size / 1024 / 1024:.0f} МБ "
+                         f"при лимите {config.MAX_UPLOAD_BYTES / 1024 / 1024:.0f} МБ.")
+
+
+def to_input_file(media: Media) -> Union[types.InputFile, str]:
+    """Build the aiogram input file: streamed from the source URL, read from disk or, for a
+    local Bot API server, just the file:// path that the server reads itself."""
+    if isinstance(media, RemoteMedia):
+        return types.URLInputFile(
+            media.url,
+            headers=media.headers,
+            filename=os.path.basename(media.filename),
+            chunk_size=STREAM_CHUNK_SIZE,
+        )
+    if config.TELEGRAM_API_URL and config.TELEGRAM_API_LOCAL:
+        return Path(media).resolve().as_uri()
+    return types.FSInputFile(media)
@@ -0,0 +1,186 @@
+import logging
+import re
+from dataclasses import dataclass
+from typing import Callable, Optional
+from urllib.parse import parse_qs, urlsplit
+
+from handlers import config
+from handlers.cache import TTLCache
+from handlers.http import BROWSER_HEADERS, get_session
+
+logger = logging.getLogger(__name__)
+
+# Домен (без www., m. и т.п.) -> платформа. Поиск по словарю вместо перебора префиксов
+PLATFORM_HOSTS = {
+    "youtube.com": "YouTube",
+    "music.youtube.com": "YouTube",
+    "youtu.be": "YouTube",
+    "x.com": "X",
+    "twitter.com": "X",
+    "tiktok.com": "TikTok",
+    "vt.tiktok.com": "TikTok",
+    "vm.tiktok.com": "TikTok",
+    "instagram.com": "Instagram",
+    "pinterest.com": "Pinterest",
+    "pin.it": "Pinterest",
+    "open.spotify.com": "Spotify",
+}
+# Платформы, где есть только картинки: /audio для них не имеет смысла
+PHOTO_ONLY_PLATFORMS = {"Pinterest"}
+# Короткие ссылки без ID: настоящий адрес узнаем по редиректу
+SHORT_LINK_HOSTS = {"pin.it", "vt.tiktok.com", "vm.tiktok.com"}
+SHORT_LINK_PATHS = {"tiktok.com": re.compile(r"^/t/\w+")}
+# Служебные поддомены, которые не влияют на платформу
+HOST_PREFIXES = ("www.", "m.", "mobile.")
+
+# Идентификатор контента в пути ссылки: одинаковое видео по разным ссылкам дает один ключ
+CONTENT_ID_PATTERNS = {
+    "YouTube": re.compile(r"^/(?:shorts|live|embed)/([\w-]{11})"),
+    "X": re.compile(r"/status(?:es)?/(\d+)"),
+    "TikTok": re.compile(r"/video/(\d+)"),
+    "Instagram": re.compile(r"^/(?:[\w.]+/)?reels?/([\w-]+)"),
+    "Pinterest": re.compile(r"^/pin/(?:[\w-]*--)?(\d+)"),
+    "Spotify": re.compile(r"^/(?:intl-[\w-]+/)?track/(\w+)"),
+}
+YOUTUBE_ID = re.compile(r"^[\w-]{11}$")
+# Вкладка Shorts канала - это список видео, как плейлист
+YOUTUBE_SHORTS_TAB = re.compile(r"^/(?:@[\w.-]+|channel/[\w-]+)/shorts/?$")
+
+# Одно регулярное выражение находит в тексте все ссылки на известные домены, с протоколом и без
+LINK_PATTERN = re.compile(
+    r"(?<![\w.@/-])(?:https?://)?(?:[a-z0-9-]+\.)*(?:"
+    + "|".join(re.escape(host) for host in sorted(set(PLATFORM_HOSTS), key=len, reverse=True))
+    + r")(?![\w.-])(?:[/?#][^\s<>\"']*)?",
+    re.IGNORECASE,
+)
+# Знаки препинания, которые обычно стоят после ссылки в тексте, а не в ней самой
+TRAILING_PUNCTUATION = ".,;:!?)]}»"
+
+
+@dataclass(frozen=True)
+class Link:
+    """A supported link found in a message, reduced to its canonical form."""
+    platform: str
+    url: str
+    content_id: Optional[str] = None
+    short: bool = False
+    # Плейлист или вкладка Shorts: раскрывается в список отдельных видео
+    playlist: bool = False
+
+    @property
+    def key(self) -> str:
+        """Canonical content key (platform + ID) used for caching and deduplication."""
+        if self.content_id:
+            return f"{self.platform}:{self.content_id}"
+        # ID неизвестен (короткая ссылка, которую не удалось раскрыть) - используем ссылку без параметров
+        return f"{self.platform}:{self.url}"
+
+
+def _platform_host(host: str) -> Optional[str]:
+    host = host.lower().rstrip(".")
+    for prefix in HOST_PREFIXES:
+        if host.startswith(prefix) and host[len(prefix):] in PLATFORM_HOSTS:
+            return host[len(prefix):]
+    if host in PLATFORM_HOSTS:
+        return host
+    # Региональные поддомены: in.pinterest.com, ru.pinterest.com и т.п.
+    parent = host.partition(".")[2]
+    return parent if parent == "pinterest.com" else None
+
+
+def parse_link(url: str) -> Optional[Link]:
+    """Canonicalize a single URL; None if it does not point to supported content."""
+    url = url.strip().rstrip(TRAILING_PUNCTUATION)
+    if "://" not in url:
+        url = f"https://{url}"
+    parts = urlsplit(url)
+    host = _platform_host(parts.hostname or "")
+    if host is None:
+        return None
+    platform = PLATFORM_HOSTS[host]
+    path = parts.path or "/"
+    # Параметры (utm_*, si, igsh, share_id...) отбрасываем: кроме v= у YouTube они не нужны для загрузки
+    clean_url = f"https://{parts.hostname.lower()}{path.rstrip('/') or '/'}"
+
+    if platform == "YouTube":
+        if host == "youtu.be":
+            video_id = path.strip("/").split("/")[0]
+        elif path.rstrip("/") == "/watch":
+            video_id = (parse_qs(parts.query).get("v") or [""])[0]
+        else:
+            match = CONTENT_ID_PATTERNS["YouTube"].match(path)
+            video_id = match.group(1) if match else ""
+        if not YOUTUBE_ID.match(video_id):
+            # Ссылка на видео внутри плейлиста (watch?v=...&list=...) выше скачивается как одно видео
+            list_id = (parse_qs(parts.query).get("list") or [""])[0]
+            if list_id and path.rstrip("/") in ("/playlist", "/watch"):
+                return Link(platform, f"https://www.youtube.com/playlist?list={list_id}", f"playlist:{list_id}",
+                            playlist=True)
+            if YOUTUBE_SHORTS_TAB.match(path):
+                return Link(platform, f"https://www.youtube.com{path.rstrip('/')}", playlist=True)
+            return None
+        if path.startswith("/shorts/"):
+            return Link(platform, f"https://www.youtube.com/shorts/{video_id}", video_id)
+        return Link(platform, f"https://www.youtube.com/watch?v={video_id}", video_id)
+
+    if host in SHORT_LINK_HOSTS or (host in SHORT_LINK_PATHS and SHORT_LINK_PATHS[host].match(path)):
+        return Link(platform, clean_url, short=True) if path.strip("/") else None
+
+    match = CONTENT_ID_PATTERNS[platform].search(path)
+    if not match:
+        return None
+    content_id = match.group(1)
+    if platform == "Spotify":
+        clean_url = f"https://open.spotify.com/track/{content_id}"
+    elif platform == "Pinterest":
+        # Раскрытый pin.it ведет на .../pin/<id>/sent/?invite_code=... - страница пина одна и та же
+        clean_url = f"https://www.pinterest.com/pin/{content_id}/"
+    return Link(platform, clean_url, content_id)
+
+
+def extract_links(text: str) -> list[Link]:
+    """Find all supported links in a message, in order and without duplicates."""
+    links: list[Link] = []
+    seen: set[str] = set()
+    for match in LINK_PATTERN.finditer(text or ""):
+        link = parse_link(match.group(0))
+        if link is not None and link.key not in seen:
+            seen.add(link.key)
+            links.append(link)
+    return links
+
+
+class ShortLinkResolver:
+    """Expands short links (pin.it, vt.tiktok.com) by following redirects, with a TTL cache."""
+
+    def __init__(self, ttl_seconds: float, max_entries: int, timeout: float,
+                 fetch: Optional[Callable[[str], str]] = None):
+        self.timeout = timeout
+        self._cache = TTLCache(ttl_seconds, max_entries)
+        self._fetch = fetch or self._follow_redirects
+
+    def _follow_redirects(self, url: str) -> str:
+        response = get_session().head(url, headers=BROWSER_HEADERS, timeout=self.timeout, allow_redirects=True)
+        return response.url
+
+    def resolve(self, link: Link) -> Link:
+        """Return the canonical link behind a short one; the short link itself if it cannot be expanded."""
+        if not link.short:
+            return link
+        cached = self._cache.get(link.url)
+        if cached is not None:
+            return cached
+        try:
+            resolved = parse_link(self._fetch(link.url))
+        except Exception as e:
+            logger.warning(f"Не удалось раскрыть короткую ссылку {link.url}: {e}")
+            return link
+        if resolved is None or resolved.short or resolved.platform != link.platform:
+            logger.warning(f"Короткая ссылка {link.url} ведет на неподдерживаемый адрес")
+            resolved = link
+        self._cache.put(link.url, resolved)
+        return resolved
+
+
+short_links = ShortLinkResolver(config.SHORT_LINK_CACHE_TTL, config.SHORT_LINK_CACHE_MAX_ENTRIES,
+                                config.SHORT_LINK_TIMEOUT)
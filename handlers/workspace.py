@@ -0,0 +1,220 @@
+import asyncio
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Optional
+
+from handlers import config, metrics
+
+logger = logging.getLogger(__name__)
+
+
+class WorkspaceFullError(RuntimeError):
+    """Raised when there is no room on the scratch disk for a download."""
+
+
+def dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass  # Файл удалили, пока мы считали
+    return total
+
+
+@dataclass
+class WorkspaceRoot:
+    path: str
+    quota: int
+    reserved: int = 0
+
+
+@dataclass(eq=False)
+class JobDir:
+    """Scratch directory of one download with its reserved bytes.
+
+    Used as a context manager around the download: on error the directory is removed and
+    the reservation freed, on success the reservation is adjusted to the real size.
+    """
+    workspace: "Workspace"
+    root: WorkspaceRoot
+    path: str
+    reserved: int
+    created_at: float = field(default_factory=time.time)
+
+    def file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def __enter__(self) -> "JobDir":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.workspace.commit(self)
+        else:
+            self.workspace.release(self)
+
+
+class Workspace:
+    """Allocates per-job scratch directories under quota, optionally on tmpfs for small files.
+
+    When the quota is exhausted, allocate() waits for running downloads to free space and
+    gives up with WorkspaceFullError after wait_timeout. A janitor removes stale leftovers.
+    """
+
+    def __init__(self, root: str, quota: int, tmpfs_root: str = "", tmpfs_quota: int = 0,
+                 tmpfs_max_bytes: int = 0, default_reservation: int = 64 * 1024 * 1024,
+                 wait_timeout: float = 120.0, stale_after: float = 3600.0, extra_dirs: tuple = ()):
+        self.disk = WorkspaceRoot(os.path.abspath(root), quota)
+        self.tmpfs = WorkspaceRoot(os.path.abspath(tmpfs_root), tmpfs_quota) if tmpfs_root and tmpfs_quota else None
+        self.tmpfs_max_bytes = tmpfs_max_bytes
+        self.default_reservation = default_reservation
+        self.wait_timeout = wait_timeout
+        self.stale_after = stale_after
+        # Папки других компонентов (spotdl), в которых чистятся только старые файлы
+        self.extra_dirs = tuple(os.path.abspath(path) for path in extra_dirs)
+        self._active: dict[str, JobDir] = {}
+        self._changed = threading.Condition()
+
+    @classmethod
+    def from_env(cls) -> "Workspace":
+        return cls(
+            root=config.WORKSPACE_ROOT,
+            quota=config.WORKSPACE_QUOTA_BYTES,
+            tmpfs_root=config.WORKSPACE_TMPFS_ROOT,
+            tmpfs_quota=config.WORKSPACE_TMPFS_QUOTA_BYTES,
+            tmpfs_max_bytes=config.WORKSPACE_TMPFS_MAX_FILE_BYTES,
+            default_reservation=config.WORKSPACE_DEFAULT_RESERVATION,
+            wait_timeout=config.WORKSPACE_WAIT_TIMEOUT,
+            stale_after=config.WORKSPACE_STALE_AFTER,
+            extra_dirs=(config.SPOTIFY_OUTPUT_DIR,),
+        )
+
+    @property
+    def roots(self) -> list[WorkspaceRoot]:
+        return [self.disk] + ([self.tmpfs] if self.tmpfs else [])
+
+    @property
+    def reserved(self) -> int:
+        return sum(root.reserved for root in self.roots)
+
+    def _choose_root(self, size: int, small: bool) -> Optional[WorkspaceRoot]:
+        if small and self.tmpfs is not None and self.tmpfs.reserved + size <= self.tmpfs.quota:
+            return self.tmpfs
+        if self.disk.reserved + size <= self.disk.quota:
+            return self.disk
+        return None
+
+    def allocate(self, name: str, estimated_bytes: Optional[int] = None) -> JobDir:
+        """Reserve space and create a directory for one download; blocks while over quota."""
+        size = int(estimated_bytes or self.default_reservation)
+        small = estimated_bytes is not None and estimated_bytes <= self.tmpfs_max_bytes
+        if size > self.disk.quota and not (small and self.tmpfs is not None):
+            raise WorkspaceFullError(f"Файл слишком большой для загрузки: ~{size / 1024 / 1024:.0f} МБ.")
+        deadline = time.monotonic() + self.wait_timeout
+        with self._changed:
+            root = self._choose_root(size, small)
+            if root is None:
+                logger.info(f"Нет места под загрузку {name} (~{size} байт, занято {self.reserved}), ожидание...")
+            while root is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise WorkspaceFullError("Сейчас на сервере не хватает места для загрузки. Попробуйте позже.")
+                self._changed.wait(remaining)
+                root = self._choose_root(size, small)
+            root.reserved += size
+            path = os.path.join(root.path, f"{name}-{uuid.uuid4().hex[:6]}")
+            job = JobDir(self, root, path, size)
+            self._active[path] = job
+        try:
+            os.makedirs(path)
+        except OSError:
+            self.release(job)
+            raise
+        return job
+
+    def commit(self, job: JobDir) -> None:
+        """Keep the finished download and account for its real size instead of the estimate."""
+        actual = dir_size(job.path)
+        if not actual:
+            # Ничего не записано (например, файл передается потоком) - папка не нужна
+            self.release(job)
+            return
+        with self._changed:
+            job.root.reserved += actual - job.reserved
+            job.reserved = actual
+            self._changed.notify_all()
+
+    def release(self, job: JobDir) -> None:
+        """Delete the job directory and free its reservation."""
+        with self._changed:
+            if self._active.pop(job.path, None) is not None:
+                job.root.reserved -= job.reserved
+            self._changed.notify_all()
+        shutil.rmtree(job.path, ignore_errors=True)
+
+    def _under_root(self, directory: str) -> bool:
+        return any(os.path.dirname(directory) == root.path for root in self.roots)
+
+    def remove(self, filename: str) -> bool:
+        """Remove a downloaded file together with its job directory; False if it was already gone."""
+        directory = os.path.dirname(os.path.abspath(filename))
+        existed = os.path.exists(filename)
+        job = self._active.get(directory)
+        if job is not None:
+            self.release(job)
+        elif self._under_root(directory):
+            # Папка создана в другом процессе (пул процессов) - резерва здесь нет, только удаляем
+            shutil.rmtree(directory, ignore_errors=True)
+        elif existed:
+            os.remove(filename)
+        return existed
+
+    def usage(self) -> int:
+        """Bytes on disk in all workspace roots and extra directories."""
+        return sum(dir_size(path) for path in (*[root.path for root in self.roots], *self.extra_dirs))
+
+    def sweep(self) -> int:
+        """Delete job directories and extra files older than stale_after that no download owns."""
+        cutoff = time.time() - self.stale_after
+        removed = 0
+        for base in (*[root.path for root in self.roots], *self.extra_dirs):
+            if not os.path.isdir(base):
+                continue
+            for entry in os.scandir(base):
+                try:
+                    if entry.path in self._active or entry.path in self.extra_dirs:
+                        continue
+                    if entry.stat().st_mtime >= cutoff:
+                        continue
+                    if entry.is_dir():
+                        shutil.rmtree(entry.path, ignore_errors=True)
+                    else:
+                        os.remove(entry.path)
+                    removed += 1
+                except OSError as e:
+                    logger.warning(f"Уборщик не смог удалить {entry.path}: {e}")
+        if removed:
+            logger.info(f"Уборщик удалил устаревших временных файлов и папок: {removed}")
+        return removed
+
+    async def run_janitor(self, interval: float) -> None:
+        """Background task: sweep stale artifacts at start and then every interval."""
+        while True:
+            try:
+                await asyncio.to_thread(self.sweep)
+            except Exception as e:
+                logger.error(f"Ошибка уборки временных файлов: {e}", exc_info=True)
+            await asyncio.sleep(interval)
+
+
+workspace = Workspace.from_env()
+metrics.registry.gauge("bot_temp_disk_bytes", "Bytes taken by download temp files.", workspace.usage)
+metrics.registry.gauge("bot_workspace_reserved_bytes", "Scratch space reserved by running downloads.",
+                       lambda: workspace.reserved)
@@ -0,0 +1,100 @@
+"""Measures how long each module takes to import at startup.
+
+Import it before anything else in an entry point; report() logs the slowest packages
+and stops measuring. Set IMPORT_PROFILE=0 in the process environment to disable.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+
+class _TimedLoader:
+    def __init__(self, loader, name: str, profiler: "ImportProfiler"):
+        self._loader = loader
+        self._name = name
+        self._profiler = profiler
+
+    def __getattr__(self, attr: str):
+        return getattr(self._loader, attr)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module) -> None:
+        # Модулю возвращаем настоящий загрузчик: некоторые библиотеки проверяют его тип
+        module.__loader__ = self._loader
+        if module.__spec__ is not None:
+            module.__spec__.loader = self._loader
+        self._profiler.run(self._name, self._loader.exec_module, module)
+
+
+class ImportProfiler:
+    """Meta path finder that wraps loaders and records each module's own import time."""
+
+    def __init__(self):
+        self.self_seconds: dict[str, float] = {}
+        self._local = threading.local()
+
+    def find_spec(self, fullname: str, path=None, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                    spec.loader = _TimedLoader(spec.loader, fullname, self)
+                return spec
+        return None
+
+    def run(self, name: str, exec_module, module) -> None:
+        # Время вложенных импортов вычитается, чтобы у модуля осталось только свое
+        stack = self._local.__dict__.setdefault("stack", [])
+        stack.append(0.0)
+        started = time.perf_counter()
+        try:
+            exec_module(module)
+        finally:
+            elapsed = time.perf_counter() - started
+            children = stack.pop()
+            self.self_seconds[name] = elapsed - children
+            if stack:
+                stack[-1] += elapsed
+
+    def install(self) -> None:
+        if self not in sys.meta_path:
+            sys.meta_path.insert(0, self)
+
+    def uninstall(self) -> None:
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    def by_package(self) -> dict[str, float]:
+        """Own import time grouped by top-level package; the bot's modules are listed one by one."""
+        totals: dict[str, float] = defaultdict(float)
+        for name, seconds in self.self_seconds.items():
+            totals[name if name.startswith("handlers.") else name.partition(".")[0]] += seconds
+        return dict(totals)
+
+    def report(self, top: int = 10) -> None:
+        """Log the total import time and the slowest packages, then stop measuring."""
+        self.uninstall()
+        if not self.self_seconds:
+            return
+        totals = sorted(self.by_package().items(), key=lambda item: item[1], reverse=True)
+        slowest = ", ".join(f"{name} {seconds:.3f} с" for name, seconds in totals[:top])
+        logger.info(f"Импорт модулей при запуске: {sum(self.self_seconds.values()):.2f} с "
+                    f"({len(self.self_seconds)} модулей). Дольше всего: {slowest}")
+
+
+profiler = ImportProfiler()
+if os.getenv("IMPORT_PROFILE", "1").lower() not in ("0", "false", "no", "off"):
+    profiler.install()
+
+
+def report(top: int = 10) -> None:
+    profiler.report(top)
@@ -1,13 +1,24 @@
+import import_profile  # Первым: замеряет время импорта всех модулей ниже
+
 import asyncio
 import logging
 import os
+import signal
 
 from aiogram import Bot, Dispatcher
-from aiogram.client.default import DefaultBotProperties
 from aiogram.fsm.storage.memory import MemoryStorage
 from dotenv import load_dotenv
 
-from handlers import router # Убедитесь, что этот импорт корректен и указывает на ваш основной роутер
+from handlers import config, router # Убедитесь, что этот импорт корректен и указывает на ваш основной роутер
+from handlers.botapi import create_bot
+from handlers.downloader import spotify_service
+from handlers.executor import download_executor
+from handlers.lazy import warm_up
+from handlers.metrics import start_metrics_server
+from handlers.postprocess import postprocessor
+from handlers.reports import admin_digest
+from handlers.shutdown import request_tracker
+from handlers.workspace import workspace
 
 # Настраиваем базовое логирование как можно раньше
 logging.basicConfig(
@@ -16,7 +27,74 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+
+async def run_polling(bot: Bot, dp: Dispatcher) -> None:
+    """Long polling - удобно для разработки и запуска на одной машине."""
+    # Если ранее был установлен вебхук, Telegram не отдаст обновления через getUpdates
+    await bot.delete_webhook(drop_pending_updates=False)
+    logger.info("Запуск поллинга бота...")
+    await dp.start_polling(bot)
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher) -> None:
+    """Webhook: aiohttp сервер принимает обновления и сразу отвечает Telegram, обработка идет в фоне."""
+    from aiohttp import web
+    from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+    webhook_url = config.WEBHOOK_URL
+    webhook_path = config.WEBHOOK_PATH
+    webhook_secret = config.WEBHOOK_SECRET or None
+    host = config.WEBHOOK_HOST
+    port = config.WEBHOOK_PORT
+
+    if not webhook_url:
+        raise RuntimeError("Для BOT_MODE=webhook нужна переменная окружения WEBHOOK_URL (публичный адрес бота).")
+    if not webhook_secret:
+        logger.warning("WEBHOOK_SECRET не задан: запросы к вебхуку не проверяются на подлинность!")
+
+    app = web.Application()
+    # handle_in_background: Telegram получает 200 сразу, а загрузка идет в отдельной задаче
+    SimpleRequestHandler(
+        dispatcher=dp, bot=bot, secret_token=webhook_secret, handle_in_background=True,
+    ).register(app, path=webhook_path)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    await bot.set_webhook(
+        f"{webhook_url.rstrip('/')}{webhook_path}",
+        secret_token=webhook_secret,
+        allowed_updates=dp.resolve_used_update_types(),
+    )
+    logger.info(f"Вебхук установлен: {webhook_url.rstrip('/')}{webhook_path}, сервер слушает {host}:{port}")
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:  # Windows
+            pass
+    try:
+        await stop_event.wait()
+        logger.info("Получен сигнал остановки, новые обновления больше не принимаются.")
+        await site.stop()
+        await request_tracker.drain(config.SHUTDOWN_DRAIN_TIMEOUT)
+    finally:
+        # Закрывает и сессию бота (SimpleRequestHandler.close)
+        await runner.cleanup()
+
+
+async def warm_up_later(delay: float) -> None:
+    """Загружает yt-dlp и экстракторы в фоне, пока бот уже отвечает, чтобы первый запрос не ждал."""
+    await asyncio.sleep(delay)
+    await asyncio.to_thread(warm_up)
+
+
 async def run_bot():
+    import_profile.report()
     logger.info("Загрузка переменных окружения...")
     load_dotenv() # Загружаем переменные из .env файла
 
@@ -28,10 +106,19 @@ async def run_bot():
         return
 
     logger.info("Инициализация бота и диспетчера...")
-    bot = Bot(token=TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
+    bot = create_bot(TOKEN)
     storage = MemoryStorage()
     dp = Dispatcher(storage=storage)
     dp.include_router(router) # Подключаем роутеры из handlers
+    dp.update.outer_middleware(request_tracker) # Учитываем обрабатываемые обновления для плавной остановки
+
+    warmup_tasks: list[asyncio.Task] = []
+    if config.WARMUP_ENABLED:
+        async def start_warm_up() -> None:
+            # Вызывается, когда поллинг или вебхук уже принимают обновления
+            warmup_tasks.append(asyncio.create_task(warm_up_later(config.WARMUP_DELAY)))
+
+        dp.startup.register(start_warm_up)
 
     # Отправка приветственного сообщения администратору
     if ADMIN_ID_STR:
@@ -53,12 +140,37 @@ async def run_bot():
             "Приветственное сообщение администратору не будет отправлено."
         )
 
-    logger.info("Запуск поллинга бота...")
+    bot_mode = config.BOT_MODE
+    metrics_runner = None
+    # Сводка администратору отправляется в фоне и никогда не задерживает ответы пользователям
+    digest_task = asyncio.create_task(admin_digest.run(bot))
+    # Уборщик удаляет временные файлы, оставшиеся после сбоев и прерванных загрузок
+    janitor_task = asyncio.create_task(workspace.run_janitor(config.WORKSPACE_JANITOR_INTERVAL))
     try:
-        await dp.start_polling(bot)
+        if config.METRICS_PORT:
+            metrics_runner = await start_metrics_server(config.METRICS_HOST, config.METRICS_PORT)
+        if bot_mode == "webhook":
+            await run_webhook(bot, dp)
+        else:
+            await run_polling(bot, dp)
+            # Поллинг остановлен, но начатые загрузки и отправки доводим до конца
+            await request_tracker.drain(config.SHUTDOWN_DRAIN_TIMEOUT)
     except Exception as e:
-        logger.critical(f"Критическая ошибка во время поллинга: {e}", exc_info=True)
+        logger.critical(f"Критическая ошибка во время работы бота ({bot_mode}): {e}", exc_info=True)
     finally:
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        digest_task.cancel()  # Перед остановкой отправляет накопленную сводку
+        await asyncio.gather(digest_task, return_exceptions=True)
+        janitor_task.cancel()
+        await asyncio.gather(janitor_task, return_exceptions=True)
+        for task in warmup_tasks:
+            task.cancel()
+        await asyncio.gather(*warmup_tasks, return_exceptions=True)
+        logger.info("Остановка пула загрузок...")
+        download_executor.shutdown(wait=False)
+        postprocessor.shutdown()
+        spotify_service.close()
         logger.info("Остановка бота. Закрытие сессии...")
         await bot.session.close()
         logger.info("Сессия бота успешно закрыта.")
@@ -0,0 +1,150 @@
+import time
+
+import pytest
+
+from handlers import jobqueue
+from handlers.executor import QueueFullError
+from handlers.jobqueue import SQLiteJobQueue
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "jobs.sqlite3")
+
+
+@pytest.fixture
+def queue(path):
+    return SQLiteJobQueue(path)
+
+
+def expire_lease(queue: SQLiteJobQueue, job_id: int) -> None:
+    queue._conn.execute("UPDATE jobs SET lease_until = ? WHERE id = ?", (time.time() - 1, job_id))
+
+
+def test_lease_takes_oldest_job_once(queue):
+    first = queue.enqueue(1, {"text": "a"})
+    second = queue.enqueue(2, {"text": "b"})
+
+    job = queue.lease("A", 60)
+    assert (job.id, job.user_id, job.payload, job.attempts) == (first, 1, {"text": "a"}, 1)
+    assert queue.lease("B", 60).id == second
+    assert queue.lease("C", 60) is None
+
+
+def test_lease_prefers_users_with_fewer_running_jobs(queue):
+    queue.enqueue(1, {})
+    queue.enqueue(1, {})
+    other = queue.enqueue(2, {})
+
+    queue.lease("A", 60)
+    assert queue.lease("B", 60).id == other
+
+
+def test_expired_lease_goes_to_another_worker(queue):
+    job_id = queue.enqueue(1, {})
+    queue.lease("A", 60)
+    assert queue.lease("B", 60) is None
+
+    expire_lease(queue, job_id)
+    job = queue.lease("B", 60)
+    assert job.id == job_id
+    assert job.attempts == 2
+    assert not queue.extend(job_id, "A", 60)
+    assert queue.extend(job_id, "B", 60)
+
+
+def test_expired_lease_without_attempts_left_fails(queue):
+    job_id = queue.enqueue(1, {}, max_attempts=1)
+    queue.lease("A", 60)
+    expire_lease(queue, job_id)
+
+    assert queue.lease("B", 60) is None
+    assert queue.stats() == {"failed": 1}
+
+
+def test_ack_and_fail_require_lease_owner(path):
+    # Два воркера с отдельными подключениями к одному файлу, как два процесса worker.py
+    worker_a, worker_b = SQLiteJobQueue(path), SQLiteJobQueue(path)
+    job_id = worker_a.enqueue(1, {})
+    worker_a.lease("A", 60)
+    expire_lease(worker_a, job_id)
+    assert worker_b.lease("B", 60).id == job_id
+
+    assert not worker_a.fail(job_id, "A", "ошибка")
+    assert not worker_a.fail(job_id, "A", "ошибка", retry=False)
+    assert not worker_a.ack(job_id, "A")
+    assert not worker_a.release(job_id, "A")
+    assert worker_b.stats() == {"leased": 1}
+    assert worker_b.ack(job_id, "B")
+    assert worker_b.stats() == {"done": 1}
+
+
+def test_fail_retries_until_max_attempts(queue, monkeypatch):
+    monkeypatch.setattr(jobqueue, "RETRY_BACKOFF", 0.0)
+    job_id = queue.enqueue(1, {}, max_attempts=2)
+
+    queue.lease("A", 60)
+    assert queue.fail(job_id, "A", "ошибка")
+    assert queue.lease("A", 60).attempts == 2
+    assert not queue.fail(job_id, "A", "ошибка")
+    assert queue.stats() == {"failed": 1}
+
+
+def test_fail_waits_for_backoff_and_retry_after(queue):
+    job_id = queue.enqueue(1, {})
+    queue.lease("A", 60)
+    assert queue.fail(job_id, "A", "ошибка", retry_after=3600)
+
+    (available_at,) = queue._conn.execute("SELECT available_at FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    assert available_at > time.time() + 3500
+    assert queue.lease("A", 60) is None
+
+
+def test_fail_without_retry_is_final(queue):
+    job_id = queue.enqueue(1, {})
+    queue.lease("A", 60)
+
+    assert not queue.fail(job_id, "A", "ошибка", retry=False)
+    assert queue.stats() == {"failed": 1}
+
+
+def test_release_does_not_use_attempt(queue):
+    job_id = queue.enqueue(1, {}, max_attempts=1)
+    for _ in range(3):
+        job = queue.lease("A", 60)
+        assert job.attempts == 1
+        assert queue.release(job_id, "A")
+    assert queue.stats() == {"queued": 1}
+
+
+def test_enqueue_respects_max_depth(queue):
+    queue.enqueue(1, {}, max_depth=2)
+    queue.enqueue(1, {}, max_depth=2)
+
+    with pytest.raises(QueueFullError):
+        queue.enqueue(1, {}, max_depth=2)
+    assert queue.pending_count() == 2
+    # Взятые воркером задания в глубину очереди не входят
+    queue.lease("A", 60)
+    queue.enqueue(1, {}, max_depth=2)
+
+
+def test_cancel_queued_skips_leased_jobs(queue):
+    queue.enqueue(1, {"text": "a"})
+    queue.enqueue(1, {"text": "b"})
+    queue.enqueue(2, {"text": "c"})
+    queue.lease("A", 60)
+
+    assert queue.cancel_queued(1) == [{"text": "b"}]
+    assert queue.stats() == {"leased": 1, "cancelled": 1, "queued": 1}
+
+
+def test_purge_removes_only_old_finished_jobs(queue):
+    done = queue.enqueue(1, {})
+    queue.enqueue(1, {})
+    queue.lease("A", 60)
+    queue.ack(done, "A")
+
+    assert queue.purge(3600) == 0
+    assert queue.purge(-1) == 1
+    assert queue.stats() == {"queued": 1}
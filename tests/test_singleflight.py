@@ -0,0 +1,124 @@
+import asyncio
+from typing import Optional
+
+import pytest
+
+from handlers.executor import JobCancelledError
+from handlers.singleflight import SingleFlight
+
+
+class Download:
+    """Factory for SingleFlight.join that finishes only when the test allows it."""
+
+    def __init__(self, result="file.mp4"):
+        self.result = result
+        self.started = 0
+        self.cancelled = False
+        self.cleaned: list = []
+        self.finish: Optional[asyncio.Event] = None
+
+    async def __call__(self, context):
+        self.started += 1
+        try:
+            await self.finish.wait()
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if isinstance(self.result, BaseException):
+            raise self.result
+        return self.result
+
+    def cleanup(self, result):
+        self.cleaned.append(result)
+
+
+def run(test):
+    async def main():
+        download = Download()
+        download.finish = asyncio.Event()
+        await test(SingleFlight(), download)
+    asyncio.run(main())
+
+
+def test_waiters_share_one_download_and_last_release_cleans_up():
+    async def test(flights, download):
+        first = flights.join("YouTube:id", download, download.cleanup)
+        second = flights.join("YouTube:id", download, download.cleanup)
+        assert first is second and len(flights) == 1
+
+        download.finish.set()
+        results = await asyncio.gather(flights.wait(first, 1), flights.wait(second, 2))
+        assert results == ["file.mp4", "file.mp4"] and download.started == 1
+
+        flights.release(first)
+        assert download.cleaned == []
+        flights.release(second)
+        assert download.cleaned == ["file.mp4"] and len(flights) == 0
+    run(test)
+
+
+def test_cancel_user_detaches_only_that_user():
+    async def test(flights, download):
+        flight = flights.join("YouTube:id", download, download.cleanup)
+        flights.join("YouTube:id", download, download.cleanup)
+        first = asyncio.create_task(flights.wait(flight, 1))
+        second = asyncio.create_task(flights.wait(flight, 2))
+        await asyncio.sleep(0)
+
+        assert flights.cancel_user(1) == 1
+        with pytest.raises(JobCancelledError):
+            await first
+        assert not download.cancelled and flight.waiters == 1
+
+        download.finish.set()
+        assert await second == "file.mp4"
+        flights.release(flight)
+        assert download.cleaned == ["file.mp4"]
+    run(test)
+
+
+def test_download_is_cancelled_when_last_waiter_leaves():
+    async def test(flights, download):
+        flight = flights.join("YouTube:id", download, download.cleanup)
+        waiter = asyncio.create_task(flights.wait(flight, 1))
+        await asyncio.sleep(0)
+
+        assert flights.cancel_user(1) == 1
+        with pytest.raises(JobCancelledError):
+            await waiter
+        await asyncio.gather(flight.task, return_exceptions=True)
+        assert download.cancelled and len(flights) == 0 and download.cleaned == []
+    run(test)
+
+
+def test_cancelled_waiter_task_releases_its_reference():
+    async def test(flights, download):
+        flight = flights.join("YouTube:id", download, download.cleanup)
+        flights.join("YouTube:id", download, download.cleanup)
+        waiter = asyncio.create_task(flights.wait(flight, 1))
+        await asyncio.sleep(0)
+
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert flight.waiters == 1 and not download.cancelled
+        flights.release(flight)
+        await asyncio.gather(flight.task, return_exceptions=True)
+        assert download.cancelled
+    run(test)
+
+
+def test_failed_download_is_retried_by_the_next_join():
+    async def test(flights, download):
+        download.result = RuntimeError("HTTP Error 503")
+        flight = flights.join("YouTube:id", download, download.cleanup)
+        download.finish.set()
+        with pytest.raises(RuntimeError):
+            await flights.wait(flight, 1)
+        assert len(flights) == 0 and flight.waiters == 0
+
+        download.result = "file.mp4"
+        retry = await flights.acquire("YouTube:id", download, download.cleanup)
+        assert retry is not flight and retry.result == "file.mp4" and download.started == 2
+        flights.release(retry)
+        assert download.cleaned == ["file.mp4"]
+    run(test)
@@ -0,0 +1,77 @@
+import pytest
+
+from handlers.urls import extract_links, parse_link
+
+
+@pytest.mark.parametrize("url", [
+    "https://www.youtube.com/watch?v=dQw4w9WgXcQ&si=abc",
+    "youtube.com/watch?v=dQw4w9WgXcQ",
+    "https://m.youtube.com/watch?v=dQw4w9WgXcQ&list=PL123",
+    "https://youtu.be/dQw4w9WgXcQ?si=abc",
+    "https://music.youtube.com/watch?v=dQw4w9WgXcQ",
+])
+def test_youtube_links_share_one_key(url):
+    link = parse_link(url)
+    assert link.platform == "YouTube"
+    assert link.key == "YouTube:dQw4w9WgXcQ"
+    assert link.url == "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+    assert not link.playlist
+
+
+def test_youtube_shorts_keep_their_url():
+    link = parse_link("https://youtube.com/shorts/dQw4w9WgXcQ?feature=share")
+    assert (link.url, link.key) == ("https://www.youtube.com/shorts/dQw4w9WgXcQ", "YouTube:dQw4w9WgXcQ")
+
+
+@pytest.mark.parametrize("url, expected", [
+    ("https://www.youtube.com/playlist?list=PL123", "https://www.youtube.com/playlist?list=PL123"),
+    ("https://www.youtube.com/@channel/shorts", "https://www.youtube.com/@channel/shorts"),
+])
+def test_youtube_playlists(url, expected):
+    link = parse_link(url)
+    assert link.playlist and link.url == expected
+
+
+@pytest.mark.parametrize("url, key, clean_url", [
+    ("https://x.com/user/status/123456?s=20", "X:123456", "https://x.com/user/status/123456"),
+    ("https://www.tiktok.com/@user/video/7123?is_from_webapp=1", "TikTok:7123",
+     "https://www.tiktok.com/@user/video/7123"),
+    ("https://www.instagram.com/reel/AbC-1_x/?igsh=xyz", "Instagram:AbC-1_x", "https://www.instagram.com/reel/AbC-1_x"),
+    ("https://in.pinterest.com/pin/some-title--98765/sent/?invite_code=x", "Pinterest:98765",
+     "https://www.pinterest.com/pin/98765/"),
+    ("https://open.spotify.com/intl-de/track/4uLU6hMCjMI75M1A2tKUQC?si=1", "Spotify:4uLU6hMCjMI75M1A2tKUQC",
+     "https://open.spotify.com/track/4uLU6hMCjMI75M1A2tKUQC"),
+])
+def test_links_are_canonicalized(url, key, clean_url):
+    link = parse_link(url)
+    assert (link.key, link.url) == (key, clean_url)
+
+
+@pytest.mark.parametrize("url", ["https://pin.it/abc123", "https://vt.tiktok.com/ZSabc/",
+                                 "https://www.tiktok.com/t/ZTabc/"])
+def test_short_links_are_marked(url):
+    link = parse_link(url)
+    assert link.short and link.content_id is None
+
+
+@pytest.mark.parametrize("url", [
+    "https://example.com/watch?v=dQw4w9WgXcQ",
+    "https://www.youtube.com/watch?v=short",
+    "https://www.youtube.com/",
+    "https://x.com/user",
+    "https://pin.it/",
+    "https://open.spotify.com/album/123",
+    "https://notyoutube.com/watch?v=dQw4w9WgXcQ",
+])
+def test_unsupported_links(url):
+    assert parse_link(url) is None
+
+
+def test_extract_links_in_order_without_duplicates():
+    text = ("Смотри: https://youtu.be/dQw4w9WgXcQ, и еще (https://x.com/user/status/1). "
+            "Повтор www.youtube.com/watch?v=dQw4w9WgXcQ!")
+    assert [link.key for link in extract_links(text)] == ["YouTube:dQw4w9WgXcQ", "X:1"]
+
+
+def test_extract_links_from_empty_text():
+    assert extract_links("") == [] and extract_links(None) == []
@@ -0,0 +1,162 @@
+import import_profile  # Первым: замеряет время импорта всех модулей ниже
+
+import asyncio
+import logging
+import os
+import signal
+import socket
+import uuid
+
+from aiogram import Bot
+from dotenv import load_dotenv
+
+from handlers import config
+from handlers.botapi import create_bot
+from handlers.downloader import spotify_service
+from handlers.executor import download_executor
+from handlers.jobqueue import JobQueue, QueuedJob, job_queue
+from handlers.lazy import warm_up
+from handlers.metrics import start_metrics_server
+from handlers.pipeline import LinkRequest, RetryLaterError, process_link
+from handlers.postprocess import postprocessor
+from handlers.reports import admin_digest
+from handlers.workspace import workspace
+
+# Настраиваем базовое логирование как можно раньше
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# Выполненные и упавшие задания старше суток удаляются из очереди при запуске воркера
+FINISHED_JOBS_RETENTION = 24 * 60 * 60
+
+
+async def keep_lease(queue: JobQueue, job: QueuedJob, worker_id: str) -> None:
+    """Extend the lease while the job runs, so long downloads are not handed to another worker."""
+    while True:
+        await asyncio.sleep(config.JOB_VISIBILITY_TIMEOUT / 3)
+        extended = await asyncio.to_thread(queue.extend, job.id, worker_id, config.JOB_VISIBILITY_TIMEOUT)
+        if not extended:
+            logger.warning(f"Аренда задания #{job.id} потеряна, его может выполнить другой воркер.")
+            return
+
+
+async def handle_job(bot: Bot, queue: JobQueue, job: QueuedJob, worker_id: str) -> None:
+    request = LinkRequest(**job.payload)
+    logger.info(f"Воркер {worker_id} взял задание #{job.id} (попытка {job.attempts}/{job.max_attempts}).")
+    heartbeat = asyncio.create_task(keep_lease(queue, job, worker_id))
+    try:
+        # Ошибки process_link сам сообщает пользователю; временную ошибку загрузки он оставляет
+        # очереди, пока у задания есть попытки
+        await process_link(bot, request, retry_transient=job.attempts < job.max_attempts)
+    except asyncio.CancelledError:
+        # Воркер останавливается - отдаем задание другому воркеру, попытка не засчитывается
+        if await asyncio.to_thread(queue.release, job.id, worker_id):
+            logger.info(f"Задание #{job.id} возвращено в очередь: воркер остановлен.")
+        raise
+    except RetryLaterError as e:
+        # Раньше TTL негативного кэша повтор на этом воркере получил бы ту же ошибку из кэша
+        will_retry = await asyncio.to_thread(queue.fail, job.id, worker_id, str(e),
+                                             retry_after=config.NEGATIVE_CACHE_TRANSIENT_TTL)
+        if will_retry:
+            logger.info(f"Задание #{job.id} будет повторено: {e}")
+        else:
+            logger.warning(f"Задание #{job.id} не возвращено в очередь: аренда уже истекла.")
+    except Exception as e:
+        logger.error(f"Задание #{job.id} завершилось ошибкой: {e}", exc_info=True)
+        will_retry = await asyncio.to_thread(queue.fail, job.id, worker_id, str(e))
+        if not will_retry:
+            try:
+                await bot.edit_message_text(f"⚠️ Произошла ошибка: {e}", chat_id=request.chat_id,
+                                            message_id=request.status_message_id)
+            except Exception as e_edit:
+                logger.warning(f"Не удалось сообщить пользователю об ошибке задания #{job.id}: {e_edit}")
+    else:
+        if not await asyncio.to_thread(queue.ack, job.id, worker_id):
+            logger.warning(f"Задание #{job.id} выполнено, но аренда уже истекла - возможен повтор.")
+    finally:
+        heartbeat.cancel()
+
+
+async def consume(bot: Bot, queue: JobQueue, worker_id: str, stop_event: asyncio.Event) -> None:
+    while not stop_event.is_set():
+        job = await asyncio.to_thread(queue.lease, worker_id, config.JOB_VISIBILITY_TIMEOUT)
+        if job is None:
+            try:
+                await asyncio.wait_for(stop_event.wait(), config.WORKER_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        await handle_job(bot, queue, job, worker_id)
+
+
+async def run_worker():
+    import_profile.report()
+    load_dotenv()
+    TOKEN = os.getenv("TOKEN")
+    if not TOKEN:
+        logger.critical("Переменная окружения TOKEN не установлена! Воркер не может быть запущен.")
+        return
+    if job_queue is None:
+        logger.critical("Очередь заданий не настроена (JOB_QUEUE), воркеру нечего обрабатывать.")
+        return
+
+    bot = create_bot(TOKEN)
+    base_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    purged = await asyncio.to_thread(job_queue.purge, FINISHED_JOBS_RETENTION)
+    if purged:
+        logger.info(f"Удалено старых заданий из очереди: {purged}")
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:  # Windows
+            pass
+
+    # Каждый воркер отдает свои метрики; при нескольких воркерах на машине задайте им разные METRICS_PORT
+    metrics_runner = await start_metrics_server(config.METRICS_HOST, config.METRICS_PORT) \
+        if config.METRICS_PORT else None
+    digest_task = asyncio.create_task(admin_digest.run(bot))
+    # Уборщик удаляет временные файлы, оставшиеся после сбоев и прерванных загрузок
+    janitor_task = asyncio.create_task(workspace.run_janitor(config.WORKSPACE_JANITOR_INTERVAL))
+    # Воркер только качает, поэтому yt-dlp загружаем сразу, пока ждем первое задание
+    warmup_task = asyncio.create_task(asyncio.to_thread(warm_up)) if config.WARMUP_ENABLED else None
+    consumers = [
+        asyncio.create_task(consume(bot, job_queue, f"{base_id}/{number}", stop_event))
+        for number in range(max(1, config.WORKER_CONCURRENCY))
+    ]
+    logger.info(f"Воркер {base_id} запущен, одновременных заданий: {len(consumers)}")
+    try:
+        await stop_event.wait()
+        logger.info("Получен сигнал остановки, новые задания больше не берутся.")
+        # Начатые задания доводим до конца, но не дольше SHUTDOWN_DRAIN_TIMEOUT
+        done, running = await asyncio.wait(consumers, timeout=config.SHUTDOWN_DRAIN_TIMEOUT)
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*consumers, return_exceptions=True)
+    finally:
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        digest_task.cancel()
+        await asyncio.gather(digest_task, return_exceptions=True)
+        janitor_task.cancel()
+        await asyncio.gather(janitor_task, return_exceptions=True)
+        if warmup_task is not None:
+            warmup_task.cancel()
+            await asyncio.gather(warmup_task, return_exceptions=True)
+        download_executor.shutdown(wait=False)
+        postprocessor.shutdown()
+        spotify_service.close()
+        await bot.session.close()
+        logger.info(f"Воркер {base_id} остановлен.")
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(run_worker())
+    except KeyboardInterrupt:
+        logger.info("Воркер остановлен вручную (Ctrl+C).")